@@ -1,5 +1,5 @@
 import os
-from flask import Flask, session
+from flask import Flask, g, request, session, url_for
 from .config import Config
 
 def create_app():
@@ -15,9 +15,49 @@ def create_app():
     # Charger la configuration
     app.config.from_object(Config)
 
-    # Initialisation du stockage Google Sheets
+    # Initialisation du stockage Google Sheets : pas d'appel réseau ici, pour que
+    # l'application puisse être préchargée dans le maître gunicorn. Les workers
+    # vérifient les feuilles après le fork (gunicorn.conf.py) ; à défaut, à la
+    # première requête du processus.
     from .models import storage_gsheets as storage
-    storage.init_all_files()
+
+    from .utils import metriques
+
+    @app.before_request
+    def initialiser_stockage():
+        metriques.debut_requete()
+        storage.debut_requete()
+        storage.assurer_initialisation()
+
+    @app.after_request
+    def mesurer_requete(response):
+        metriques.fin_requete(request.endpoint, request.method, response.status_code)
+        return response
+
+    # Profilage à la demande : ?profil=1 ou en-tête X-Profil: 1, administrateurs seulement
+    from .utils import profilage
+
+    def _infos_profil(statut):
+        return {"methode": request.method, "chemin": request.full_path.rstrip("?"),
+                "route": request.endpoint, "statut": statut, "utilisateur": session.get("user")}
+
+    @app.before_request
+    def demarrer_profil():
+        demande = request.args.get("profil") == "1" or request.headers.get("X-Profil") == "1"
+        if demande and session.get("role") == "admin" and not profilage.demarrer():
+            app.logger.info("Profil ignoré : un autre profil est en cours dans ce worker")
+
+    @app.after_request
+    def terminer_profil(response):
+        if profilage.en_cours():
+            id_profil = profilage.terminer(_infos_profil(response.status_code))
+            response.headers["X-Profil"] = url_for("profils.detail", id_profil=id_profil)
+        return response
+
+    @app.teardown_request
+    def abandonner_profil(exc):
+        if profilage.en_cours():  # exception non gérée : after_request n'a pas été appelé
+            profilage.terminer(_infos_profil(500))
 
     # Import des blueprints existants
     from .routes.auth import auth_bp
@@ -28,6 +68,9 @@ def create_app():
     from .routes.categories import categories_bp
     from .routes.inscription import inscription_bp  # <- Import du nouveau blueprint
     from .routes.travaux import travaux_bp  # <- Import du blueprint travaux
+    from .routes.taches import taches_bp  # <- File des rapports / exports en arrière-plan
+    from .routes.metriques import metriques_bp  # <- /metrics (Prometheus, admin)
+    from .routes.profils import profils_bp  # <- Profils de requêtes (admin)
 
 
     # Enregistrement des blueprints
@@ -39,12 +82,42 @@ def create_app():
     app.register_blueprint(categories_bp, url_prefix="/categories")
     app.register_blueprint(inscription_bp, url_prefix="/inscription")  # <- Enregistrement
     app.register_blueprint(travaux_bp, url_prefix="/travaux")  # <- Enregistrement blueprint travaux
+    app.register_blueprint(taches_bp, url_prefix="/taches")
+    app.register_blueprint(metriques_bp)
+    app.register_blueprint(profils_bp, url_prefix="/profils")
 
 
     # Création automatique de l'administrateur par défaut
     from .models.user import create_admin_default
     create_admin_default()
 
+    # Clé d'idempotence à placer dans les formulaires de paiement / dépense
+    from .utils.idempotence import nouvelle_cle
+    app.jinja_env.globals["cle_idempotence"] = nouvelle_cle
+
+    # Quota Google Sheets épuisé ou service en panne : indiquer le délai plutôt qu'une erreur 500.
+    # Un formulaire envoyé revient sur sa page d'origine avec le message ; une page
+    # consultée (GET) reçoit une page 503 : la rediriger vers sa page précédente,
+    # elle-même souvent lectrice de Sheets (tableau de bord), bouclerait tant que
+    # le quota est épuisé.
+    from .utils.quota import QuotaDepasse
+    from .utils.disjoncteur import ServiceIndisponible
+
+    @app.errorhandler(QuotaDepasse)
+    @app.errorhandler(ServiceIndisponible)
+    def quota_depasse(e):
+        from flask import flash, jsonify, make_response, redirect, render_template, request
+        if request.is_json or request.args.get("format") == "json":
+            reponse = jsonify({"status": "error", "message": str(e), "attente": e.attente})
+            reponse.status_code = 503
+        elif request.method == "POST" and request.referrer and request.referrer != request.url:
+            flash(str(e), "warning")
+            reponse = redirect(request.referrer)
+        else:
+            reponse = make_response(render_template("indisponible.html", message=str(e), attente=e.attente), 503)
+        reponse.headers["Retry-After"] = str(e.attente)
+        return reponse
+
     # Injection de current_user pour les templates
     @app.context_processor
     def inject_user():
@@ -63,4 +136,17 @@ def create_app():
         )
         return dict(current_user=user)
 
+    # Bandeau de mode dégradé (Sheets en panne, données périmées, écritures en attente).
+    # Calculé une fois par requête (flask.g) : le processeur de contexte tourne à
+    # chaque render_template de la requête.
+    @app.context_processor
+    def inject_etat_stockage():
+        if "etat_stockage" not in g:
+            try:
+                g.etat_stockage = storage.etat_degrade()
+            except Exception as e:
+                app.logger.warning(f"État du stockage indisponible : {e}")
+                g.etat_stockage = None
+        return dict(etat_stockage=g.etat_stockage)
+
     return app
@@ -4,13 +4,19 @@ from datetime import datetime
 import logging
 import random
 import time
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from collections import Counter
+import json
 from threading import Lock
 from gspread.exceptions import APIError, WorksheetNotFound
 from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 from threading import Lock
 from gspread_dataframe import get_as_dataframe
+from requests.exceptions import RequestException
+from app.utils import local_store, quota, instantanes_partages, disjoncteur, metriques
 
 _init_lock = Lock()
 _init_done = False  # Flag pour éviter les réinitialisations multiples
@@ -20,13 +26,44 @@ _init_done = False  # Flag pour éviter les réinitialisations multiples
 CREDENTIALS_FILE = 'facultairecashwebapp-5b853b8f0832.json'
 SPREADSHEET_NAME = 'ULGLP_Caisse'
 
-# Authentification et ouverture du spreadsheet
-gc = gspread.service_account(filename=CREDENTIALS_FILE)
-try:
-    sh = gc.open(SPREADSHEET_NAME)
-except gspread.SpreadsheetNotFound:
-    sh = gc.create(SPREADSHEET_NAME)
-    sh.share('', perm_type='anyone', role='reader')
+# Authentification et ouverture du spreadsheet : paresseuses et propres à chaque
+# processus. L'import ne fait aucun appel réseau, si bien que le module peut être
+# préchargé dans le maître gunicorn (--preload) : chaque worker ouvre sa propre
+# session HTTP après le fork, au premier accès à `gc` ou `sh`.
+_connexions_lock = Lock()
+_connexions = {}  # {pid: (client, classeur)}
+
+
+def _connexion():
+    pid = os.getpid()
+    connexion = _connexions.get(pid)
+    if connexion is None:
+        with _connexions_lock:
+            connexion = _connexions.get(pid)
+            if connexion is None:
+                client = gspread.service_account(filename=CREDENTIALS_FILE, http_client=quota.ClientLimite)
+                try:
+                    classeur = client.open(SPREADSHEET_NAME)
+                except gspread.SpreadsheetNotFound:
+                    classeur = client.create(SPREADSHEET_NAME)
+                    classeur.share('', perm_type='anyone', role='reader')
+                _connexions.clear()  # connexion héritée du processus parent
+                connexion = _connexions[pid] = (client, classeur)
+    return connexion
+
+
+class _Paresseux:
+    """Délègue à l'objet gspread du processus courant (0 = client, 1 = classeur)."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getattr__(self, nom):
+        return getattr(_connexion()[self._index], nom)
+
+
+gc = _Paresseux(0)
+sh = _Paresseux(1)
 
 REQUIRED_SHEETS = {
     "Classes": ["NomClasse", "Etudiant"],
@@ -41,7 +78,8 @@ REQUIRED_SHEETS = {
     "CategoriesDepense": ["Categorie"],
     "CategoriesPaiement": ["Categorie"],
     "Recettes": ["Date", "Source", "Type", "Description", "Montant", "NomClasse", "Etudiant", "Utilisateur"],
-    "Autres_recettes": ["Date", "NomClasse", "Etudiant", "CategoriePaiement", "Montant", "Description", "Utilisateur"]
+    "Autres_recettes": ["Date", "NomClasse", "Etudiant", "CategoriePaiement", "Montant", "Description", "Utilisateur"],
+    "Catalogue_Classes": ["NomClasse", "NbEtudiants", "NbCours", "DerniereActivite"]
 }
 
 _cached_existing_ws = None
@@ -79,19 +117,19 @@ def init_all_files():
 
 
 
-# Fonction utilitaire pour appel sécurisé à l'API avec retry
+# Fonction utilitaire pour appel sécurisé à l'API
 def safe_call(func, *args, **kwargs):
-    for attempt in range(5):
-        try:
-            return func(*args, **kwargs)
-        except APIError as e:
-            if "429" in str(e):
-                wait = (2 ** attempt) + random.random()
-                logging.warning(f"⏳ Quota dépassé, retry dans {wait:.1f}s...")
-                time.sleep(wait)
-            else:
-                raise
-    raise RuntimeError("Échec après plusieurs tentatives à cause du quota Sheets API.")
+    """
+    Les attentes liées au quota sont gérées par le limiteur partagé (app.utils.quota)
+    au niveau de chaque requête HTTP ; un 429 qui remonte jusqu'ici est converti en
+    QuotaDepasse avec le délai estimé avant de pouvoir réessayer.
+    """
+    try:
+        return func(*args, **kwargs)
+    except APIError as e:
+        if e.response.status_code == 429:
+            raise quota.QuotaDepasse(quota.attente_estimee()) from e
+        raise
 
 
 def get_sheet(sheet_name, columns=None):
@@ -118,6 +156,16 @@ def read_sheet(sheet_name):
         return pd.DataFrame()
 
 
+def get_or_create_inscriptions_sheet_cached():
+    """Comme get_or_create_inscriptions_sheet, mais réutilise le Worksheet en cache."""
+    try:
+        return get_worksheet('Paiements_Inscriptions')
+    except WorksheetNotFound:
+        ws = get_or_create_inscriptions_sheet()
+        _worksheets['Paiements_Inscriptions'] = ws
+        return ws
+
+
 def get_or_create_inscriptions_sheet():
     """
     Récupère ou crée la feuille 'Paiements_Inscriptions' avec colonnes initiales.
@@ -152,15 +200,35 @@ def lire_classes():
 # gc = gspread.service_account(filename='credentials.json')
 # sh = gc.open('ULPGL_Caisse')
 
+def _dataframe_instantane(sheet_name):
+    """
+    DataFrame équivalent à get_all_records (mêmes conversions numériques), construit
+    sur l'instantané de la feuille : pas d'appel API s'il est à jour, un seul pour
+    des lectures simultanées, et les dernières données connues en cas de panne.
+    La conversion est faite une fois par version de l'instantané ; chaque appel
+    reçoit sa propre copie.
+    """
+    snap = get_instantane(sheet_name)
+    with _instantanes_lock:
+        en_cache = snap["derives"].get("dataframe")
+        if en_cache is not None and en_cache[0] == snap["version"]:
+            return en_cache[1].copy()
+        # Les écritures remplacent les lignes sans les modifier : une copie de la
+        # liste suffit pour convertir hors du verrou
+        version, entetes, lignes = snap["version"], list(snap["entetes"]), list(snap["lignes"])
+    lignes = [gspread.utils.numericise_all(list(row), default_blank="") for row in lignes]
+    df = pd.DataFrame(gspread.utils.to_records(entetes, lignes))
+    with _instantanes_lock:
+        if snap["version"] == version:
+            # Vue sans correctif incrémental : oubliée à la prochaine écriture (_apres_ecriture)
+            snap["derives"]["dataframe"] = (version, df)
+    return df.copy()
+
+
 def read_sheet(sheet_name):
     """Lit une feuille Google Sheets et retourne un DataFrame pandas."""
     try:
-        ws = sh.worksheet(sheet_name)
-        data = ws.get_all_records()
-        df = pd.DataFrame(data)
-        if not df.empty:
-            df.columns = [c.strip() for c in df.columns]
-        return df
+        return _dataframe_instantane(sheet_name)
     except Exception as e:
         print(f"[Erreur read_sheet {sheet_name}] {e}")
         return pd.DataFrame()
@@ -192,47 +260,49 @@ def lire_depenses():
 
 
 def update_student_payment(nom_classe, etudiant, type_inscription, montant=10.0):
-    worksheet = get_or_create_inscriptions_sheet()
-    records = worksheet.get_all_records()
-    cell_to_update = None
-
-    for i, row in enumerate(records, start=2):  # 1-based Excel rows, header is 1
-        if (row.get("NomClasse") == nom_classe and
-            row.get("Etudiant") == etudiant and
-            row.get("TypeTravail") == type_inscription):
-            cell_to_update = i
-            break
-
-    if cell_to_update is None:
-        new_row = [nom_classe, etudiant, type_inscription, "Payé", montant, datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
-        worksheet.append_row(new_row)
-    else:
-        statut_cell = f'D{cell_to_update}'  # StatutPaiement col
-        montant_cell = f'E{cell_to_update}'  # Montant col
-        date_cell = f'F{cell_to_update}'  # DatePaiement col
-
-        worksheet.update(statut_cell, "Payé")
+    """
+    Marque payé (et cumule le montant) pour un étudiant dans 'Paiements_Inscriptions'.
+    La ligne est localisée dans l'instantané en cache ; statut, montant et date
+    partent en un seul batch_update (ou un append_row si l'étudiant n'a pas de ligne).
+    """
+    sheet_name = "Paiements_Inscriptions"
+    get_or_create_inscriptions_sheet_cached()
+    for tentative in range(2):
+        snap = get_instantane(sheet_name)
+        date_paiement = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        num = trouver_ligne(snap, NomClasse=nom_classe, Etudiant=etudiant, TypeInscription=type_inscription)
+        if num is None:
+            ligne = {"NomClasse": nom_classe, "Etudiant": etudiant, "TypeInscription": type_inscription,
+                     "StatutPaiement": "Payé", "Montant": montant, "DatePaiement": date_paiement}
+            ajouter_lignes(sheet_name, [[ligne.get(col, "") for col in snap["entetes"]]], snap=snap)
+            return
 
-        current_montant = worksheet.acell(montant_cell).value
+        actuelle = dict(zip(snap["entetes"], snap["lignes"][num - 2]))
         total_montant = montant
-        if current_montant:
-            try:
-                total_montant += float(current_montant)
-            except ValueError:
-                pass
-        worksheet.update(montant_cell, total_montant)
-        worksheet.update(date_cell, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        try:
+            total_montant += float(str(actuelle.get("Montant") or 0).replace(",", "."))
+        except ValueError:
+            pass
+        try:
+            mettre_a_jour_ligne(sheet_name, num, {
+                "StatutPaiement": "Payé",
+                "Montant": total_montant,
+                "DatePaiement": date_paiement,
+            }, snap=snap)
+            return
+        except ConflitModification:
+            # La ligne a changé entre-temps : on recommence une fois sur un instantané frais
+            if tentative:
+                raise
+
 
 def get_students_for_class(nom_classe):
     """
     Récupère la liste des étudiants pour une classe donnée depuis la feuille 'Classes'.
-    Retourne une liste triée et sans doublons de noms d’étudiants.
+    Retourne une liste triée et sans doublons de noms d’étudiants (effectifs en cache).
     """
     try:
-        sheet = get_sheet("Classes")
-        records = sheet.get_all_records()
-        students = [row.get("Etudiant").strip() for row in records if row.get("NomClasse") == nom_classe and row.get("Etudiant")]
-        return sorted(set(students))
+        return get_roster_classe(nom_classe)
     except Exception as e:
         print(f"[Erreur get_students_for_class] {e}")
         return []
@@ -241,46 +311,20 @@ def get_students_for_class(nom_classe):
 def get_payment_status(nom_classe, etudiant, type_inscription):
     """
     Retourne le statut du paiement (ex: "Payé" ou "Non payé") 
-    pour un étudiant, classe et type d'inscription donné.
+    pour un étudiant, classe et type d'inscription donné (lu dans la matrice des statuts).
     """
     try:
-        sheet = get_sheet("Paiements_Inscriptions")  # ou "Paiements" selon votre usage
-        records = sheet.get_all_records()
-        for row in records:
-            if (row.get("NomClasse") == nom_classe and
-                row.get("Etudiant") == etudiant and
-                row.get("TypeInscription") == type_inscription):
-                return row.get("StatutPaiement", "Non payé")
-        return "Non payé"
+        statuts = get_statuts_paiement("Paiements_Inscriptions", nom_classe, type_inscription)
+        return statuts.get(str(etudiant).strip(), "Non payé")
     except Exception as e:
         print(f"[Erreur get_payment_status] {e}")
         return "Non payé"
 
 
 def get_payment_summary(nom_classe, type_inscription):
-    worksheet = get_or_create_inscriptions_sheet()
-    records = worksheet.get_all_records()
-    payes, non_payes, total_recettes = 0, 0, 0.0
-    detail = {}
-
-    for row in records:
-        if row.get("NomClasse") == nom_classe and row.get("TypeInscription") == type_inscription:
-            etudiant = row.get("Etudiant")
-            statut = row.get("StatutPaiement", "Non payé")
-            montant = float(row.get("Montant", 0))
-            detail[etudiant] = statut
-            if statut == "Payé":
-                payes += 1
-                total_recettes += montant
-            else:
-                non_payes += 1
-
-    return {
-        'payes': payes,
-        'non_payes': non_payes,
-        'total_recettes': total_recettes,
-        'detail': detail
-    }
+    cellules, resume = _resume_paiements("Paiements_Inscriptions", nom_classe, type_inscription)
+    resume["detail"] = {etudiant: c["statut"] for etudiant, c in cellules.items()}
+    return resume
 
 import unicodedata
 
@@ -305,66 +349,13 @@ def normalize_str(s):
 
 
 def get_payment_summary_travaux(nom_classe, type_travail):
-    worksheet = get_or_create_travaux_sheet()  # à adapter à ton code gspread
-    records = worksheet.get_all_records()
-
-    nom_classe_norm = normalize_str(nom_classe)
-    type_travail_norm = normalize_str(type_travail)
-
-    print(f"[Travaux] Classe demandée : {nom_classe} -> {nom_classe_norm}")
-    print(f"[Travaux] Travail demandé : {type_travail} -> {type_travail_norm}")
-    print(f"[Travaux] Nb lignes lues depuis Google Sheet : {len(records)}")
-
-    payes, non_payes, total_recettes = 0, 0, 0.0
-    detail = {}
-
-    for i, row in enumerate(records, 1):
-        classe_raw = row.get("NomClasse", "")
-        travail_raw = row.get("TypeTravail", "")
-        etudiant_raw = row.get("Etudiant", "")
-        statut_raw = row.get("StatutPaiement", "")
-        montant_raw = row.get("Montant", 0)
-
-        # Normalisation
-        classe = normalize_str(classe_raw)
-        travail = normalize_str(travail_raw)
-        etudiant = str(etudiant_raw).strip()
-        statut = str(statut_raw).strip()
-        montant_str = str(montant_raw).strip()
-
-        if classe != nom_classe_norm or travail != type_travail_norm:
-            # Ligne ignorée (ne correspond pas aux filtres)
-            if i <= 10:  # éviter trop de logs
-                print(f"[Travaux][Row {i}] Ignorée: Classe='{classe_raw}' ({classe}) | "
-                      f"Travail='{travail_raw}' ({travail})")
-            continue
-
-        try:
-            montant = float(montant_str.replace(",", "."))
-        except ValueError:
-            montant = 0.0
-
-        detail[etudiant] = {
-            "type_travail": travail_raw,
-            "statut": statut,
-            "montant": montant,
-        }
-
-        if normalize_str(statut) == "paye":  # "Payé" normalisé -> "paye"
-            payes += 1
-            total_recettes += montant
-        else:
-            non_payes += 1
-
-    summary = {
-        "payes": payes,
-        "non_payes": non_payes,
-        "total_recettes": round(total_recettes, 2),
-        "detail": detail,
+    """Résumé des paiements travaux d'une classe, lu dans la matrice de 'Paiements_Travaux'."""
+    cellules, resume = _resume_paiements("Paiements_Travaux", nom_classe, type_travail)
+    resume["detail"] = {
+        etudiant: {"type_travail": c["type"], "statut": c["statut"], "montant": c["montant"]}
+        for etudiant, c in cellules.items()
     }
-
-    print(f"[Travaux] Résumé final: {summary}")
-    return summary
+    return resume
 
 
 
@@ -383,106 +374,10 @@ def get_or_create_travaux_sheet():
 
 # Fonctions complémentaires que vous aviez précédemment, à maintenir ou adapter selon contexte
 
-def ensure_ids(df, id_col="ID"):
-    def safe_int(value):
-        try:
-            return int(value)
-        except (ValueError, TypeError):
-            return None
-
-    ids = []
-    for i, v in enumerate(df[id_col]):
-        iv = safe_int(v)
-        if iv is None:
-            iv = i + 1
-        ids.append(iv)
-
-    df[id_col] = ids
-    return df
-
-
 # Ajoutez ici les autres fonctions nécessaires pour votre projet...
 
-# Exemple : génération PDF
-def generate_summary_pdf(summary_data, nom_classe, type_inscription):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    margin = 50
-    y = height - margin
-
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(margin, y, f"Résumé des paiements - {nom_classe} - {type_inscription}")
-    y -= 30
-
-    c.setFont("Helvetica", 12)
-    c.drawString(margin, y, f"Étudiants payés : {summary_data['payes']}")
-    y -= 20
-    c.drawString(margin, y, f"Étudiants non payés : {summary_data['non_payes']}")
-    y -= 20
-    c.drawString(margin, y, f"Total des recettes : {summary_data['total_recettes']:.2f} USD")
-    y -= 40
-
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(margin, y, "Détail des paiements :")
-    y -= 20
-
-    c.setFont("Helvetica", 10)
-    for etudiant, statut in summary_data['detail'].items():
-        if y < margin:
-            c.showPage()
-            y = height - margin
-            c.setFont("Helvetica", 10)
-        c.drawString(margin, y, f"{etudiant}: {statut}")
-        y -= 15
-
-    c.save()
-    buffer.seek(0)
-    return buffer
-
-
-def generate_summary_pdf_travaux(summary_data, nom_classe, type_travail):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    margin = 50
-    y = height - margin
-
-    # Titre
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(margin, y, f"Résumé des paiements - {nom_classe} - {type_travail}")
-    y -= 30
-
-    # Résumé global
-    c.setFont("Helvetica", 12)
-    c.drawString(margin, y, f"Étudiants payés : {summary_data['payes']}")
-    y -= 20
-    c.drawString(margin, y, f"Étudiants non payés : {summary_data['non_payes']}")
-    y -= 20
-    c.drawString(margin, y, f"Total des recettes : {summary_data['total_recettes']:.2f} USD")
-    y -= 40
-
-    # Détails
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(margin, y, "Détail des paiements :")
-    y -= 20
-
-    c.setFont("Helvetica", 10)
-    for etudiant, infos in summary_data['detail'].items():
-        # infos doit contenir {'type_travail': ..., 'statut': ..., 'montant': ...}
-        if y < margin:
-            c.showPage()
-            y = height - margin
-            c.setFont("Helvetica", 10)
-
-        ligne = (f"{etudiant} | Travail: {infos['type_travail']} | "
-                 f"Statut: {infos['statut']} | Montant: {infos['montant']:.2f} USD")
-        c.drawString(margin, y, ligne)
-        y -= 15
-
-    c.save()
-    buffer.seek(0)
-    return buffer
+# Exemple : génération PDF (dessin dans app.utils.pdf_resumes, réexporté ici)
+from app.utils.pdf_resumes import generate_summary_pdf, generate_summary_pdf_travaux  # noqa: E402
 
 
 def lire_categories_paiement():
@@ -528,22 +423,17 @@ def write_sheet(sheet_name, df):
     """
     ws = sh.worksheet(sheet_name)
     ws.clear()
-    if df.empty:
-        return
-    values = [df.columns.tolist()] + df.values.tolist()
-    ws.update(values)
+    if not df.empty:
+        values = [df.columns.tolist()] + df.values.tolist()
+        ws.update(values)
+    _apres_ecriture(sheet_name)
 
 def lire_cours():
     """
     Lit la feuille 'Cours' dans Google Sheets et renvoie un DataFrame pandas.
     """
     try:
-        ws = sh.worksheet('Cours')
-        data = ws.get_all_records()
-        df = pd.DataFrame(data)
-        if not df.empty:
-            df.columns = [col.strip() for col in df.columns]
-        return df
+        return _dataframe_instantane('Cours')
     except Exception as e:
         print(f"[Erreur lire_cours] {e}")
         return pd.DataFrame()
@@ -552,10 +442,7 @@ def lire_cours():
 def lire_paiements_inscriptions():
     """Lit la feuille Paiements_Inscriptions et retourne un DataFrame."""
     try:
-        ws = sh.worksheet('Paiements_Inscriptions')
-        data = ws.get_all_records()
-        df = pd.DataFrame(data)
-        return df
+        return _dataframe_instantane('Paiements_Inscriptions')
     except Exception as e:
         print(f"Erreur lecture Paiements_Inscriptions: {e}")
         return pd.DataFrame()
@@ -595,7 +482,7 @@ def enregistrer_paiement_google(nom_classe, etudiant, type_inscription, montant=
             date_paiement
         ]
         
-        ws.append_row(ligne, value_input_option='USER_ENTERED')
+        ajouter_lignes('Paiements_Inscriptions', [ligne])
         return True
     except Exception as e:
         print(f"Erreur lors de l'enregistrement paiement sur Google Sheets : {e}")
@@ -624,6 +511,7 @@ def enregistrer_paiement(date_paiement, montant, details=None):
             for key in ['classe', 'etudiant', 'commentaire']:
                 ligne.append(details.get(key, ''))
         ws.append_row(ligne, value_input_option='USER_ENTERED')
+        _apres_ecriture('Paiements_Inscriptions')
         return True
     except Exception as e:
         print(f"Erreur enregistrement paiement: {e}")
@@ -708,7 +596,7 @@ def enregistrer_paiement_travaux(nom_classe, etudiant, type_travail, montant):
         ws = sh.worksheet("Paiements_Travaux")
         date_paiement = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         ligne = [nom_classe, etudiant, type_travail, "Payé", montant, date_paiement]
-        ws.append_row(ligne, value_input_option="USER_ENTERED")
+        ajouter_lignes("Paiements_Travaux", [ligne])
         return True
     except Exception as e:
         print(f"Erreur lors de l'enregistrement du paiement travaux : {e}")
@@ -759,14 +647,8 @@ def lire_paiements_travaux():
 # --- Vérifie le statut de paiement d'un étudiant pour un type de travail donné ---
 
 def get_payment_status_travaux(nom_classe, etudiant, type_travail):
-    df = lire_paiements_travaux()
-    filtre = (
-        (df["NomClasse"] == nom_classe) &
-        (df["Etudiant"] == etudiant) &
-        (df["TypeTravail"] == type_travail) &
-        (df["StatutPaiement"] == "Payé")
-    )
-    return "Payé" if not df[filtre].empty else None
+    statuts = get_statuts_paiement("Paiements_Travaux", nom_classe, type_travail)
+    return "Payé" if statuts.get(str(etudiant).strip()) == "Payé" else None
 
 # --- Enregistre un paiement dans la feuille Paiements_Travaux ---
 
@@ -790,41 +672,16 @@ def get_payment_status_inscription(nom_classe, etudiant, type_inscription):
     Retourne le statut de paiement de l'étudiant pour une classe et type d'inscription donnés.
     Renvoie 'Payé' ou 'Non payé'.
     """
-    df = lire_paiements_inscriptions()  # fonction à adapter pour charger la feuille inscriptions
-
-    # Nettoyer les noms de colonnes
-    df.columns = df.columns.str.strip()
-
-    # Filtrer par classe, étudiant et type inscription
-    filt = (
-        (df['NomClasse'] == nom_classe) &
-        (df['Etudiant'] == etudiant) &
-        (df['TypeInscription'] == type_inscription)
-    )
-
-    ligne = df[filt]
-    if not ligne.empty:
-        statut = ligne.iloc[0]['StatutPaiement']
-        if statut and statut.lower() == 'payé':
-            return "Payé"
-
-    return "Non payé"
+    statuts = get_statuts_paiement("Paiements_Inscriptions", nom_classe, type_inscription)
+    return "Payé" if statuts.get(str(etudiant).strip()) == "Payé" else "Non payé"
 
 
 
 
 
-# Variables globales configuration (adapter si besoin)
-CREDENTIALS_FILE = 'facultairecashwebapp-5b853b8f0832.json'
-SPREADSHEET_NAME = 'ULGLP_Caisse'
-
-# Initialiser la connexion Google Sheets (faire une seule fois)
-gc = gspread.service_account(filename=CREDENTIALS_FILE)
-sh = gc.open(SPREADSHEET_NAME)
-
-def get_sheet_dataframe(sheet_title):
+def _charger_dataframe(sheet_title):
     try:
-        worksheet = sh.worksheet(sheet_title)
+        worksheet = get_worksheet(sheet_title)
     except gspread.exceptions.WorksheetNotFound:
         # Si la feuille n'existe pas, retourne DataFrame vide
         return pd.DataFrame()
@@ -833,6 +690,12 @@ def get_sheet_dataframe(sheet_title):
     df.dropna(how='all', inplace=True)
     return df
 
+
+def get_sheet_dataframe(sheet_title):
+    # Lectures simultanées de la même version : un seul téléchargement, une copie par appelant
+    cle = ("dataframe", sheet_title, version_feuille(sheet_title))
+    return lecture_unique(cle, _charger_dataframe, sheet_title).copy()
+
 def lire_inscriptions():
     """
     Lit toutes les données de la feuille inscriptions en DataFrame.
@@ -844,3 +707,1609 @@ def lire_paiements_travaux():
     Lit toutes les données de la feuille paiements travaux en DataFrame.
     """
     return get_sheet_dataframe('Paiements_Travaux')
+
+
+# --- Catalogue des classes (vue matérialisée) ---
+# Les sélecteurs de classe n'ont besoin que des noms (et de quelques compteurs) :
+# on les sert depuis la petite feuille 'Catalogue_Classes', tenue à jour à chaque
+# écriture du roster ou des cours, au lieu de télécharger toute la feuille 'Classes'.
+# Elle passe par les instantanés versionnés comme les autres feuilles : une
+# classe créée par un worker apparaît dans les sélecteurs de l'autre dès la
+# requête suivante. Ses mises à jour se font sous un verrou entre processus.
+
+CATALOGUE_SHEET = "Catalogue_Classes"
+CATALOGUE_COLUMNS = REQUIRED_SHEETS[CATALOGUE_SHEET]
+
+_catalogue_amorce = False  # amorçage depuis le roster déjà tenté dans ce processus
+
+
+def _maintenant():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _feuille_catalogue():
+    try:
+        return sh.worksheet(CATALOGUE_SHEET)
+    except WorksheetNotFound:
+        ws = safe_call(sh.add_worksheet, title=CATALOGUE_SHEET, rows="200", cols=str(len(CATALOGUE_COLUMNS)))
+        safe_call(ws.append_row, CATALOGUE_COLUMNS)
+        return ws
+
+
+def _entree_catalogue(row):
+    def as_int(value):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return 0
+
+    return {
+        "NomClasse": str(row.get("NomClasse", "")).strip(),
+        "NbEtudiants": as_int(row.get("NbEtudiants")),
+        "NbCours": as_int(row.get("NbCours")),
+        "DerniereActivite": str(row.get("DerniereActivite", "") or ""),
+    }
+
+
+def _ligne_catalogue(entree):
+    return [entree[col] for col in CATALOGUE_COLUMNS]
+
+
+def _construire_catalogue(snap):
+    # {NomClasse: (numéro de ligne, entrée)}, la première ligne d'une classe l'emporte
+    catalogue = {}
+    for num, row in enumerate(snap["lignes"], start=2):
+        entree = _entree_catalogue(dict(zip(snap["entetes"], row)))
+        if entree["NomClasse"]:
+            catalogue.setdefault(entree["NomClasse"], (num, entree))
+    return catalogue
+
+
+def _instantane_catalogue():
+    try:
+        return get_instantane(CATALOGUE_SHEET)
+    except WorksheetNotFound:
+        _worksheets[CATALOGUE_SHEET] = _feuille_catalogue()
+        return get_instantane(CATALOGUE_SHEET)
+
+
+def _catalogue_courant():
+    """(instantané, {NomClasse: (numéro de ligne, entrée)}) du catalogue."""
+    snap = _instantane_catalogue()
+    with _instantanes_lock:
+        return snap, dict(get_derive(snap, "catalogue", _construire_catalogue))
+
+
+def reconstruire_catalogue_classes():
+    """
+    Recalcule entièrement le catalogue depuis les feuilles 'Classes' et 'Cours'
+    puis le réécrit dans 'Catalogue_Classes'. Sert d'amorçage et de réconciliation.
+    """
+    df_classes = read_sheet("Classes")
+    df_cours = read_sheet("Cours")
+    catalogue = {}
+
+    if not df_classes.empty and "NomClasse" in df_classes.columns:
+        df = df_classes.copy()
+        df["NomClasse"] = df["NomClasse"].astype(str).str.strip()
+        df = df[df["NomClasse"] != ""]
+        if "Etudiant" not in df.columns:
+            df["Etudiant"] = ""
+        df["Etudiant"] = df["Etudiant"].astype(str).str.strip()
+        for nom, groupe in df.groupby("NomClasse"):
+            etudiants = groupe.loc[groupe["Etudiant"] != "", "Etudiant"]
+            catalogue[nom] = {"NomClasse": nom, "NbEtudiants": int(etudiants.nunique()),
+                              "NbCours": 0, "DerniereActivite": ""}
+
+    if not df_cours.empty and "NomClasse" in df_cours.columns and "NomCours" in df_cours.columns:
+        df = df_cours.copy()
+        df["NomClasse"] = df["NomClasse"].astype(str).str.strip()
+        df["NomCours"] = df["NomCours"].astype(str).str.strip()
+        df = df[(df["NomClasse"] != "") & (df["NomCours"] != "")]
+        for nom, nb in df.groupby("NomClasse")["NomCours"].nunique().items():
+            entree = catalogue.setdefault(nom, {"NomClasse": nom, "NbEtudiants": 0,
+                                                "NbCours": 0, "DerniereActivite": ""})
+            entree["NbCours"] = int(nb)
+
+    with local_store.verrou("catalogue_classes"):
+        # Conserver les dates d'activité déjà connues
+        _, actuel = _catalogue_courant()
+        for nom, entree in catalogue.items():
+            if nom in actuel:
+                entree["DerniereActivite"] = actuel[nom][1]["DerniereActivite"]
+        ws = get_worksheet(CATALOGUE_SHEET)
+        valeurs = [CATALOGUE_COLUMNS] + [_ligne_catalogue(catalogue[nom]) for nom in sorted(catalogue)]
+        safe_call(ws.clear)
+        safe_call(ws.update, values=valeurs, range_name="A1")
+        _apres_ecriture(CATALOGUE_SHEET)
+    logging.info(f"Catalogue des classes reconstruit ({len(catalogue)} classes).")
+    return [catalogue[nom] for nom in sorted(catalogue)]
+
+
+def lire_catalogue_classes():
+    """
+    Retourne le catalogue des classes (liste de dicts triée par NomClasse) avec
+    NbEtudiants, NbCours et DerniereActivite, sans lire la feuille 'Classes'.
+    """
+    global _catalogue_amorce
+    try:
+        _, catalogue = _catalogue_courant()
+    except Exception as e:
+        logging.error(f"[Erreur lire_catalogue_classes] {e}")
+        return []
+    if not catalogue and not _catalogue_amorce:
+        # Catalogue jamais construit : amorçage unique (par processus) depuis le roster ;
+        # s'il reste vide (aucune classe), l'instantané vide sert ensuite comme un autre
+        _catalogue_amorce = True
+        return reconstruire_catalogue_classes()
+    return [dict(catalogue[nom][1]) for nom in sorted(catalogue)]
+
+
+def get_classes():
+    """Liste triée des noms de classes, lue depuis le catalogue."""
+    return [entree["NomClasse"] for entree in lire_catalogue_classes()]
+
+
+def maj_catalogue_classe(nom_classe, delta_etudiants=0, delta_cours=0, nb_etudiants=None, nb_cours=None):
+    """
+    Applique un delta au catalogue pour une classe (création si absente) et
+    réécrit uniquement sa ligne dans 'Catalogue_Classes'. `nb_etudiants` et
+    `nb_cours` remplacent le compteur au lieu de lui ajouter un delta.
+    """
+    nom_classe = str(nom_classe).strip()
+    if not nom_classe:
+        return
+    # Verrou entre workers : lecture, calcul et écriture de la ligne sans qu'un
+    # autre worker n'écrive entre-temps (l'instantané suit sa version partagée)
+    with local_store.verrou("catalogue_classes"):
+        snap, catalogue = _catalogue_courant()
+        num, entree = catalogue.get(nom_classe, (None, None))
+        entree = dict(entree or {"NomClasse": nom_classe, "NbEtudiants": 0, "NbCours": 0, "DerniereActivite": ""})
+        if nb_etudiants is not None:
+            entree["NbEtudiants"] = nb_etudiants
+        else:
+            entree["NbEtudiants"] = max(0, entree["NbEtudiants"] + delta_etudiants)
+        if nb_cours is not None:
+            entree["NbCours"] = nb_cours
+        else:
+            entree["NbCours"] = max(0, entree["NbCours"] + delta_cours)
+        entree["DerniereActivite"] = _maintenant()
+
+        if num is None:
+            ajouter_lignes(CATALOGUE_SHEET, [_ligne_catalogue(entree)], snap=snap)
+        else:
+            mettre_a_jour_lignes(CATALOGUE_SHEET, {num: {col: entree[col] for col in CATALOGUE_COLUMNS}}, snap)
+
+
+def enregistrer_classe_etudiants(nom_classe, etudiants):
+    """
+    Ajoute des étudiants à une classe dans 'Classes' (un seul append_rows)
+    et met à jour le catalogue. Une liste vide enregistre seulement la classe.
+    """
+    nom_classe = nom_classe.strip()
+    etudiants = list(dict.fromkeys(e.strip() for e in etudiants if e and e.strip()))
+    if etudiants:
+        ajouter_lignes("Classes", [[nom_classe, e] for e in etudiants])
+    maj_catalogue_classe(nom_classe, nb_etudiants=_nb_etudiants_roster(nom_classe))
+
+
+def _nb_etudiants_roster(nom_classe):
+    # Même compte que reconstruire_catalogue_classes (noms distincts) : un étudiant
+    # déjà inscrit ou un renommage vers un nom existant ne gonfle pas le catalogue
+    return len(get_roster_classe(nom_classe))
+
+
+def mettre_a_jour_etudiant(nom_classe, ancien_nom, nouveau_nom):
+    """Renomme un étudiant d'une classe dans 'Classes' (un seul batch_update)."""
+    for tentative in range(2):
+        snap = get_instantane("Classes")
+        with _instantanes_lock:
+            roster = get_derive(snap, "roster", _construire_roster)
+            cle = (nom_classe.strip(), ancien_nom.strip())
+            nums = [num for num, c in roster["ligne_cle"].items() if c == cle]
+        if not nums:
+            raise ValueError(f"Étudiant '{ancien_nom}' introuvable dans la classe {nom_classe}")
+        try:
+            mettre_a_jour_lignes("Classes", {num: {"Etudiant": nouveau_nom} for num in nums}, snap)
+            break
+        except ConflitModification:
+            if tentative:
+                raise
+    maj_catalogue_classe(nom_classe, nb_etudiants=_nb_etudiants_roster(nom_classe))
+
+
+def ajouter_cours_classe(nom_classe, cours):
+    """Ajoute des cours à une classe dans 'Cours' et met à jour le catalogue."""
+    nom_classe = nom_classe.strip()
+    cours = list(dict.fromkeys(c.strip() for c in cours if c and c.strip()))
+    if not cours:
+        return
+    ajouter_lignes("Cours", [[nom_classe, c] for c in cours])
+    # Noms distincts, comme reconstruire_catalogue_classes : un cours déjà présent ne compte pas deux fois
+    maj_catalogue_classe(nom_classe, nb_cours=len(get_cours_classe(nom_classe)))
+
+
+# --- Correspondance classe -> cours (préchargée) ---
+# Les formulaires de dépenses demandent les cours d'une classe à chaque changement
+# de liste déroulante : la correspondance complète est une vue dérivée de
+# l'instantané de 'Cours'. Elle suit donc la version partagée de la feuille (un
+# cours ajouté par un worker est vu par l'autre à la requête suivante) et n'est
+# reconstruite, sans appel API, qu'après une écriture dans 'Cours'.
+
+def _version_cours_map(mapping):
+    contenu = json.dumps(mapping, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(contenu.encode("utf-8")).hexdigest()[:16]
+
+
+def _construire_cours_map(snap):
+    # Corrige la faute de frappe si présente
+    entetes = ["NomClasse" if c == "NomClassse" and "NomClasse" not in snap["entetes"] else c
+               for c in snap["entetes"]]
+    mapping = {}
+    if "NomClasse" in entetes and "NomCours" in entetes:
+        pos_classe, pos_cours = entetes.index("NomClasse"), entetes.index("NomCours")
+        for row in snap["lignes"]:
+            classe, cours = str(row[pos_classe]).strip(), str(row[pos_cours]).strip()
+            if classe and cours:
+                mapping.setdefault(classe, set()).add(cours)
+    mapping = {classe: sorted(cours) for classe, cours in mapping.items()}
+    return mapping, _version_cours_map(mapping)
+
+
+def get_cours_map():
+    """
+    Retourne (mapping, version) : mapping {NomClasse: [NomCours]} et une version
+    courte (hash du contenu) utilisable comme ETag.
+    """
+    snap = get_instantane("Cours")
+    with _instantanes_lock:
+        return get_derive(snap, "cours_map", _construire_cours_map)
+
+
+def get_cours_classe(nom_classe):
+    """Liste triée des cours d'une classe, depuis la correspondance préchargée."""
+    mapping, _ = get_cours_map()
+    return list(mapping.get(str(nom_classe).strip(), []))
+
+
+# --- Instantanés de feuilles, versions et mises à jour ligne à ligne ---
+# Chaque feuille écrite par l'application a un numéro de version dans la base
+# locale partagée, incrémenté à chaque écriture (ajout, modification, réécriture).
+# Un instantané (en-tête + toutes les lignes, lu en un get_all_values) reste
+# valable tant que sa version est la version courante : les deux workers voient
+# ainsi les écritures l'un de l'autre sans relire la feuille, et une mise à jour
+# de ligne peut se contenter d'un seul batch_update quand rien n'a bougé.
+# Les instantanés sont aussi publiés sur disque (app.utils.instantanes_partages) :
+# une feuille lue par un worker n'est pas retéléchargée par l'autre.
+
+local_store.register_schema(
+    "CREATE TABLE IF NOT EXISTS versions_feuilles (feuille TEXT PRIMARY KEY, version INTEGER NOT NULL);"
+)
+
+_instantanes_lock = Lock()
+_instantanes = {}  # {sheet: {"entetes", "lignes", "version", "time", "index_id", "derives"}}
+_instantane_expiration = 120  # secondes (rattrape les saisies manuelles dans Google Sheets)
+
+_worksheets = {}  # cache des objets Worksheet (sh.worksheet() coûte un appel API)
+
+# Vues dérivées d'un instantané (ex. matrice des statuts) : {nom: patcher(snap, derive, nums_lignes)}.
+# Elles vivent dans snap["derives"] et sont corrigées ligne à ligne à chaque écriture.
+_patchs_derives = {}
+
+LEDGER_SHEETS = ("Paiements", "Depenses")
+
+
+class ConflitModification(ValueError):
+    """La ligne a été modifiée (ou déplacée) depuis sa dernière lecture."""
+
+
+def get_worksheet(sheet_name):
+    """Retourne l'objet Worksheet, mis en cache pour éviter un appel de métadonnées à chaque accès."""
+    ws = _worksheets.get(sheet_name)
+    if ws is None:
+        ws = safe_call(sh.worksheet, sheet_name)
+        _worksheets[sheet_name] = ws
+    return ws
+
+
+def version_feuille(sheet_name):
+    """Version courante (partagée entre workers) d'une feuille."""
+    with local_store.lecture() as conn:
+        row = conn.execute("SELECT version FROM versions_feuilles WHERE feuille = ?", (sheet_name,)).fetchone()
+    return row[0] if row else 0
+
+
+def incrementer_version(sheet_name):
+    """Signale une écriture sur la feuille ; retourne la nouvelle version."""
+    with local_store.transaction() as conn:
+        conn.execute(
+            "INSERT INTO versions_feuilles (feuille, version) VALUES (?, 1) "
+            "ON CONFLICT(feuille) DO UPDATE SET version = version + 1",
+            (sheet_name,),
+        )
+        return conn.execute("SELECT version FROM versions_feuilles WHERE feuille = ?", (sheet_name,)).fetchone()[0]
+
+
+def _as_id(value):
+    try:
+        return int(float(str(value).strip()))
+    except (TypeError, ValueError):
+        return None
+
+
+def _cellule_egale(a, b):
+    a, b = str(a if a is not None else "").strip(), str(b if b is not None else "").strip()
+    if a == b:
+        return True
+    try:
+        return float(a.replace(",", ".")) == float(b.replace(",", "."))
+    except ValueError:
+        return False
+
+
+def _charger_instantane(sheet_name, version):
+    valeurs = safe_call(get_worksheet(sheet_name).get_all_values)
+    if valeurs:
+        entetes = [str(c).strip() for c in valeurs[0]]
+    else:
+        entetes = list(REQUIRED_SHEETS.get(sheet_name, []))
+    lignes = [list(row) + [""] * (len(entetes) - len(row)) for row in valeurs[1:]]
+    metriques.compteur("caisse_sheets_lignes_lues_total", len(lignes), feuille=sheet_name)
+    return {"entetes": entetes, "lignes": lignes, "version": version, "time": time.time(),
+            "index_id": None, "derives": {}}
+
+
+# Lectures servies depuis un instantané périmé (Sheets en panne) pendant la requête courante
+_lecture_degradee = threading.local()
+
+
+def _service_en_panne(e):
+    if isinstance(e, (disjoncteur.ServiceIndisponible, quota.QuotaDepasse, RequestException)):
+        return True
+    return isinstance(e, APIError) and (e.response.status_code == 429 or e.response.status_code >= 500)
+
+
+def _signaler_perime(snap):
+    depuis = getattr(_lecture_degradee, "depuis", None)
+    _lecture_degradee.depuis = snap["time"] if depuis is None else min(depuis, snap["time"])
+
+
+def debut_requete():
+    """Remet à zéro le signalement de données périmées (appelé avant chaque requête)."""
+    _lecture_degradee.depuis = None
+
+
+def donnees_perimees_depuis():
+    """Heure (timestamp) de l'instantané le plus ancien servi en mode dégradé, ou None."""
+    return getattr(_lecture_degradee, "depuis", None)
+
+
+# Lectures identiques simultanées (single-flight) : quand plusieurs threads du
+# worker veulent la même feuille à la même version, un seul la télécharge et les
+# autres attendent son résultat. Des feuilles différentes se chargent en parallèle.
+_en_vol_lock = Lock()
+_en_vol = {}  # {clé: Future}
+
+
+def lecture_unique(cle, fonction, *args):
+    """
+    Exécute fonction(*args), sauf si une lecture de même `cle` est déjà en cours
+    dans le processus : on attend alors son résultat (ou son exception).
+    """
+    with _en_vol_lock:
+        futur = _en_vol.get(cle)
+        proprietaire = futur is None
+        if proprietaire:
+            futur = _en_vol[cle] = Future()
+    if not proprietaire:
+        metriques.compteur("caisse_cache_instantanes_total", feuille=cle[1], resultat="coalescee")
+        return futur.result()
+    try:
+        resultat = fonction(*args)
+    except BaseException as e:
+        futur.set_exception(e)
+        raise
+    else:
+        futur.set_result(resultat)
+        return resultat
+    finally:
+        with _en_vol_lock:
+            _en_vol.pop(cle, None)
+
+
+def _recharger_instantane(sheet_name, version):
+    """
+    Recharge l'instantané (fichier publié par un autre worker, sinon API) hors du
+    verrou global. Retourne (instantané, périmé).
+    """
+    maintenant = time.time()
+    nouveau = instantanes_partages.charger(sheet_name, version, _instantane_expiration, maintenant)
+    if nouveau is not None:
+        nouveau.update({"index_id": None, "derives": {}})
+        metriques.compteur("caisse_cache_instantanes_total", feuille=sheet_name, resultat="partage")
+    else:
+        try:
+            nouveau = _charger_instantane(sheet_name, version)
+            metriques.compteur("caisse_cache_instantanes_total", feuille=sheet_name, resultat="api")
+        except Exception as e:
+            if not _service_en_panne(e):
+                raise
+            with _instantanes_lock:
+                ancien = _instantanes.get(sheet_name)
+            if ancien is None:
+                ancien = instantanes_partages.charger(sheet_name, None, None, maintenant)
+                if ancien is None:
+                    raise
+                ancien.update({"index_id": None, "derives": {}})
+                with _instantanes_lock:
+                    ancien = _instantanes.setdefault(sheet_name, ancien)
+            logging.warning(f"Sheets indisponible, instantané périmé servi pour {sheet_name} : {e}")
+            metriques.compteur("caisse_cache_instantanes_total", feuille=sheet_name, resultat="perime")
+            return ancien, True
+        instantanes_partages.publier(sheet_name, nouveau)
+    with _instantanes_lock:
+        courant = _instantanes.get(sheet_name)
+        # Ne pas remplacer un instantané plus récent (écriture pendant le chargement)
+        if courant is None or courant["version"] <= nouveau["version"]:
+            _instantanes[sheet_name] = nouveau
+    return nouveau, False
+
+
+def get_instantane(sheet_name):
+    """
+    Retourne l'instantané d'une feuille : {"entetes", "lignes", "version", ...}.
+    La ligne n de la feuille est lignes[n - 2]. Rechargé si une écriture a eu lieu
+    (version) ou après expiration ; les rechargements simultanés de la même
+    version n'en font qu'un. Si Google Sheets est en panne, le dernier
+    instantané connu (en mémoire ou publié par un autre worker) est servi et
+    signalé comme périmé pour la requête.
+    """
+    version = version_feuille(sheet_name)
+    with _instantanes_lock:
+        snap = _instantanes.get(sheet_name)
+        if (snap is not None and snap["version"] == version
+                and time.time() - snap["time"] <= _instantane_expiration):
+            metriques.compteur("caisse_cache_instantanes_total", feuille=sheet_name, resultat="memoire")
+            return snap
+    snap, perime = lecture_unique(("instantane", sheet_name, version), _recharger_instantane, sheet_name, version)
+    if perime:
+        _signaler_perime(snap)
+    return snap
+
+
+def get_derive(snap, nom, construire):
+    """
+    Retourne la vue dérivée `nom` de l'instantané, construite au besoin par
+    construire(snap). À utiliser sous _instantanes_lock (les écritures la corrigent).
+    """
+    derive = snap["derives"].get(nom)
+    if derive is None:
+        derive = construire(snap)
+        snap["derives"][nom] = derive
+    return derive
+
+
+def invalider_instantane(sheet_name=None):
+    """Oublie l'instantané d'une feuille (ou de toutes), y compris celui publié aux autres workers."""
+    with _instantanes_lock:
+        if sheet_name is None:
+            _instantanes.clear()
+        else:
+            _instantanes.pop(sheet_name, None)
+        instantanes_partages.supprimer(sheet_name)
+
+
+def _apres_ecriture(sheet_name, snap=None, appliquer=None):
+    """
+    Incrémente la version de la feuille. Si `snap` était à jour juste avant notre
+    écriture (aucune autre écriture entre-temps), `appliquer(snap)` y reporte la
+    modification et retourne les numéros des lignes touchées : l'instantané reste
+    valable, ses vues dérivées sont corrigées sur ces lignes et il est republié
+    pour les autres workers. Sinon il est oublié.
+    """
+    nouvelle = incrementer_version(sheet_name)
+    a_publier = None
+    with _instantanes_lock:
+        courant = _instantanes.get(sheet_name)
+        nums = None
+        if (snap is not None and courant is snap and nouvelle == snap["version"] + 1
+                and appliquer is not None):
+            nums = appliquer(snap)
+        if nums is not None and nums is not False:
+            snap["version"] = nouvelle
+            for nom, derive in list(snap["derives"].items()):
+                patcher = _patchs_derives.get(nom)
+                if patcher is None:
+                    del snap["derives"][nom]
+                else:
+                    patcher(snap, derive, nums)
+            # Les écritures remplacent les lignes sans les modifier : une copie de
+            # la liste suffit pour publier hors du verrou
+            a_publier = {"entetes": list(snap["entetes"]), "lignes": list(snap["lignes"]),
+                         "version": nouvelle, "time": snap["time"]}
+        elif courant is not None:
+            _instantanes.pop(sheet_name, None)
+    if a_publier is not None:
+        # L'autre worker reprendra cette version sans relire la feuille
+        instantanes_partages.publier(sheet_name, a_publier)
+    return nouvelle
+
+
+def _num_lignes_ajoutees(reponse):
+    # append_row(s) renvoie {"updates": {"updatedRange": "Feuille!A12:F14", ...}}
+    try:
+        plage = reponse["updates"]["updatedRange"].split("!")[-1]
+        return gspread.utils.a1_to_rowcol(plage.split(":")[0])[0]
+    except (KeyError, TypeError, AttributeError, IndexError, gspread.exceptions.IncorrectCellLabel):
+        return None
+
+
+def ajouter_lignes(sheet_name, lignes, snap=None):
+    """
+    Ajoute des lignes (listes dans l'ordre de l'en-tête) en un seul append_rows
+    et les reporte dans l'instantané quand il est à jour.
+    """
+    if not lignes:
+        return
+    if snap is None:
+        # Instantané en cache (s'il y en a un) : il sera complété si toujours à jour
+        with _instantanes_lock:
+            snap = _instantanes.get(sheet_name)
+    try:
+        reponse = safe_call(get_worksheet(sheet_name).append_rows, lignes, value_input_option="USER_ENTERED")
+    except disjoncteur.ServiceIndisponible:
+        # Rien n'est parti : l'ajout sera rejoué au rétablissement du service
+        mettre_en_attente(sheet_name, lignes)
+        return
+    premiere = _num_lignes_ajoutees(reponse)
+
+    def appliquer(s):
+        if premiere != len(s["lignes"]) + 2:
+            return False  # des lignes inconnues se sont intercalées : instantané à relire
+        largeur = len(s["entetes"])
+        for ligne in lignes:
+            ligne = ["" if v is None else str(v) for v in ligne]
+            s["lignes"].append(ligne + [""] * (largeur - len(ligne)))
+        s["index_id"] = None
+        return range(premiere, premiere + len(lignes))
+
+    _apres_ecriture(sheet_name, snap, appliquer)
+
+
+# --- Écritures en attente (disjoncteur ouvert) ---
+# Seuls les ajouts de lignes sont mis en file : ils ne dépendent pas de l'état de
+# la feuille. Les modifications de lignes existantes, soumises au contrôle de
+# concurrence, échouent avec ServiceIndisponible. La file est partagée par les
+# workers et vidée dans l'ordre dès que le disjoncteur se referme.
+
+local_store.register_schema("""
+CREATE TABLE IF NOT EXISTS ecritures_en_attente (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    feuille TEXT NOT NULL,
+    lignes TEXT NOT NULL,
+    cree REAL NOT NULL,
+    envoi REAL
+);
+""")
+
+ENVOI_DELAI_MAX = 300  # secondes ; au-delà un envoi non confirmé est repris
+_rejeu_lock = Lock()
+_rejeu_thread = None
+
+
+def mettre_en_attente(sheet_name, lignes):
+    """Met des lignes à ajouter en file jusqu'au rétablissement de Google Sheets."""
+    lignes = [["" if v is None else v for v in ligne] for ligne in lignes]
+    with local_store.transaction() as conn:
+        conn.execute(
+            "INSERT INTO ecritures_en_attente (feuille, lignes, cree) VALUES (?, ?, ?)",
+            (sheet_name, json.dumps(lignes, default=str), time.time()),
+        )
+    logging.warning(f"Sheets indisponible : {len(lignes)} ligne(s) de {sheet_name} mises en attente")
+
+
+def nb_ecritures_en_attente():
+    with local_store.lecture() as conn:
+        return conn.execute("SELECT COUNT(*) FROM ecritures_en_attente").fetchone()[0]
+
+
+def _reclamer_ecriture():
+    maintenant = time.time()
+    with local_store.transaction() as conn:
+        ligne = conn.execute(
+            "SELECT id, feuille, lignes FROM ecritures_en_attente "
+            "WHERE envoi IS NULL OR envoi < ? ORDER BY id LIMIT 1",
+            (maintenant - ENVOI_DELAI_MAX,),
+        ).fetchone()
+        if ligne is None:
+            return None
+        conn.execute("UPDATE ecritures_en_attente SET envoi = ? WHERE id = ?", (maintenant, ligne[0]))
+    return ligne[0], ligne[1], json.loads(ligne[2])
+
+
+def rejouer_ecritures():
+    """Envoie les ajouts en attente, dans l'ordre ; s'arrête à la première erreur."""
+    envoyees = 0
+    while True:
+        reclame = _reclamer_ecriture()
+        if reclame is None:
+            break
+        id_ecriture, feuille, lignes = reclame
+        try:
+            reponse = safe_call(get_worksheet(feuille).append_rows, lignes, value_input_option="USER_ENTERED")
+        except Exception as e:
+            with local_store.transaction() as conn:
+                conn.execute("UPDATE ecritures_en_attente SET envoi = NULL WHERE id = ?", (id_ecriture,))
+            logging.warning(f"Rejeu des écritures en attente interrompu : {e}")
+            break
+        with local_store.transaction() as conn:
+            conn.execute("DELETE FROM ecritures_en_attente WHERE id = ?", (id_ecriture,))
+        _apres_ecriture(feuille)
+        envoyees += 1
+    if envoyees:
+        logging.info(f"✅ {envoyees} écriture(s) en attente envoyée(s) à Google Sheets")
+    return envoyees
+
+
+@disjoncteur.au_retablissement
+def demarrer_rejeu():
+    """Lance le rejeu de la file dans un thread (un seul par processus)."""
+    global _rejeu_thread
+    with _rejeu_lock:
+        if _rejeu_thread is not None and _rejeu_thread.is_alive():
+            return
+        _rejeu_thread = threading.Thread(target=rejouer_ecritures, name="rejeu-ecritures", daemon=True)
+        _rejeu_thread.start()
+
+
+metriques.jauge("caisse_ecritures_en_attente", "Ajouts de lignes en file en attendant Google Sheets",
+                lambda: nb_ecritures_en_attente())
+metriques.jauge("caisse_disjoncteur_ouvert", "1 si le disjoncteur Sheets est ouvert ou semi-ouvert",
+                lambda: int(disjoncteur.etat()["etat"] != disjoncteur.FERME))
+
+
+def etat_degrade():
+    """
+    Pour le bandeau des pages : None si tout va bien, sinon {"disjoncteur",
+    "perime_depuis", "en_attente"}. Relance le rejeu si des écritures attendent
+    alors que le service répond.
+    """
+    etat = disjoncteur.etat()
+    en_attente = nb_ecritures_en_attente()
+    perime = donnees_perimees_depuis()
+    if en_attente and etat["etat"] == disjoncteur.FERME:
+        demarrer_rejeu()
+    if etat["etat"] == disjoncteur.FERME and not en_attente and perime is None:
+        return None
+    return {
+        "disjoncteur": etat["etat"],
+        "perime_depuis": datetime.fromtimestamp(perime).strftime("%H:%M") if perime else None,
+        "en_attente": en_attente,
+    }
+
+
+def mettre_a_jour_ligne(sheet_name, num_ligne, changements, attendu=None, snap=None):
+    """
+    Met à jour en place les colonnes `changements` (dict) de la ligne `num_ligne`.
+
+    Le contrôle de concurrence compare la ligne aux valeurs `attendu` (par défaut
+    celles de l'instantané) : si la version de la feuille n'a pas bougé depuis
+    l'instantané, la ligne en cache fait foi et seul le batch_update part ; sinon
+    la ligne est relue (petite plage) avant comparaison. En cas d'écart,
+    ConflitModification est levée. Retourne le nombre de cellules écrites.
+    """
+    snap = snap or get_instantane(sheet_name)
+    entetes = snap["entetes"]
+    inconnues = [col for col in changements if col not in entetes]
+    if inconnues:
+        raise ValueError(f"Colonnes inconnues dans {sheet_name} : {', '.join(inconnues)}")
+    if not 2 <= num_ligne < len(snap["lignes"]) + 2:
+        raise ValueError(f"Ligne {num_ligne} absente de {sheet_name}")
+    cache = snap["lignes"][num_ligne - 2]
+    if attendu is None:
+        attendu = dict(zip(entetes, cache))
+
+    ws = get_worksheet(sheet_name)
+    if version_feuille(sheet_name) == snap["version"]:
+        actuelle = list(cache)
+    else:
+        fin = gspread.utils.rowcol_to_a1(num_ligne, len(entetes))
+        plage = safe_call(ws.get, f"A{num_ligne}:{fin}")
+        actuelle = list(plage[0]) if plage else []
+        actuelle += [""] * (len(entetes) - len(actuelle))
+    actuelle_dict = dict(zip(entetes, actuelle))
+
+    for col, valeur in attendu.items():
+        if col in actuelle_dict and not _cellule_egale(actuelle_dict[col], valeur):
+            invalider_instantane(sheet_name)
+            raise ConflitModification(
+                f"La ligne {num_ligne} de {sheet_name} a été modifiée entre-temps ({col}), veuillez réessayer."
+            )
+
+    cellules = []
+    for col, valeur in changements.items():
+        if _cellule_egale(actuelle_dict[col], valeur):
+            continue
+        pos = entetes.index(col)
+        cellules.append({"range": gspread.utils.rowcol_to_a1(num_ligne, pos + 1),
+                         "values": [["" if valeur is None else valeur]]})
+        actuelle[pos] = "" if valeur is None else str(valeur)
+    if not cellules:
+        return 0
+    safe_call(ws.batch_update, cellules, value_input_option="USER_ENTERED")
+
+    def appliquer(s):
+        s["lignes"][num_ligne - 2] = actuelle
+        return [num_ligne]
+
+    _apres_ecriture(sheet_name, snap, appliquer)
+    return len(cellules)
+
+
+def trouver_ligne(snap, **criteres):
+    """Numéro de la première ligne de l'instantané dont les colonnes valent `criteres` (sinon None)."""
+    entetes = snap["entetes"]
+    positions = [(entetes.index(col), str(val).strip()) for col, val in criteres.items() if col in entetes]
+    if len(positions) != len(criteres):
+        return None
+    for num, row in enumerate(snap["lignes"], start=2):
+        if all(str(row[pos]).strip() == val for pos, val in positions):
+            return num
+    return None
+
+
+# --- Index ID -> ligne des registres (Paiements, Depenses) ---
+# Construit à la demande sur l'instantané du registre, il en suit donc les
+# ajouts et les modifications.
+
+def get_index_lignes(sheet_name):
+    """Retourne (instantané, index {ID: numéro de ligne}) d'un registre."""
+    snap = get_instantane(sheet_name)
+    with _instantanes_lock:
+        if snap["index_id"] is None:
+            index = {}
+            if "ID" in snap["entetes"]:
+                col_id = snap["entetes"].index("ID")
+                for num, row in enumerate(snap["lignes"], start=2):
+                    id_ligne = _as_id(row[col_id])
+                    if id_ligne is not None and id_ligne not in index:
+                        index[id_ligne] = num
+            snap["index_id"] = index
+        return snap, snap["index_id"]
+
+
+def lire_ligne_par_id(sheet_name, id_ligne):
+    """Retourne l'enregistrement (dict colonne -> valeur) portant cet ID, ou None."""
+    snap, index = get_index_lignes(sheet_name)
+    num = index.get(_as_id(id_ligne))
+    if num is None:
+        return None
+    return dict(zip(snap["entetes"], snap["lignes"][num - 2]))
+
+
+def ajouter_ligne_registre(sheet_name, donnees):
+    """
+    Ajoute un enregistrement (dict) à un registre en respectant l'ordre de l'en-tête,
+    lui attribue un ID et l'inscrit dans l'instantané. Retourne l'ID attribué.
+    """
+    snap, index = get_index_lignes(sheet_name)
+    entetes = snap["entetes"]
+    id_ligne = None
+    if "ID" in entetes:
+        id_ligne = allouer_ids(sheet_name, plancher=max(index, default=0))
+        donnees = dict(donnees, ID=id_ligne)
+    ligne = ["" if donnees.get(col) is None else donnees.get(col) for col in entetes]
+    ajouter_lignes(sheet_name, [ligne], snap=snap)
+    return id_ligne
+
+
+def modifier_ligne_par_id(sheet_name, id_ligne, changements, attendu=None):
+    """
+    Modifie en place les colonnes `changements` (dict) de l'enregistrement `id_ligne`
+    (un seul batch_update des cellules modifiées, voir mettre_a_jour_ligne).
+
+    `attendu` : valeurs lues par l'utilisateur (champs cachés du formulaire). Sans
+    elles, seul un déplacement de la ligne depuis l'instantané est détecté.
+    """
+    snap, index = get_index_lignes(sheet_name)
+    num = index.get(_as_id(id_ligne))
+    if num is None:
+        raise ValueError(f"Enregistrement {id_ligne} introuvable dans {sheet_name}")
+    if attendu is None:
+        attendu = dict(zip(snap["entetes"], snap["lignes"][num - 2]))
+    elif "ID" in snap["entetes"]:
+        attendu = dict(attendu, ID=id_ligne)  # la ligne ne doit pas avoir bougé non plus
+    return mettre_a_jour_ligne(sheet_name, num, changements, attendu=attendu, snap=snap)
+
+
+# --- Séquences d'ID persistantes ---
+# Chaque registre a sa séquence dans la base locale partagée : l'allocation est
+# atomique entre les workers (BEGIN IMMEDIATE) et ne redescend jamais, même si
+# la feuille est réécrite. `plancher` (plus grand ID vu dans la feuille) sert à
+# amorcer la séquence et à la resynchroniser si des lignes ont été saisies à la main.
+
+local_store.register_schema(
+    "CREATE TABLE IF NOT EXISTS sequences (feuille TEXT PRIMARY KEY, valeur INTEGER NOT NULL);"
+)
+
+
+def allouer_ids(sheet_name, n=1, plancher=0):
+    """Réserve n ID consécutifs pour sheet_name et retourne le premier."""
+    with local_store.transaction() as conn:
+        row = conn.execute("SELECT valeur FROM sequences WHERE feuille = ?", (sheet_name,)).fetchone()
+        debut = max(row[0] if row else 0, int(plancher or 0)) + 1
+        conn.execute(
+            "INSERT INTO sequences (feuille, valeur) VALUES (?, ?) "
+            "ON CONFLICT(feuille) DO UPDATE SET valeur = excluded.valeur",
+            (sheet_name, debut + n - 1),
+        )
+    return debut
+
+
+def reparer_ids(sheet_name):
+    """
+    Attribue un ID de la séquence aux lignes dont l'ID est vide ou en double
+    (lignes anciennes ou saisies à la main), en n'écrivant que ces cellules (un
+    seul batch_update). La feuille est relue avant : des lignes ont pu y être
+    insérées à la main depuis le dernier instantané. Retourne le nombre corrigé.
+    """
+    invalider_instantane(sheet_name)
+    snap = get_instantane(sheet_name)
+    if "ID" not in snap["entetes"]:
+        return 0
+    col_id = snap["entetes"].index("ID")
+    vus, a_corriger = set(), []
+    for num, row in enumerate(snap["lignes"], start=2):
+        if not any(str(v).strip() for v in row):
+            continue
+        id_ligne = _as_id(row[col_id])
+        if id_ligne is None or id_ligne in vus:
+            a_corriger.append(num)
+        else:
+            vus.add(id_ligne)
+    if a_corriger:
+        debut = allouer_ids(sheet_name, len(a_corriger), plancher=max(vus, default=0))
+        mettre_a_jour_lignes(sheet_name, {num: {"ID": debut + i} for i, num in enumerate(a_corriger)}, snap)
+        logging.info(f"{len(a_corriger)} ID attribué(s) dans {sheet_name}")
+    return len(a_corriger)
+
+
+def ajouter_paiement_classe(nom_classe, etudiant, categorie, montant, date_paiement, utilisateur=None):
+    """Ajoute un paiement (par catégorie) dans la feuille 'Paiements'."""
+    return ajouter_ligne_registre("Paiements", {
+        "NomClasse": nom_classe,
+        "Etudiant": etudiant,
+        "CategoriePaiement": categorie,
+        "Montant": montant,
+        "DatePaiement": date_paiement,
+        "Utilisateur": utilisateur,
+    })
+
+
+def modifier_paiement(paiement_id, categorie, montant, date_paiement, attendu=None):
+    """
+    Modifie catégorie, montant et date d'un paiement de 'Paiements' en place.
+    `attendu` : valeurs affichées dans le formulaire (ConflitModification si elles ont changé).
+    """
+    return modifier_ligne_par_id("Paiements", paiement_id, {
+        "CategoriePaiement": categorie,
+        "Montant": montant,
+        "DatePaiement": date_paiement,
+    }, attendu=attendu)
+
+
+def ajouter_depense(categorie, description, commentaire, montant, date_depense,
+                    nom_classe="", nom_cours="", type_depense="", utilisateur=""):
+    """Ajoute une dépense dans la feuille 'Depenses'."""
+    return ajouter_ligne_registre("Depenses", {
+        "NomCours": nom_cours or "",
+        "CategorieDepense": categorie,
+        "Description": description,
+        "Montant": montant,
+        "NomClasse": nom_classe or "",
+        "TypeDepense": type_depense,
+        "Commentaire": commentaire,
+        "DateDepense": date_depense,
+        "Utilisateur": utilisateur,
+    })
+
+
+def modifier_depense(depense_id, changements, attendu=None):
+    """
+    Modifie en place les colonnes données (dict) d'une dépense de 'Depenses'.
+    `attendu` : valeurs affichées dans le formulaire (ConflitModification si elles ont changé).
+    """
+    return modifier_ligne_par_id("Depenses", depense_id, changements, attendu=attendu)
+
+
+# --- Matrice de complétion des paiements (toutes classes) ---
+# Pour chaque classe, pourcentage d'étudiants du roster ayant payé chaque
+# CategoriePaiement, chaque type d'inscription et chaque type de travaux :
+# un seul pivot sur le roster et les trois registres, mis en cache.
+
+_completion_lock = Lock()
+_completion_cache = None  # (DataFrame, horodatage)
+_completion_expiration = 300  # secondes
+
+
+def _paiements_long(df, col_rubrique, prefixe, filtre_paye=True):
+    colonnes = ["NomClasse", "Etudiant", col_rubrique]
+    if df is None or df.empty or any(c not in df.columns for c in colonnes):
+        return pd.DataFrame(columns=["NomClasse", "Etudiant", "Rubrique"])
+    if filtre_paye and "StatutPaiement" in df.columns:
+        df = df[df["StatutPaiement"].map(normalize_str) == "paye"]
+    long = pd.DataFrame({
+        "NomClasse": df["NomClasse"].astype(str).str.strip(),
+        "Etudiant": df["Etudiant"].astype(str).str.strip(),
+        "Rubrique": prefixe + df[col_rubrique].astype(str).str.strip(),
+    })
+    return long[long["Rubrique"] != prefixe]
+
+
+def calculer_matrice_completion():
+    """
+    Calcule la matrice classes x rubriques (en %) : index NomClasse, colonne
+    NbEtudiants puis une colonne par rubrique ('Catégorie : …', 'Inscription : …',
+    'Travaux : …').
+    """
+    roster = read_sheet("Classes")
+    if roster.empty or "NomClasse" not in roster.columns or "Etudiant" not in roster.columns:
+        return pd.DataFrame(columns=["NbEtudiants"])
+    roster = pd.DataFrame({
+        "NomClasse": roster["NomClasse"].astype(str).str.strip(),
+        "Etudiant": roster["Etudiant"].astype(str).str.strip(),
+    })
+    roster = roster[(roster["NomClasse"] != "") & (roster["Etudiant"] != "")].drop_duplicates()
+    effectifs = roster.groupby("NomClasse").size().rename("NbEtudiants")
+
+    paiements = pd.concat([
+        _paiements_long(read_sheet("Paiements"), "CategoriePaiement", "Catégorie : ", filtre_paye=False),
+        _paiements_long(read_sheet("Paiements_Inscriptions"), "TypeInscription", "Inscription : "),
+        _paiements_long(read_sheet("Paiements_Travaux"), "TypeTravail", "Travaux : "),
+    ], ignore_index=True)
+    # Seuls les étudiants inscrits au roster comptent, une fois par rubrique
+    paiements = paiements.merge(roster, on=["NomClasse", "Etudiant"]).drop_duplicates()
+
+    if paiements.empty:
+        return effectifs.to_frame()
+    comptes = pd.crosstab(paiements["NomClasse"], paiements["Rubrique"])
+    comptes = comptes.reindex(effectifs.index, fill_value=0)
+    pourcentages = comptes.div(effectifs, axis=0).mul(100).round(1)
+    return pd.concat([effectifs, pourcentages], axis=1).sort_index()
+
+
+def get_matrice_completion(force=False):
+    """Matrice de complétion mise en cache ; `force=True` la recalcule."""
+    global _completion_cache
+    with _completion_lock:
+        if (force or _completion_cache is None
+                or time.time() - _completion_cache[1] > _completion_expiration):
+            _completion_cache = (calculer_matrice_completion(), time.time())
+        return _completion_cache[0].copy()
+
+
+# --- Enregistrement groupé des paiements (inscriptions / travaux) ---
+
+def _enregistrer_paiements_lot(sheet_name, col_type, nom_classe, etudiants, type_paiement, montant):
+    """
+    Vérifie les statuts de tous les étudiants dans la matrice des statuts,
+    ignore ceux déjà payés (ou en double dans la demande) puis écrit tous les
+    nouveaux paiements en un seul append_rows.
+    Retourne {etudiant: "enregistre" | "deja_paye"}.
+    """
+    snap = _instantane_registre(sheet_name)
+    entetes = snap["entetes"]
+    nom_classe = str(nom_classe).strip()
+    deja_payes = {
+        etudiant for etudiant, c in _cellules_classe(sheet_name, nom_classe, type_paiement).items()
+        if c["statut"] == "Payé"
+    }
+
+    date_paiement = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    resultats, lignes = {}, []
+    for etudiant in dict.fromkeys(str(e).strip() for e in etudiants if e and str(e).strip()):
+        if etudiant in deja_payes:
+            resultats[etudiant] = "deja_paye"
+            continue
+        valeurs = {"NomClasse": nom_classe, "Etudiant": etudiant, col_type: type_paiement,
+                   "StatutPaiement": "Payé", "Montant": montant, "DatePaiement": date_paiement}
+        lignes.append([valeurs.get(col, "") for col in entetes])
+        resultats[etudiant] = "enregistre"
+
+    ajouter_lignes(sheet_name, lignes, snap=snap)
+    return resultats
+
+
+def enregistrer_paiements_inscriptions_lot(nom_classe, etudiants, type_inscription, montant=10.0):
+    """Enregistre en une écriture les paiements d'inscription d'une liste d'étudiants."""
+    return _enregistrer_paiements_lot("Paiements_Inscriptions", "TypeInscription",
+                                      nom_classe, etudiants, type_inscription, montant)
+
+
+def enregistrer_paiements_travaux_lot(nom_classe, etudiants, type_travail, montant):
+    """Enregistre en une écriture les paiements de travaux d'une liste d'étudiants."""
+    return _enregistrer_paiements_lot("Paiements_Travaux", "TypeTravail",
+                                      nom_classe, etudiants, type_travail, montant)
+
+
+# --- Matrice des statuts de paiement (étudiants × types) ---
+# Pour chaque registre de paiements étudiants, une matrice par classe :
+# {classe: {etudiant: {type: {"type", "statut", "montant", "lignes"}}}}, clés de
+# classe et de type normalisées (normalize_str). Elle est construite en un passage
+# sur l'instantané du registre, puis corrigée cellule par cellule à chaque écriture
+# de l'application (vue dérivée de l'instantané, voir _apres_ecriture).
+# Plusieurs lignes pour une même cellule (doubles saisies) sont fusionnées :
+# la cellule est payée si au moins une ligne l'est, le montant cumule les lignes payées.
+# La matrice tient aussi des compteurs par (classe, type) : payés, non payés et total
+# encaissé, ajustés par différence à chaque cellule corrigée, si bien que les pages
+# de statistiques n'ont rien à reparcourir.
+
+MATRICE_REGISTRES = {
+    "Paiements_Inscriptions": "TypeInscription",
+    "Paiements_Travaux": "TypeTravail",
+}
+
+
+def _montant(valeur):
+    try:
+        return float(str(valeur).strip().replace(",", ".") or 0)
+    except ValueError:
+        return 0.0
+
+
+def _cle_cellule(snap, col_type, num):
+    row = dict(zip(snap["entetes"], snap["lignes"][num - 2]))
+    etudiant = str(row.get("Etudiant", "")).strip()
+    if not etudiant:
+        return None
+    return normalize_str(row.get("NomClasse")), etudiant, normalize_str(row.get(col_type))
+
+
+def _recalculer_cellule(snap, col_type, cellule):
+    pos = {col: i for i, col in enumerate(snap["entetes"])}
+    statut, montant, type_brut = None, 0.0, cellule.get("type", "")
+    for num in cellule["lignes"]:
+        row = snap["lignes"][num - 2]
+        brut = str(row[pos["StatutPaiement"]]).strip() if "StatutPaiement" in pos else ""
+        if col_type in pos:
+            type_brut = type_brut or str(row[pos[col_type]]).strip()
+        if normalize_str(brut) == "paye":
+            statut = "Payé"
+            montant += _montant(row[pos["Montant"]]) if "Montant" in pos else 0.0
+        elif statut is None:
+            statut = brut or "Non payé"
+    cellule.update(type=type_brut, statut=statut or "Non payé", montant=round(montant, 2))
+
+
+def _contribuer(matrice, classe, type_norm, cellule, signe):
+    """Ajoute (signe=1) ou retire (signe=-1) la contribution d'une cellule aux compteurs."""
+    if "statut" not in cellule:
+        return
+    compteur = matrice["compteurs"].setdefault(
+        (classe, type_norm), {"payes": 0, "non_payes": 0, "total_recettes": 0.0})
+    if cellule["statut"] == "Payé":
+        compteur["payes"] += signe
+        compteur["total_recettes"] += signe * cellule["montant"]
+    else:
+        compteur["non_payes"] += signe
+
+
+def _indexer_ligne(snap, col_type, matrice, num):
+    cle = _cle_cellule(snap, col_type, num)
+    if cle is None:
+        return
+    classe, etudiant, type_norm = cle
+    cellule = matrice["classes"].setdefault(classe, {}).setdefault(etudiant, {}).setdefault(
+        type_norm, {"type": "", "lignes": []})
+    cellule["lignes"].append(num)
+    matrice["ligne_cellule"][num] = cle
+    return cellule
+
+
+def _construire_matrice(col_type):
+    def construire(snap):
+        matrice = {"classes": {}, "ligne_cellule": {}, "compteurs": {}}
+        for num in range(2, len(snap["lignes"]) + 2):
+            _indexer_ligne(snap, col_type, matrice, num)
+        for classe, etudiants in matrice["classes"].items():
+            for types in etudiants.values():
+                for type_norm, cellule in types.items():
+                    _recalculer_cellule(snap, col_type, cellule)
+                    _contribuer(matrice, classe, type_norm, cellule, 1)
+        return matrice
+    return construire
+
+
+def _patcher_matrice(col_type):
+    def patcher(snap, matrice, nums):
+        for num in nums:
+            ancienne = matrice["ligne_cellule"].pop(num, None)
+            if ancienne is not None:
+                classe, etudiant, type_norm = ancienne
+                types = matrice["classes"][classe][etudiant]
+                cellule = types[type_norm]
+                _contribuer(matrice, classe, type_norm, cellule, -1)
+                cellule["lignes"].remove(num)
+                if cellule["lignes"]:
+                    _recalculer_cellule(snap, col_type, cellule)
+                    _contribuer(matrice, classe, type_norm, cellule, 1)
+                else:
+                    del types[type_norm]
+            cle = _cle_cellule(snap, col_type, num)
+            if cle is None:
+                continue
+            classe, etudiant, type_norm = cle
+            existante = matrice["classes"].get(classe, {}).get(etudiant, {}).get(type_norm)
+            if existante is not None:
+                _contribuer(matrice, classe, type_norm, existante, -1)
+            cellule = _indexer_ligne(snap, col_type, matrice, num)
+            _recalculer_cellule(snap, col_type, cellule)
+            _contribuer(matrice, classe, type_norm, cellule, 1)
+    return patcher
+
+
+for _registre, _col_type in MATRICE_REGISTRES.items():
+    _patchs_derives["matrice_" + _col_type] = _patcher_matrice(_col_type)
+
+
+def _instantane_registre(sheet_name):
+    try:
+        return get_instantane(sheet_name)
+    except WorksheetNotFound:
+        # Registre absent : on le crée (en-tête seul) puis on relit
+        if sheet_name == "Paiements_Travaux":
+            _worksheets[sheet_name] = assure_feuille_paiements_travaux()
+        else:
+            _worksheets[sheet_name] = get_or_create_inscriptions_sheet()
+        return get_instantane(sheet_name)
+
+
+def _cellules_classe(sheet_name, nom_classe, type_paiement):
+    """
+    Retourne {etudiant: {"type", "statut", "montant"}} (copies) pour une classe et
+    un type de paiement, lus dans la matrice du registre.
+    """
+    col_type = MATRICE_REGISTRES[sheet_name]
+    snap = _instantane_registre(sheet_name)
+    type_norm = normalize_str(type_paiement)
+    with _instantanes_lock:
+        matrice = get_derive(snap, "matrice_" + col_type, _construire_matrice(col_type))
+        etudiants = matrice["classes"].get(normalize_str(nom_classe), {})
+        return {
+            etudiant: {"type": c["type"], "statut": c["statut"], "montant": c["montant"]}
+            for etudiant, types in etudiants.items()
+            for c in [types.get(type_norm)] if c is not None
+        }
+
+
+def get_statuts_paiement(sheet_name, nom_classe, type_paiement):
+    """Statut ("Payé" / autre) de chaque étudiant ayant une ligne pour ce type de paiement."""
+    return {etudiant: c["statut"] for etudiant, c in _cellules_classe(sheet_name, nom_classe, type_paiement).items()}
+
+
+def reconcilier_compteurs(sheet_name=None):
+    """
+    Relit le(s) registre(s) et reconstruit matrice et compteurs à partir de zéro.
+    Retourne la liste des écarts constatés avec les compteurs tenus en mémoire
+    [(registre, classe, type, avant, apres)], journalisés s'il y en a.
+    """
+    ecarts = []
+    for registre in ([sheet_name] if sheet_name else list(MATRICE_REGISTRES)):
+        nom = "matrice_" + MATRICE_REGISTRES[registre]
+        with _instantanes_lock:
+            snap = _instantanes.get(registre)
+            avant = dict(snap["derives"][nom]["compteurs"]) if snap and nom in snap["derives"] else None
+        invalider_instantane(registre)
+        snap = _instantane_registre(registre)
+        with _instantanes_lock:
+            apres = get_derive(snap, nom, _construire_matrice(MATRICE_REGISTRES[registre]))["compteurs"]
+            if avant is None:
+                continue
+            for cle in set(avant) | set(apres):
+                vide = {"payes": 0, "non_payes": 0, "total_recettes": 0.0}
+                a, b = avant.get(cle, vide), apres.get(cle, vide)
+                if (a["payes"], a["non_payes"], round(a["total_recettes"], 2)) != \
+                        (b["payes"], b["non_payes"], round(b["total_recettes"], 2)):
+                    ecarts.append((registre, cle[0], cle[1], dict(a), dict(b)))
+    for ecart in ecarts:
+        logging.warning("Compteurs de paiements corrigés : %s", ecart)
+    return ecarts
+
+
+def _resume_paiements(sheet_name, nom_classe, type_paiement):
+    """(cellules de la classe, compteurs) lus sur le même instantané."""
+    col_type = MATRICE_REGISTRES[sheet_name]
+    snap = _instantane_registre(sheet_name)
+    classe, type_norm = normalize_str(nom_classe), normalize_str(type_paiement)
+    with _instantanes_lock:
+        matrice = get_derive(snap, "matrice_" + col_type, _construire_matrice(col_type))
+        cellules = {
+            etudiant: {"type": c["type"], "statut": c["statut"], "montant": c["montant"]}
+            for etudiant, types in matrice["classes"].get(classe, {}).items()
+            for c in [types.get(type_norm)] if c is not None
+        }
+        compteur = matrice["compteurs"].get((classe, type_norm), {})
+        return cellules, {
+            "payes": compteur.get("payes", 0),
+            "non_payes": compteur.get("non_payes", 0),
+            "total_recettes": round(compteur.get("total_recettes", 0.0), 2),
+        }
+
+
+def resumes_paiements_toutes_classes(sheet_name, types, classes=None):
+    """
+    Résumés (même forme que get_payment_summary / get_payment_summary_travaux) de
+    toutes les paires (classe, type), lus sur un seul instantané du registre.
+    `classes` par défaut : catalogue des classes. Retourne {(classe, type): résumé}.
+    """
+    col_type = MATRICE_REGISTRES[sheet_name]
+    classes = list(classes) if classes is not None else get_classes()
+    snap = _instantane_registre(sheet_name)
+    resumes = {}
+    with _instantanes_lock:
+        matrice = get_derive(snap, "matrice_" + col_type, _construire_matrice(col_type))
+        for nom_classe in classes:
+            etudiants = matrice["classes"].get(normalize_str(nom_classe), {})
+            for type_paiement in types:
+                type_norm = normalize_str(type_paiement)
+                compteur = matrice["compteurs"].get((normalize_str(nom_classe), type_norm), {})
+                cellules = {e: t[type_norm] for e, t in etudiants.items() if type_norm in t}
+                if sheet_name == "Paiements_Travaux":
+                    detail = {e: {"type_travail": c["type"], "statut": c["statut"], "montant": c["montant"]}
+                              for e, c in cellules.items()}
+                else:
+                    detail = {e: c["statut"] for e, c in cellules.items()}
+                resumes[(nom_classe, type_paiement)] = {
+                    "payes": compteur.get("payes", 0),
+                    "non_payes": compteur.get("non_payes", 0),
+                    "total_recettes": round(compteur.get("total_recettes", 0.0), 2),
+                    "detail": detail,
+                }
+    return resumes
+
+
+# --- Bascule du statut de paiement (admin) ---
+# La matrice des statuts sert de localisateur de lignes : chaque cellule connaît
+# les numéros de ligne qui la composent. Une bascule (ou un lot de bascules)
+# n'écrit que les cellules StatutPaiement / Montant concernées, en un seul
+# batch_update, plus un append_rows pour les étudiants sans ligne.
+
+def mettre_a_jour_lignes(sheet_name, changements_par_ligne, snap):
+    """
+    Met à jour plusieurs lignes en un seul batch_update : {num_ligne: {col: valeur}}.
+    L'instantané doit être à jour (sinon ConflitModification, à relancer sur un
+    instantané frais). Retourne le nombre de cellules écrites.
+    """
+    entetes = snap["entetes"]
+    if version_feuille(sheet_name) != snap["version"]:
+        invalider_instantane(sheet_name)
+        raise ConflitModification(f"{sheet_name} a été modifiée entre-temps, veuillez réessayer.")
+    cellules, nouvelles = [], {}
+    for num, changements in changements_par_ligne.items():
+        ligne = list(snap["lignes"][num - 2])
+        for col, valeur in changements.items():
+            pos = entetes.index(col)
+            if _cellule_egale(ligne[pos], valeur):
+                continue
+            cellules.append({"range": gspread.utils.rowcol_to_a1(num, pos + 1),
+                             "values": [["" if valeur is None else valeur]]})
+            ligne[pos] = "" if valeur is None else str(valeur)
+            nouvelles[num] = ligne
+    if not cellules:
+        return 0
+    safe_call(get_worksheet(sheet_name).batch_update, cellules, value_input_option="USER_ENTERED")
+
+    def appliquer(s):
+        for num, ligne in nouvelles.items():
+            s["lignes"][num - 2] = ligne
+        return list(nouvelles)
+
+    _apres_ecriture(sheet_name, snap, appliquer)
+    return len(cellules)
+
+
+def toggle_payment_status_lot(nom_classe, etudiants, type_paiement, new_status, montant=10.0,
+                              sheet_name="Paiements_Inscriptions"):
+    """
+    Passe les étudiants au statut `new_status` ("Payé" / "Non payé") pour ce type.
+    Marquer payé : la ligne existante passe à "Payé" (avec `montant` si elle n'en
+    avait pas), ou une ligne est ajoutée. Marquer non payé : toutes les lignes de
+    la cellule passent à "Non payé", montant remis à 0.
+    Retourne {etudiant: "modifie" | "ajoute" | "inchange"}.
+    """
+    col_type = MATRICE_REGISTRES[sheet_name]
+    payer = new_status == "Payé"
+    etudiants = list(dict.fromkeys(str(e).strip() for e in etudiants if e and str(e).strip()))
+    type_norm = normalize_str(type_paiement)
+
+    for tentative in range(2):
+        snap = _instantane_registre(sheet_name)
+        entetes = snap["entetes"]
+        pos_statut, pos_montant = entetes.index("StatutPaiement"), entetes.index("Montant")
+        resultats, changements, ajouts = {}, {}, []
+        with _instantanes_lock:
+            matrice = get_derive(snap, "matrice_" + col_type, _construire_matrice(col_type))
+            classe = matrice["classes"].get(normalize_str(nom_classe), {})
+            for etudiant in etudiants:
+                cellule = classe.get(etudiant, {}).get(type_norm)
+                if cellule is None:
+                    if payer:
+                        valeurs = {"NomClasse": nom_classe, "Etudiant": etudiant, col_type: type_paiement,
+                                   "StatutPaiement": "Payé", "Montant": montant,
+                                   "DatePaiement": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+                        ajouts.append([valeurs.get(col, "") for col in entetes])
+                        resultats[etudiant] = "ajoute"
+                    else:
+                        resultats[etudiant] = "inchange"
+                    continue
+                if (cellule["statut"] == "Payé") == payer:
+                    resultats[etudiant] = "inchange"
+                    continue
+                if payer:
+                    num = cellule["lignes"][0]
+                    ligne = snap["lignes"][num - 2]
+                    changements[num] = {"StatutPaiement": "Payé"}
+                    if not _montant(ligne[pos_montant]):
+                        changements[num]["Montant"] = montant
+                else:
+                    for num in cellule["lignes"]:
+                        if normalize_str(snap["lignes"][num - 2][pos_statut]) == "paye":
+                            changements[num] = {"StatutPaiement": "Non payé", "Montant": 0}
+                resultats[etudiant] = "modifie"
+        try:
+            mettre_a_jour_lignes(sheet_name, changements, snap)
+        except ConflitModification:
+            if tentative:
+                raise
+            continue
+        ajouter_lignes(sheet_name, ajouts, snap=snap)
+        return resultats
+
+
+def toggle_payment_status(nom_classe, etudiant, type_inscription, new_status, montant=10.0,
+                          sheet_name="Paiements_Inscriptions"):
+    """Bascule le statut de paiement d'un étudiant (voir toggle_payment_status_lot)."""
+    return toggle_payment_status_lot(nom_classe, [etudiant], type_inscription, new_status,
+                                     montant=montant, sheet_name=sheet_name)[str(etudiant).strip()]
+
+
+# --- Effectifs par classe (roster) ---
+# Vue dérivée de l'instantané de 'Classes' : {classe: Counter(etudiant)} et la
+# liste triée sans doublons de chaque classe, calculée à la demande. Construite
+# une fois par instantané puis corrigée ligne à ligne à chaque écriture de
+# l'application (ajout ou renommage d'étudiants) : les listes d'étudiants ne
+# retéléchargent pas la feuille sur les requêtes suivantes.
+
+def _cle_roster(snap, num):
+    row = dict(zip(snap["entetes"], snap["lignes"][num - 2]))
+    classe, etudiant = str(row.get("NomClasse", "")).strip(), str(row.get("Etudiant", "")).strip()
+    return (classe, etudiant) if classe and etudiant else None
+
+
+def _roster_ajouter(roster, num, cle):
+    classe, etudiant = cle
+    roster["ligne_cle"][num] = cle
+    roster["comptes"].setdefault(classe, Counter())[etudiant] += 1
+    roster["tries"].pop(classe, None)
+
+
+def _construire_roster(snap):
+    roster = {"comptes": {}, "tries": {}, "ligne_cle": {}}
+    for num in range(2, len(snap["lignes"]) + 2):
+        cle = _cle_roster(snap, num)
+        if cle is not None:
+            _roster_ajouter(roster, num, cle)
+    return roster
+
+
+def _patcher_roster(snap, roster, nums):
+    for num in nums:
+        ancienne = roster["ligne_cle"].pop(num, None)
+        if ancienne is not None:
+            classe, etudiant = ancienne
+            comptes = roster["comptes"][classe]
+            comptes[etudiant] -= 1
+            if comptes[etudiant] <= 0:
+                del comptes[etudiant]
+            roster["tries"].pop(classe, None)
+        cle = _cle_roster(snap, num)
+        if cle is not None:
+            _roster_ajouter(roster, num, cle)
+
+
+_patchs_derives["roster"] = _patcher_roster
+
+
+def get_roster_classe(nom_classe):
+    """Liste triée et sans doublons des étudiants d'une classe (depuis le cache)."""
+    snap = get_instantane("Classes")
+    classe = str(nom_classe).strip()
+    with _instantanes_lock:
+        roster = get_derive(snap, "roster", _construire_roster)
+        tries = roster["tries"].get(classe)
+        if tries is None:
+            tries = sorted(roster["comptes"].get(classe, ()))
+            roster["tries"][classe] = tries
+        return list(tries)
+
+
+# --- Lectures indépendantes en parallèle ---
+# Quand les lectures d'une page ne peuvent pas être regroupées en un seul appel
+# (chemins get_as_dataframe / get_all_records mélangés), elles partent ensemble
+# sur un petit pool de threads borné : la page attend la lecture la plus lente et
+# non la somme de toutes. Le pool est créé paresseusement (après le fork des
+# workers gunicorn) ; chaque lecture passe toujours par les fonctions habituelles.
+
+LECTURES_PARALLELES = 4
+
+_pool_lectures = None
+_pool_lectures_pid = None
+_pool_lectures_lock = Lock()
+_dans_pool = threading.local()
+
+
+def _get_pool_lectures():
+    global _pool_lectures, _pool_lectures_pid
+    with _pool_lectures_lock:
+        if _pool_lectures is None or _pool_lectures_pid != os.getpid():
+            _pool_lectures = ThreadPoolExecutor(max_workers=LECTURES_PARALLELES, thread_name_prefix="lecture")
+            _pool_lectures_pid = os.getpid()
+        return _pool_lectures
+
+
+def _lecture_marquee(fonction, args, niveau, perimes, appels, chronologie):
+    _dans_pool.actif = True
+    debut_requete()
+    avant = metriques.appels_requete()
+    metriques.suivre_chronologie(chronologie)
+    try:
+        with quota.priorite(niveau):  # même priorité de quota que le thread appelant
+            return fonction(*args)
+    finally:
+        _dans_pool.actif = False
+        metriques.suivre_chronologie(None)
+        appels.append(metriques.appels_requete() - avant)
+        if donnees_perimees_depuis() is not None:
+            perimes.append({"time": donnees_perimees_depuis()})
+
+
+def lire_en_parallele(lectures):
+    """
+    Exécute des lectures indépendantes en parallèle (au plus LECTURES_PARALLELES
+    à la fois). `lectures` : {nom: fonction} ou {nom: (fonction, arg1, ...)}.
+    Retourne {nom: résultat}. Comme en séquentiel, si une lecture échoue, son
+    exception est relevée (la première dans l'ordre des lectures) une fois toutes
+    les lectures terminées.
+    """
+    appels = {
+        nom: (lecture[0], tuple(lecture[1:])) if isinstance(lecture, tuple) else (lecture, ())
+        for nom, lecture in lectures.items()
+    }
+    # Appel depuis une lecture déjà parallélisée, ou une seule lecture : en direct
+    if getattr(_dans_pool, "actif", False) or len(appels) <= 1:
+        return {nom: fonction(*args) for nom, (fonction, args) in appels.items()}
+
+    pool = _get_pool_lectures()
+    niveau = quota.priorite_courante()
+    perimes, nb_appels = [], []
+    chronologie = metriques.chronologie()
+    futurs = {nom: pool.submit(_lecture_marquee, fonction, args, niveau, perimes, nb_appels, chronologie)
+              for nom, (fonction, args) in appels.items()}
+    wait(futurs.values())
+    # Remonter au thread de la requête le mode dégradé et les appels Sheets faits pour elle
+    for snap in perimes:
+        _signaler_perime(snap)
+    metriques.ajouter_appels(sum(nb_appels))
+    for futur in futurs.values():
+        if futur.exception() is not None:
+            raise futur.exception()
+    return {nom: futur.result() for nom, futur in futurs.items()}
+
+
+# --- Démarrage des workers (préchargement gunicorn) ---
+# Avec preload_app (gunicorn.conf.py), le maître importe l'application une seule
+# fois sans toucher au réseau ; chaque worker, après le fork, vérifie les feuilles
+# (un seul worker par période grâce à la base locale) puis précharge les
+# instantanés les plus consultés avant de servir sa première requête.
+
+local_store.register_schema(
+    "CREATE TABLE IF NOT EXISTS demarrage (etape TEXT PRIMARY KEY, fait REAL NOT NULL);"
+)
+
+INIT_VALIDITE = 3600  # secondes pendant lesquelles la vérification des feuilles vaut pour tous les workers
+REGISTRES_IDS = ("Paiements", "Depenses")  # registres dont les ID sont réparés au démarrage
+PRECHAUFFAGE_FEUILLES = ("Classes", "Paiements_Inscriptions", "Paiements_Travaux", "Paiements", "Depenses", "Recettes")
+PRECHAUFFAGE_ATTENTE_MAX = float(os.environ.get("PRECHAUFFAGE_ATTENTE_MAX", "20"))
+
+_demarrage_lock = Lock()
+_initialise_pid = None
+
+
+def apres_fork():
+    """À appeler dans le processus enfant juste après le fork : oublie l'état hérité du parent."""
+    global _init_done, _cached_existing_ws, _initialise_pid
+    _worksheets.clear()
+    _instantanes.clear()
+    _cached_existing_ws = None
+    _init_done = False
+    _initialise_pid = None
+
+
+def _reserver_etape(etape):
+    """Réserve l'étape pour ce worker si personne ne l'a faite depuis INIT_VALIDITE."""
+    maintenant = time.time()
+    with local_store.transaction() as conn:
+        ligne = conn.execute("SELECT fait FROM demarrage WHERE etape = ?", (etape,)).fetchone()
+        if ligne and maintenant - ligne[0] < INIT_VALIDITE:
+            return False
+        conn.execute(
+            "INSERT INTO demarrage (etape, fait) VALUES (?, ?) "
+            "ON CONFLICT(etape) DO UPDATE SET fait = excluded.fait",
+            (etape, maintenant),
+        )
+    return True
+
+
+def assurer_initialisation():
+    """
+    Vérifie une fois par processus que les feuilles requises existent (init_all_files)
+    et que chaque ligne des registres a un ID (reparer_ids). Si un autre worker l'a
+    fait récemment, on s'appuie sur sa trace sans appel API.
+    """
+    global _initialise_pid
+    if _initialise_pid == os.getpid():
+        return
+    with _demarrage_lock:
+        if _initialise_pid == os.getpid():
+            return
+        if _reserver_etape("feuilles"):
+            try:
+                init_all_files()
+            except Exception:
+                with local_store.transaction() as conn:
+                    conn.execute("DELETE FROM demarrage WHERE etape = 'feuilles'")
+                raise
+        if _reserver_etape("ids"):
+            # Lignes sans ID (antérieures à la séquence, ou saisies à la main) :
+            # sans ID, modifier_ligne_par_id ne peut pas les atteindre
+            for registre in REGISTRES_IDS:
+                try:
+                    reparer_ids(registre)
+                except Exception as e:
+                    logging.error(f"Réparation des ID de {registre} impossible : {e}")
+        _initialise_pid = os.getpid()
+
+
+def prechauffer(feuilles=PRECHAUFFAGE_FEUILLES, attente_max=PRECHAUFFAGE_ATTENTE_MAX):
+    """
+    Charge les instantanés des feuilles les plus consultées dans un thread de fond
+    et l'attend au plus `attente_max` secondes. Retourne True si tout est chargé.
+    """
+    def charger():
+        with quota.priorite("fond"):
+            for nom in feuilles:
+                try:
+                    get_instantane(nom)
+                except Exception as e:
+                    logging.warning(f"Préchauffage de {nom} impossible : {e}")
+
+    thread = threading.Thread(target=charger, name="prechauffage", daemon=True)
+    debut = time.time()
+    thread.start()
+    thread.join(attente_max)
+    termine = not thread.is_alive()
+    logging.info(f"Préchauffage du cache {'terminé' if termine else 'poursuivi en arrière-plan'} "
+                 f"après {time.time() - debut:.1f}s (pid {os.getpid()})")
+    return termine
+
+
+def demarrer_worker(prechauffage=True):
+    """Prépare un worker avant qu'il ne serve : feuilles requises puis cache préchargé."""
+    try:
+        assurer_initialisation()
+    except Exception as e:
+        # La première requête retentera (voir create_app)
+        logging.error(f"Initialisation des feuilles impossible au démarrage : {e}")
+        return
+    if prechauffage:
+        prechauffer()
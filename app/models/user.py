@@ -1,26 +1,69 @@
 # app/models/users.py
+"""
+Comptes utilisateurs (data/users.json).
+
+Les comptes sont gardés en mémoire, indexés par nom d'utilisateur : une
+connexion ou une vérification de mot de passe ne relit pas le fichier. Un
+simple os.stat par accès détecte une modification (faite par l'autre worker
+ou à la main) : la liste n'est relue que si la date, la taille ou l'inode du
+fichier a changé. Les écritures se font sous verrou de fichier (lecture,
+modification, écriture sans interférence entre workers) et remplacent le
+fichier d'un coup (fichier temporaire puis os.replace).
+"""
 import os
 import json
+import threading
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    import fcntl
+except ImportError:  # Windows (exécutable PyInstaller)
+    fcntl = None
+    import msvcrt
+
 # Dossiers et fichiers
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_FOLDER = os.path.join(BASE_DIR, "..", "data")
 USERS_FILE = os.path.join(DATA_FOLDER, "users.json")
+LOCK_FILE = USERS_FILE + ".lock"
 
+_cache_lock = threading.Lock()
+_cache_signature = None
+_cache_users = []     # liste dans l'ordre du fichier
+_cache_index = {}     # {username: utilisateur}
 
-def _ensure_users_file():
-    """Assure que le dossier et le fichier utilisateurs existent."""
-    if not os.path.exists(DATA_FOLDER):
-        os.makedirs(DATA_FOLDER)
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False)
 
+def _signature():
+    """(mtime, taille, inode) du fichier, ou None s'il n'existe pas."""
+    try:
+        st = os.stat(USERS_FILE)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
 
-def load_users():
-    """Charge la liste des utilisateurs depuis users.json."""
-    _ensure_users_file()
+
+@contextmanager
+def _verrou_fichier():
+    """Verrou exclusif entre processus (et threads) pour les écritures de users.json."""
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    with open(LOCK_FILE, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _lire_fichier():
     try:
         with open(USERS_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)
@@ -31,44 +74,93 @@ def load_users():
     return data
 
 
-def save_users(users_list):
-    """Enregistre la liste des utilisateurs dans users.json."""
+def _ecrire_fichier(users_list):
+    """Remplace users.json d'un coup (à appeler sous _verrou_fichier)."""
     os.makedirs(DATA_FOLDER, exist_ok=True)
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
+    temporaire = f"{USERS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporaire, "w", encoding="utf-8") as f:
         json.dump(users_list, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporaire, USERS_FILE)
+    _installer(users_list, _signature())
+
+
+def _installer(users_list, signature):
+    global _cache_signature, _cache_users, _cache_index
+    index = {}
+    for user in users_list:
+        index.setdefault(user.get("username"), user)  # le premier l'emporte, comme l'ancien parcours
+    with _cache_lock:
+        _cache_users, _cache_index, _cache_signature = users_list, index, signature
+
+
+def _ensure_users_file():
+    """Assure que le dossier et le fichier utilisateurs existent."""
+    if not os.path.exists(USERS_FILE):
+        with _verrou_fichier():
+            if not os.path.exists(USERS_FILE):
+                _ecrire_fichier([])
+
+
+def _index_a_jour():
+    """Index {username: utilisateur}, relu seulement si le fichier a changé depuis la dernière lecture."""
+    signature = _signature()
+    if signature is None:
+        _ensure_users_file()
+        signature = _signature()
+    if signature != _cache_signature:
+        # Signature prise avant la lecture : une écriture concurrente sera vue à l'accès suivant
+        _installer(_lire_fichier(), signature)
+    return _cache_index
+
+
+def load_users():
+    """Charge la liste des utilisateurs depuis users.json (copie, modifiable par l'appelant)."""
+    _index_a_jour()
+    return [dict(user) for user in _cache_users]
+
+
+def save_users(users_list):
+    """Enregistre la liste des utilisateurs dans users.json."""
+    with _verrou_fichier():
+        _ecrire_fichier(users_list)
 
 
 def get_user_by_username(username):
     """Retourne le dictionnaire utilisateur si trouvé, sinon None."""
-    users = load_users()
-    for user in users:
-        if user.get("username") == username:
-            return user
-    return None
+    user = _index_a_jour().get(username)
+    return dict(user) if user is not None else None
 
 
 def create_user(username, password, role="user"):
     """Crée un nouvel utilisateur et l'ajoute au fichier JSON."""
-    if get_user_by_username(username):
-        raise ValueError(f"Utilisateur '{username}' déjà existant.")
-    
     hashed_password = generate_password_hash(password, method="pbkdf2:sha256")
     user = {
         "username": username,
         "password": hashed_password,
         "role": role
     }
-    users = load_users()
-    users.append(user)
-    save_users(users)
+    # Relecture, vérification et écriture sous le même verrou : pas de doublon entre workers
+    with _verrou_fichier():
+        users = _lire_fichier()
+        if any(u.get("username") == username for u in users):
+            raise ValueError(f"Utilisateur '{username}' déjà existant.")
+        users.append(user)
+        _ecrire_fichier(users)
     return user
 
 
 def create_admin_default():
     """Crée un admin par défaut si aucun n'existe."""
-    users = load_users()
-    admin_exists = any(u.get("role") == "admin" for u in users)
-    if not admin_exists:
+    if any(u.get("role") == "admin" for u in _index_a_jour().values()):
+        print("[INFO] Un utilisateur admin existe déjà.")
+        return
+    with _verrou_fichier():
+        users = _lire_fichier()
+        if any(u.get("role") == "admin" for u in users):
+            print("[INFO] Un utilisateur admin existe déjà.")
+            return
         admin_password = "adminFST@=="  # À sécuriser en prod
         admin_user = {
             "username": "admin",
@@ -76,10 +168,8 @@ def create_admin_default():
             "role": "admin"
         }
         users.append(admin_user)
-        save_users(users)
+        _ecrire_fichier(users)
         print(f"[INFO] Admin créé : username='admin', mot de passe clair : {admin_password}")
-    else:
-        print("[INFO] Un utilisateur admin existe déjà.")
 
 
 # ===============================
@@ -1,7 +1,11 @@
 import logging
+from datetime import datetime
 from flask import Blueprint, render_template, send_file, request, redirect, url_for, flash, make_response
 from app.routes.auth import login_required
 from app.models import storage_gsheets as storage
+from app.utils.idempotence import idempotent
+from app.utils import taches
+from app.routes.taches import deposer_et_suivre
 from reportlab.lib.pagesizes import A4, landscape
 from io import BytesIO
 import pandas as pd
@@ -18,22 +22,76 @@ classes_bp = Blueprint("classes", __name__, template_folder="../templates")
 @classes_bp.route('/choisir_classe_etudiant')
 @login_required
 def choisir_classe_etudiant():
-    classes = storage.lire_classes()
+    classes = storage.get_classes()
     return render_template('choisir_classe.html', classes=classes, action='ajouter_etudiant')
 
 
 @classes_bp.route('/choisir_classe_paiement')
 @login_required
 def choisir_classe_paiement():
-    df = storage.lire_classes()  # DataFrame complet avec 'NomClasse' et 'Etudiant'
-    
-    # Extraire uniquement les noms de classes et retirer doublons
-    classes_unique = df['NomClasse'].drop_duplicates().sort_values().tolist()
-    
+    # Noms de classes triés, servis par le catalogue (sans lire le roster)
+    classes_unique = storage.get_classes()
+
     # Envoyer au template la liste simple de noms de classes
     return render_template('choisir_classe.html', classes=classes_unique, action='suivi_paiements')
 
 
+@classes_bp.route('/rapport_completion')
+@login_required
+def rapport_completion():
+    """Vue faculté : % d'étudiants ayant payé chaque rubrique, pour toutes les classes."""
+    try:
+        matrice = storage.get_matrice_completion(force=request.args.get("actualiser") == "1")
+    except Exception as e:
+        logging.exception("Erreur calcul matrice de complétion")
+        flash(f"Impossible de calculer le rapport : {e}", "error")
+        return redirect(url_for("classes.liste_classes"))
+    rubriques = [c for c in matrice.columns if c != "NbEtudiants"]
+    lignes = matrice.reset_index().rename(columns={"index": "NomClasse"}).to_dict(orient="records")
+    return render_template("completion_paiements.html", lignes=lignes, rubriques=rubriques)
+
+
+@classes_bp.route('/rapport_completion/export')
+@login_required
+def export_completion():
+    """Export de la matrice de complétion en CSV (par défaut) ou Excel (?format=xlsx)."""
+    matrice = storage.get_matrice_completion()
+    buffer = BytesIO()
+    if request.args.get("format") == "xlsx":
+        matrice.to_excel(buffer, sheet_name="Completion")
+        buffer.seek(0)
+        return send_file(
+            buffer,
+            as_attachment=True,
+            download_name="completion_paiements.xlsx",
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+    buffer.write(matrice.to_csv(sep=";").encode("utf-8-sig"))
+    buffer.seek(0)
+    return send_file(buffer, as_attachment=True, download_name="completion_paiements.csv", mimetype="text/csv")
+
+
+def tache_rapports_paiements_zip():
+    """Tâche de fond : tous les récapitulatifs PDF (inscriptions et travaux, toutes classes) dans un ZIP."""
+    from app.utils.rapports_lot import generer_rapports_zip
+    return generer_rapports_zip(), f"rapports_paiements_{datetime.now():%Y%m%d}.zip", "application/zip"
+
+
+taches.enregistrer_type("rapports_paiements_zip", tache_rapports_paiements_zip)
+
+
+@classes_bp.route('/rapports_paiements/zip')
+@login_required
+def rapports_paiements_zip():
+    """Dépose la génération groupée des récapitulatifs et renvoie vers son suivi."""
+    try:
+        return deposer_et_suivre("rapports_paiements_zip", libelle=f"rapports_paiements_{datetime.now():%Y%m%d}.zip")
+    except Exception as e:
+        logging.exception("Erreur génération groupée des rapports")
+        flash(f"Impossible de générer les rapports : {e}", "error")
+        return redirect(url_for("classes.rapport_completion"))
+
+
 @classes_bp.route("/classes/<nom_classe>/suivi_paiements")
 @login_required
 def suivi_paiements(nom_classe):
@@ -43,12 +101,8 @@ def suivi_paiements(nom_classe):
 @classes_bp.route('/classes/liste')
 def liste_classes():
     try:
-        df_classes = storage.lire_classes()
-        if df_classes is not None and not df_classes.empty:
-            classes = df_classes['NomClasse'].drop_duplicates().tolist()
-            classes.sort()
-        else:
-            classes = []
+        # Catalogue : NomClasse, NbEtudiants, NbCours, DerniereActivite
+        classes = storage.lire_catalogue_classes()
         page = request.args.get('page', 1, type=int)
         per_page = 20
         total_pages = (len(classes) + per_page - 1) // per_page
@@ -244,12 +298,7 @@ def ajouter_cours(nom_classe):
         else:
             cours_lignes = [c.strip() for c in cours_valeur.splitlines() if c.strip()]
             try:
-                df_cours = storage.lire_cours()
-                if df_cours is None:
-                    df_cours = pd.DataFrame(columns=["NomClasse", "NomCours"])
-                new_rows = pd.DataFrame([{"NomClasse": nom_classe, "NomCours": c} for c in cours_lignes])
-                df_cours = pd.concat([df_cours, new_rows], ignore_index=True)
-                storage.write_sheet("Cours", df_cours)
+                storage.ajouter_cours_classe(nom_classe, cours_lignes)
                 flash(f"{len(cours_lignes)} cours ajoutés à la classe {nom_classe}.", "success")
                 return redirect(url_for("classes.detail_classe", nom_classe=nom_classe))
             except Exception as e:
@@ -259,6 +308,7 @@ def ajouter_cours(nom_classe):
 
 @classes_bp.route("/classes/<nom_classe>/ajouter_paiement", methods=["GET", "POST"])
 @login_required
+@idempotent
 def ajouter_paiement(nom_classe):
     if request.method == "POST":
         etudiant = request.args.get("etudiant", "").strip()
@@ -270,7 +320,7 @@ def ajouter_paiement(nom_classe):
             flash("Tous les champs sont requis.", "error")
             return redirect(request.url)
         try:
-            storage.enregistrer_paiement(nom_classe, etudiant, categorie, montant, date_paiement, utilisateur)
+            storage.ajouter_paiement_classe(nom_classe, etudiant, categorie, montant, date_paiement, utilisateur)
             flash("Paiement enregistré avec succès ✅", "success")
             return redirect(url_for("classes.detail_classe", nom_classe=nom_classe))
         except Exception as e:
@@ -291,23 +341,31 @@ def ajouter_paiement(nom_classe):
 @classes_bp.route("/classes/<nom_classe>/modifier_paiement/<int:paiement_id>", methods=["GET", "POST"])
 @login_required
 def modifier_paiement(nom_classe, paiement_id):
-    df_paiements = storage.lire_paiements()
-    paiement = df_paiements[df_paiements["ID"] == paiement_id].to_dict(orient="records")
-    paiement = paiement[0] if paiement else None
+    # Accès direct par l'index ID -> ligne, sans relire toute la feuille
+    paiement = storage.lire_ligne_par_id("Paiements", paiement_id)
     if not paiement:
         flash("Paiement introuvable.", "error")
         return redirect(url_for("classes.detail_classe", nom_classe=nom_classe))
     if request.method == "POST":
         categorie = request.form.get("categorie", "").strip()
         montant = request.form.get("montant", "").strip()
-        date = request.form.get("date_paiement", "").strip()
+        date = (request.form.get("date_paiement") or request.form.get("date", "")).strip()
         if not (categorie and montant and date):
             flash("Tous les champs sont requis.", "error")
             return redirect(request.url)
+        # Valeurs affichées au chargement du formulaire : une modification faite
+        # entre-temps par quelqu'un d'autre est détectée au lieu d'être écrasée
+        attendu = {col: request.form[f"original_{col}"] for col in ("CategoriePaiement", "Montant", "DatePaiement")
+                   if f"original_{col}" in request.form}
         try:
-            storage.modifier_paiement(paiement_id, categorie, montant, date)
+            storage.modifier_paiement(paiement_id, categorie, montant, date, attendu=attendu)
             flash("Paiement modifié avec succès ✅", "success")
             return redirect(url_for("classes.detail_classe", nom_classe=nom_classe))
+        except storage.ConflitModification as e:
+            flash(f"{e} Les valeurs ci-dessous sont les valeurs actuelles.", "error")
+            paiement = storage.lire_ligne_par_id("Paiements", paiement_id)
+            if not paiement:
+                return redirect(url_for("classes.detail_classe", nom_classe=nom_classe))
         except Exception as e:
             logging.exception("Erreur lors de la modification du paiement")
             flash(f"Erreur : {e}", "error")
@@ -323,6 +381,7 @@ def modifier_paiement(nom_classe, paiement_id):
 
 @classes_bp.route("/<nom_classe>/ajouter_depense_travail", methods=["GET", "POST"])
 @login_required
+@idempotent
 def ajouter_depense_travail(nom_classe):
     try:
         df_classes = storage.lire_classes()
@@ -446,118 +505,124 @@ def ajouter_depense_travail(nom_classe):
         return redirect(url_for("classes.detail_classe", nom_classe=nom_classe))
 
 
-@classes_bp.route("/classes/<nom_classe>/pdf/<categorie>")
-@login_required
-def generer_pdf_categorie(nom_classe, categorie):
-    try:
-        df_classes = storage.lire_classes()
-        df_paiements = storage.lire_paiements()
-        etudiants = df_classes[df_classes["NomClasse"] == nom_classe]["Etudiant"].dropna().tolist()
-
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
-        styles = getSampleStyleSheet()
-        wrap_style = ParagraphStyle(name="Wrap", fontSize=9, leading=11)  # Petite police pour retour à la ligne
-
-        elements = []
-        elements.append(Paragraph(f"Rapport - Classe : {nom_classe}", styles["Title"]))
-        elements.append(Spacer(1, 12))
+def construire_pdf_categorie(nom_classe, categorie):
+    """Tâche de fond : rapport PDF d'une classe (paiements par catégorie et liste des étudiants)."""
+    df_classes = storage.lire_classes()
+    df_paiements = storage.lire_paiements()
+    etudiants = df_classes[df_classes["NomClasse"] == nom_classe]["Etudiant"].dropna().tolist()
 
-        # --- STATISTIQUES DES PAIEMENTS ---
-        elements.append(Paragraph("📊 Statistiques des paiements par catégorie", styles["Heading2"]))
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
+    styles = getSampleStyleSheet()
+    wrap_style = ParagraphStyle(name="Wrap", fontSize=9, leading=11)  # Petite police pour retour à la ligne
 
-        if df_paiements is not None and not df_paiements.empty:
-            paiements_classe = df_paiements[df_paiements["Etudiant"].isin(etudiants)]
-
-            if categorie != "Toutes":
-                paiements_classe = paiements_classe[paiements_classe["CategoriePaiement"] == categorie]
-
-            # Calcul nombre paiements par catégorie et somme totale
-            stats_count = paiements_classe.groupby("CategoriePaiement")["Montant"].count().reset_index(name="NombrePaiements")
-            stats_sum = paiements_classe.groupby("CategoriePaiement")["Montant"].sum().reset_index(name="TotalMontant")
-
-            stats = stats_count.merge(stats_sum, on="CategoriePaiement")
-
-            stats_data = [["Catégorie", "Nombre de paiements", "Total payé (CDF)"]]
-            for _, row in stats.iterrows():
-                stats_data.append([
-                    row["CategoriePaiement"],
-                    int(row["NombrePaiements"]),
-                    f"{row['TotalMontant']:,}"
-                ])
-            total_nbr = stats["NombrePaiements"].sum()
-            total_mont = stats["TotalMontant"].sum()
-            stats_data.append(["TOTAL", int(total_nbr), f"{total_mont:,}"])
-
-            stats_table = Table(stats_data, colWidths=[200, 150, 150])
-            stats_table.setStyle(TableStyle([
-                ("BACKGROUND", (0, 0), (-1, 0), colors.darkblue),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
-                ("FONTSIZE", (0, 0), (-1, -1), 9),
-            ]))
-            elements.append(stats_table)
+    elements = []
+    elements.append(Paragraph(f"Rapport - Classe : {nom_classe}", styles["Title"]))
+    elements.append(Spacer(1, 12))
 
-        else:
-            elements.append(Paragraph("Aucun paiement enregistré.", styles["Normal"]))
+    # --- STATISTIQUES DES PAIEMENTS ---
+    elements.append(Paragraph("📊 Statistiques des paiements par catégorie", styles["Heading2"]))
 
-        elements.append(Spacer(1, 20))
+    if df_paiements is not None and not df_paiements.empty:
+        paiements_classe = df_paiements[df_paiements["Etudiant"].isin(etudiants)]
 
-        # --- TABLEAU ÉTUDIANTS ---
-        elements.append(Paragraph("📋 Liste des étudiants", styles["Heading2"]))
+        if categorie != "Toutes":
+            paiements_classe = paiements_classe[paiements_classe["CategoriePaiement"] == categorie]
 
-        data = [["N°", "Étudiant", "Paiements", "Commentaires"]]
+        # Calcul nombre paiements par catégorie et somme totale
+        stats_count = paiements_classe.groupby("CategoriePaiement")["Montant"].count().reset_index(name="NombrePaiements")
+        stats_sum = paiements_classe.groupby("CategoriePaiement")["Montant"].sum().reset_index(name="TotalMontant")
 
-        for idx, etu in enumerate(etudiants, start=1):
-            paiements_etu = df_paiements[df_paiements["Etudiant"] == etu] if df_paiements is not None else None
-            if paiements_etu is not None and not paiements_etu.empty:
-                paiement_text = ", ".join(
-                    [f"{row['CategoriePaiement']}={row['Montant']}" for _, row in paiements_etu.iterrows()]
-                )
-                commentaire = ", ".join(
-                    [str(row.get('Commentaire', '')) for _, row in paiements_etu.iterrows()]
-                )
-            else:
-                paiement_text, commentaire = "Aucun", "—"
+        stats = stats_count.merge(stats_sum, on="CategoriePaiement")
 
-            data.append([
-                idx,
-                Paragraph(etu, wrap_style),
-                Paragraph(paiement_text, wrap_style),
-                Paragraph(commentaire, wrap_style)
+        stats_data = [["Catégorie", "Nombre de paiements", "Total payé (CDF)"]]
+        for _, row in stats.iterrows():
+            stats_data.append([
+                row["CategoriePaiement"],
+                int(row["NombrePaiements"]),
+                f"{row['TotalMontant']:,}"
             ])
+        total_nbr = stats["NombrePaiements"].sum()
+        total_mont = stats["TotalMontant"].sum()
+        stats_data.append(["TOTAL", int(total_nbr), f"{total_mont:,}"])
 
-        table = Table(data, colWidths=[40, 200, 250, 200])
-        table.setStyle(TableStyle([
-            ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+        stats_table = Table(stats_data, colWidths=[200, 150, 150])
+        stats_table.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, 0), colors.darkblue),
             ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
             ("ALIGN", (0, 0), (-1, -1), "CENTER"),
             ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+            ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
             ("FONTSIZE", (0, 0), (-1, -1), 9),
-            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-            ("GRID", (0, 0), (-1, -1), 0.75, colors.black),
-            ("BOX", (0, 0), (-1, -1), 1, colors.black),
-            ("INNERGRID", (0, 0), (-1, -1), 0.5, colors.black),
-            ("LEFTPADDING", (0,0), (-1,-1), 5),
-            ("RIGHTPADDING", (0,0), (-1,-1), 5),
-            ("TOPPADDING", (0,0), (-1,-1), 3),
-            ("BOTTOMPADDING", (0,0), (-1,-1), 3),
         ]))
+        elements.append(stats_table)
 
-        elements.append(table)
+    else:
+        elements.append(Paragraph("Aucun paiement enregistré.", styles["Normal"]))
 
-        doc.build(elements)
-        buffer.seek(0)
+    elements.append(Spacer(1, 20))
 
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=f"{nom_classe}_{categorie}.pdf",
-            mimetype="application/pdf"
-        )
+    # --- TABLEAU ÉTUDIANTS ---
+    elements.append(Paragraph("📋 Liste des étudiants", styles["Heading2"]))
 
+    data = [["N°", "Étudiant", "Paiements", "Commentaires"]]
+
+    for idx, etu in enumerate(etudiants, start=1):
+        paiements_etu = df_paiements[df_paiements["Etudiant"] == etu] if df_paiements is not None else None
+        if paiements_etu is not None and not paiements_etu.empty:
+            paiement_text = ", ".join(
+                [f"{row['CategoriePaiement']}={row['Montant']}" for _, row in paiements_etu.iterrows()]
+            )
+            commentaire = ", ".join(
+                [str(row.get('Commentaire', '')) for _, row in paiements_etu.iterrows()]
+            )
+        else:
+            paiement_text, commentaire = "Aucun", "—"
+
+        data.append([
+            idx,
+            Paragraph(etu, wrap_style),
+            Paragraph(paiement_text, wrap_style),
+            Paragraph(commentaire, wrap_style)
+        ])
+
+    table = Table(data, colWidths=[40, 200, 250, 200])
+    table.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("GRID", (0, 0), (-1, -1), 0.75, colors.black),
+        ("BOX", (0, 0), (-1, -1), 1, colors.black),
+        ("INNERGRID", (0, 0), (-1, -1), 0.5, colors.black),
+        ("LEFTPADDING", (0,0), (-1,-1), 5),
+        ("RIGHTPADDING", (0,0), (-1,-1), 5),
+        ("TOPPADDING", (0,0), (-1,-1), 3),
+        ("BOTTOMPADDING", (0,0), (-1,-1), 3),
+    ]))
+
+    elements.append(table)
+
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer, f"{nom_classe}_{categorie}.pdf", "application/pdf"
+
+
+taches.enregistrer_type("pdf_classe_categorie", construire_pdf_categorie)
+
+
+@classes_bp.route("/classes/<nom_classe>/pdf/<categorie>")
+@login_required
+def generer_pdf_categorie(nom_classe, categorie):
+    try:
+        # Génération hors du thread de requête : on suit la tâche jusqu'au téléchargement
+        return deposer_et_suivre(
+            "pdf_classe_categorie",
+            {"nom_classe": nom_classe, "categorie": categorie},
+            libelle=f"{nom_classe}_{categorie}.pdf"
+        )
     except Exception as e:
         logging.exception("Erreur génération PDF")
         flash(f"Impossible de générer le PDF : {e}", "error")
@@ -1,7 +1,9 @@
+import hashlib
 import logging
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from app.routes.auth import login_required
 from app.models import storage_gsheets as storage
+from app.utils.idempotence import idempotent
 from app.utils.pagination import paginate  # Assurez-vous que paginate est défini ici
 from flask import session
 from app.models.storage_gsheets import get_sheet,  read_sheet
@@ -167,6 +169,7 @@ def liste_depenses_examen(nom_classe):
 # --- Ajout de dépense travail (existante dans votre fichier) ---
 @depenses_bp.route("/ajouter_depense_travail", methods=["GET", "POST"])
 @login_required
+@idempotent
 def ajouter_depense_travail():
     try:
         df_classes = storage.lire_classes()
@@ -261,15 +264,8 @@ def ajouter_depense_travail():
 @depenses_bp.route('/choisir_classe_examen')
 @login_required
 def choisir_classe_examen():
-    # Lire les données depuis Google Sheets
-    df_classes = storage.lire_classes()  # renvoie un DataFrame
-
-    # Obtenir uniquement la liste des classes uniques
-    if df_classes is None or df_classes.empty:
-        classes = []
-    else:
-        classes = df_classes["NomClasse"].dropna().unique().tolist()  # unique supprime les doublons
-        classes.sort()  # tri optionnel
+    # Liste triée des classes depuis le catalogue (sans lire le roster)
+    classes = storage.get_classes()
 
     return render_template(
         "choisir_classe.html",
@@ -305,11 +301,11 @@ def liste_depenses_autres():
 
 @depenses_bp.route("/ajouter_depense_examen", methods=["GET", "POST"])
 @login_required
+@idempotent
 def ajouter_depense_examen():
     try:
         # Récupération des classes disponibles
-        df_classes = storage.lire_classes()
-        classes = sorted(df_classes["NomClasse"].dropna().unique().tolist()) if not df_classes.empty else []
+        classes = storage.get_classes()
 
         recherche = request.args.get("recherche", "").strip().lower()
         categories_examen = ["Matériel", "Frais", "Autre"]
@@ -407,6 +403,7 @@ def ajouter_depense_examen():
 
 @depenses_bp.route("/ajouter_autres", methods=["GET", "POST"])
 @login_required
+@idempotent
 def ajouter_depense_autres():
     classes = storage.get_classes()  # Récupère la liste des classes
     if request.method == "POST":
@@ -524,37 +521,66 @@ def ajouter_depense_autres():
 @depenses_bp.route('/modifier/<int:depense_id>', methods=['GET', 'POST'])
 @login_required
 def modifier_depense(depense_id):
-    # Lire toutes les dépenses
-    df_depenses = storage.lire_depenses()
-
-    # Chercher la dépense à modifier
-    depense = df_depenses[df_depenses['ID'] == depense_id]
-    if depense.empty:
+    # Accès direct par l'index ID -> ligne, sans relire toute la feuille
+    depense_data = storage.lire_ligne_par_id("Depenses", depense_id)
+    if depense_data is None:
         flash("Dépense introuvable.", "danger")
         return redirect(url_for("depenses.liste_depenses_autres"))
 
-    depense_data = depense.iloc[0].to_dict()  # convertir en dict
+    categories = storage.lire_categories_depense()["Categorie"].dropna().tolist()
 
     if request.method == "POST":
         # Récupérer les champs du formulaire
-        type_depense = request.form.get("TypeDepense")
-        montant = request.form.get("Montant")
-        description = request.form.get("Description")
+        categorie = request.form.get("categorie", "").strip()
+        if categorie == "Autre":
+            categorie = request.form.get("categorie_autre", "").strip() or categorie
+        changements = {
+            "CategorieDepense": categorie,
+            "Description": request.form.get("description", "").strip(),
+            "DateDepense": request.form.get("date_depense", "").strip(),
+            "Montant": request.form.get("montant", "").strip(),
+        }
+
+        # Valeurs affichées au chargement du formulaire : une modification faite
+        # entre-temps par quelqu'un d'autre est détectée au lieu d'être écrasée
+        attendu = {col: request.form[f"original_{col}"] for col in changements
+                   if f"original_{col}" in request.form}
+
+        # Écrire uniquement les cellules modifiées de cette ligne
+        try:
+            storage.modifier_depense(depense_id, changements, attendu=attendu)
+            flash("Dépense modifiée avec succès.", "success")
+            return redirect(url_for("depenses.liste_depenses_autres"))
+        except storage.ConflitModification as e:
+            flash(f"{e} Les valeurs ci-dessous sont les valeurs actuelles.", "danger")
+            depense_data = storage.lire_ligne_par_id("Depenses", depense_id)
+            if depense_data is None:
+                return redirect(url_for("depenses.liste_depenses_autres"))
+        except Exception as e:
+            logging.exception("Erreur lors de la modification de la dépense")
+            flash(f"Erreur : {e}", "danger")
+            return redirect(url_for("depenses.liste_depenses_autres"))
 
-        # Mettre à jour le DataFrame
-        df_depenses.loc[df_depenses['ID'] == depense_id, ['TypeDepense', 'Montant', 'Description']] = [
-            type_depense, montant, description
-        ]
+    # Afficher le formulaire avec les données existantes
+    return render_template("modifier_depense.html", depense=depense_data, categories=categories)
 
-        # Sauvegarder les modifications
-        storage.ecrire_depenses(df_depenses)
-        flash("Dépense modifiée avec succès.", "success")
-        return redirect(url_for("depenses.liste_depenses_autres"))
 
-    # Afficher le formulaire avec les données existantes
-    return render_template("modifier_depense.html", depense=depense_data)
+
+# Le navigateur garde les listes de cours mais les revalide à chaque usage via
+# l'ETag (réponse 304 sans corps tant qu'aucun cours n'a été ajouté).
 
 
+def _reponse_cours(payload, version, classe=None):
+    etag = version
+    if classe is not None:
+        # Les noms de classe peuvent contenir des accents : l'ETag doit rester ASCII
+        etag = hashlib.sha1(f"{version}:{classe}".encode("utf-8")).hexdigest()[:16]
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 
 @depenses_bp.route("/api/cours/<classe_id>")
 def get_cours_by_classe(classe_id):
@@ -562,12 +588,9 @@ def get_cours_by_classe(classe_id):
     Retourne en JSON la liste des cours pour une classe donnée
     """
     try:
-        sheet = get_sheet("Cours")  # suppose qu'on a une feuille "Cours" avec colonnes Classe, NomCours
-        rows = sheet.get_all_records()
-
-        cours = [row["NomCours"] for row in rows if row.get("Classe") == classe_id]
-
-        return jsonify({"status": "success", "cours": cours})
+        _, version = storage.get_cours_map()
+        cours = storage.get_cours_classe(classe_id)
+        return _reponse_cours({"status": "success", "cours": cours}, version, classe_id)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -576,27 +599,30 @@ def get_cours_by_classe(classe_id):
 def api_cours_by_classe():
     """
     Retourne en JSON la liste des cours pour une classe donnée (paramètre query ?classe=).
-    S'appuie sur storage.lire_cours() qui corrige NomClassse -> NomClasse.
+    S'appuie sur la correspondance classe -> cours préchargée par storage.get_cours_map().
     """
     classe = (request.args.get("classe") or "").strip()
     if not classe:
         return jsonify({"status": "error", "message": "Paramètre 'classe' requis."}), 400
     try:
-        df = storage.lire_cours()
-        if df.empty:
-            return jsonify({"status": "success", "cours": []})
-
-        # Filtre strict sur la classe
-        mask = df["NomClasse"].astype(str).str.strip() == classe
-        cours = (
-            df.loc[mask, "NomCours"]
-              .dropna()
-              .astype(str)
-              .str.strip()
-              .unique()
-              .tolist()
-        )
-        return jsonify({"status": "success", "cours": cours})
+        _, version = storage.get_cours_map()
+        cours = storage.get_cours_classe(classe)
+        return _reponse_cours({"status": "success", "cours": cours}, version, classe)
     except Exception as e:
         logging.exception("Erreur AJAX /api/cours")
         return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@depenses_bp.route("/api/cours_par_classe", methods=["GET"])
+@login_required
+def api_cours_par_classe():
+    """
+    Retourne en JSON toute la correspondance {classe: [cours]} en une seule réponse,
+    chargée une fois par formulaire.
+    """
+    try:
+        mapping, version = storage.get_cours_map()
+        return _reponse_cours({"status": "success", "cours_par_classe": mapping}, version)
+    except Exception as e:
+        logging.exception("Erreur AJAX /api/cours_par_classe")
+        return jsonify({"status": "error", "message": str(e)}), 500
@@ -1,21 +1,29 @@
-from flask import Blueprint, request, redirect, url_for, flash, session, render_template
+from flask import Blueprint, request, redirect, url_for, flash, session, render_template, jsonify
 from flask import send_file
 from app.models.storage_gsheets import (
     get_students_for_class,
     get_payment_status,
+    get_statuts_paiement,
     update_student_payment,
     get_payment_summary,
     enregistrer_paiement_google,
+    enregistrer_paiements_inscriptions_lot,
     generate_summary_pdf
 )
 
+from app.utils.idempotence import idempotent
+from app.utils.rapports_lot import TYPES_INSCRIPTION
+from app.utils import taches
+from app.routes.taches import deposer_et_suivre
+from app.routes.auth import login_required
+
 inscription_bp = Blueprint('inscription', __name__, url_prefix='/inscription')
 
 @inscription_bp.route('/selection_type', methods=['GET', 'POST'])
 def selection_type():
     if request.method == 'POST':
         type_inscription = request.form.get('type_inscription')
-        if type_inscription not in ('1er_semestre', '2nd_semestre', 'rattrapage'):
+        if type_inscription not in TYPES_INSCRIPTION:
             flash("Veuillez sélectionner un type d'inscription valide.", "error")
             return render_template('selection_type_inscription.html')
         session['type_inscription'] = type_inscription
@@ -27,17 +35,11 @@ def selection_type():
 
 @inscription_bp.route('/selection_classe', methods=['GET', 'POST'])
 def selection_classe():
-    from app.models.storage_gsheets import lire_classes  # Import local pour éviter problème circulaire
-
-    # Lire les données de la feuille Classes dans un DataFrame
-    df_classes = lire_classes()
+    from app.models.storage_gsheets import get_classes  # Import local pour éviter problème circulaire
 
-    # Nettoyer les noms de colonnes pour éviter soucis d'espaces invisibles
-    df_classes.columns = df_classes.columns.str.strip()
-
-    # Extraire la liste unique des noms de classes triée et nettoyée
-    classes = df_classes['NomClasse'].drop_duplicates().sort_values().tolist()
-    classes_clean = [c.strip() for c in classes]
+    # Liste triée et nettoyée des classes, servie par le catalogue
+    classes = get_classes()
+    classes_clean = classes
 
     if request.method == 'POST':
         nom_classe = request.form.get('classe')
@@ -83,8 +85,10 @@ def liste_etudiants():
             return redirect(url_for('inscription.liste_etudiants'))
 
     etudiants = get_students_for_class(nom_classe)
+    # Tous les statuts de la classe en une lecture de la matrice
+    statuts = get_statuts_paiement("Paiements_Inscriptions", nom_classe, type_inscription)
     etudiants_paiements = {
-        etudiant: get_payment_status(nom_classe, etudiant, type_inscription)
+        etudiant: statuts.get(etudiant, "Non payé")
         for etudiant in etudiants
     }
 
@@ -99,6 +103,7 @@ from flask import flash, redirect, request, session, url_for
 from app.models.storage_gsheets import enregistrer_paiement_google, get_payment_status
 
 @inscription_bp.route('/enregistrer_paiement', methods=['POST'])
+@idempotent
 def enregistrer_paiement():
     nom_classe = session.get('nom_classe')
     type_inscription = session.get('type_inscription')
@@ -127,9 +132,49 @@ def enregistrer_paiement():
     return redirect(url_for('inscription.liste_etudiants'))
 
 
+@inscription_bp.route('/enregistrer_paiements_lot', methods=['POST'])
+@idempotent
+def enregistrer_paiements_lot():
+    """
+    Enregistre les paiements de plusieurs étudiants en une seule écriture.
+    Accepte un formulaire (cases 'etudiants') ou du JSON {"etudiants": [...]} ;
+    répond en JSON par étudiant, ou par un message flash pour le formulaire.
+    """
+    nom_classe = session.get('nom_classe')
+    type_inscription = session.get('type_inscription')
+    donnees = request.get_json(silent=True) or {}
+    etudiants = donnees.get('etudiants') if request.is_json else request.form.getlist('etudiants')
+
+    if not nom_classe or not type_inscription or not etudiants:
+        if request.is_json:
+            return jsonify({"status": "error", "message": "Classe, type ou étudiants manquants."}), 400
+        flash("Veuillez sélectionner au moins un étudiant.", "error")
+        return redirect(url_for('inscription.liste_etudiants'))
+
+    try:
+        resultats = enregistrer_paiements_inscriptions_lot(nom_classe, etudiants, type_inscription, montant=10.0)
+    except Exception as e:
+        if request.is_json:
+            return jsonify({"status": "error", "message": str(e)}), 500
+        flash(f"Erreur lors de l'enregistrement des paiements : {e}", "error")
+        return redirect(url_for('inscription.liste_etudiants'))
+
+    if request.is_json:
+        return jsonify({"status": "success", "resultats": resultats})
+    enregistres = [e for e, r in resultats.items() if r == "enregistre"]
+    deja = [e for e, r in resultats.items() if r == "deja_paye"]
+    if enregistres:
+        flash(f"Paiement de 10 USD enregistré pour {len(enregistres)} étudiant(s).", "success")
+    if deja:
+        flash(f"Déjà payé, ignoré : {', '.join(deja)}.", "error")
+    return redirect(url_for('inscription.liste_etudiants'))
+
+
 @inscription_bp.route('/statistiques', methods=['GET', 'POST'])
 def statistiques():
-    from app.models.storage_gsheets import get_payment_summary, toggle_payment_status
+    from app.models.storage_gsheets import (
+        get_payment_summary, toggle_payment_status, toggle_payment_status_lot, reconcilier_compteurs
+    )
 
     nom_classe = session.get('nom_classe')
     type_inscription = session.get('type_inscription')
@@ -139,22 +184,37 @@ def statistiques():
         flash("Veuillez d'abord sélectionner le type d'inscription et la classe.", "error")
         return redirect(url_for('inscription.selection_type'))
 
-    # Récupération des stats depuis le module de stockage
+    # Admin : relecture complète du registre pour recaler les compteurs
+    if request.args.get('reconcilier') and user_role == 'admin':
+        ecarts = reconcilier_compteurs("Paiements_Inscriptions")
+        if ecarts:
+            flash(f"Compteurs recalés sur le registre ({len(ecarts)} écart(s) corrigé(s)).", "warning")
+        else:
+            flash("Compteurs conformes au registre.", "success")
+        return redirect(url_for('inscription.statistiques'))
+
+    # Récupération des stats depuis les compteurs tenus à jour à chaque paiement
     summary = get_payment_summary(nom_classe, type_inscription)  
     # summary attendu comme dict: {'payes': int, 'non_payes': int, 'total_recettes': float}
 
-    # Gestion admin : toggle statut paiement
+    # Gestion admin : toggle statut paiement (un étudiant, ou les cases cochées)
     if request.method == 'POST' and user_role == 'admin':
         etudiant = request.form.get('etudiant')
+        etudiants = request.form.getlist('etudiants')
         action = request.form.get('action')
-        if etudiant and action in ['MarquerPayé', 'MarquerNonPayé']:
+        if (etudiant or etudiants) and action in ['MarquerPayé', 'MarquerNonPayé']:
             new_status = "Payé" if action == 'MarquerPayé' else "Non payé"
             try:
-                toggle_payment_status(nom_classe, etudiant, type_inscription, new_status)
-                flash(f"Le statut de paiement pour {etudiant} a été mis à jour.", "success")
+                if etudiants:
+                    resultats = toggle_payment_status_lot(nom_classe, etudiants, type_inscription, new_status)
+                    modifies = [e for e, r in resultats.items() if r != "inchange"]
+                    flash(f"Statut « {new_status} » appliqué à {len(modifies)} étudiant(s).", "success")
+                else:
+                    toggle_payment_status(nom_classe, etudiant, type_inscription, new_status)
+                    flash(f"Le statut de paiement pour {etudiant} a été mis à jour.", "success")
             except Exception as e:
                 flash(f"Erreur lors de la mise à jour : {e}", "error")
-            return redirect(url_for('inscription.statistiques'))
+        return redirect(url_for('inscription.statistiques'))
 
     return render_template(
         'statistiques.html',
@@ -165,7 +225,18 @@ def statistiques():
     )
 
 
+def tache_pdf_inscription(nom_classe, type_inscription):
+    """Tâche de fond : récapitulatif PDF des paiements d'inscription d'une classe."""
+    summary = get_payment_summary(nom_classe, type_inscription)
+    pdf_buffer = generate_summary_pdf(summary, nom_classe, type_inscription)
+    return pdf_buffer, f"Résumé_paiements_{nom_classe}_{type_inscription}.pdf", 'application/pdf'
+
+
+taches.enregistrer_type("pdf_inscription", tache_pdf_inscription)
+
+
 @inscription_bp.route('/generer_pdf')
+@login_required
 def generer_pdf():
     nom_classe = session.get('nom_classe')
     type_inscription = session.get('type_inscription')
@@ -174,13 +245,10 @@ def generer_pdf():
         flash("Veuillez sélectionner une classe et type d'inscription avant de générer le PDF.", "error")
         return redirect(url_for('inscription.selection_type'))
 
-    summary = get_payment_summary(nom_classe, type_inscription)
-    pdf_buffer = generate_summary_pdf(summary, nom_classe, type_inscription)
-
-    return send_file(
-        pdf_buffer,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f"Résumé_paiements_{nom_classe}_{type_inscription}.pdf"
+    # Génération hors du thread de requête : on suit la tâche jusqu'au téléchargement
+    return deposer_et_suivre(
+        "pdf_inscription",
+        {"nom_classe": nom_classe, "type_inscription": type_inscription},
+        libelle=f"Résumé_paiements_{nom_classe}_{type_inscription}.pdf"
     )
 
@@ -63,14 +63,22 @@ def inject_menu():
 @main_bp.route("/")
 @login_required
 def index():
-    # Lire les données de Google Sheets via vos fonctions
-    df_classes = storage.lire_classes()
-
-    df_recettes = storage.lire_recettes()
-    df_autres_recettes = storage.lire_autres_recettes()
-    df_paiements_inscriptions = lire_paiements_inscriptions()
-
-    df_depenses_list = [storage.lire_depenses()]
+    # Lire les données de Google Sheets via vos fonctions (lectures indépendantes en parallèle)
+    lectures = storage.lire_en_parallele({
+        "classes": storage.lire_classes,
+        "recettes": storage.lire_recettes,
+        "autres_recettes": storage.lire_autres_recettes,
+        "paiements_inscriptions": lire_paiements_inscriptions,
+        "depenses": storage.lire_depenses,
+        "total_travaux": total_paiements_travaux,
+    })
+    df_classes = lectures["classes"]
+
+    df_recettes = lectures["recettes"]
+    df_autres_recettes = lectures["autres_recettes"]
+    df_paiements_inscriptions = lectures["paiements_inscriptions"]
+
+    df_depenses_list = [lectures["depenses"]]
     df_depenses = concat_or_empty(df_depenses_list, [
         "ID", "NomClasse", "NomCours", "DateExamen", "CategorieDepense", "Description",
         "Montant", "TypeDepense", "Commentaire", "DateDepense"
@@ -87,7 +95,7 @@ def index():
     total_paiements_inscriptions = safe_sum(df_paiements_inscriptions, "Montant")
 
     # Calcul total paiements travaux - attention à ne pas utiliser le même nom que la fonction
-    total_paiements_travaux_valeur = total_paiements_travaux()
+    total_paiements_travaux_valeur = lectures["total_travaux"]
 
     total_depenses = safe_sum(df_depenses, "Montant")
 
@@ -156,22 +164,32 @@ def historique():
     page = request.args.get("page", 1, type=int)
     per_page = 20
 
+    # Six feuilles indépendantes : lues en parallèle (la page attend la plus lente)
+    lectures = storage.lire_en_parallele({
+        "depenses": storage.lire_depenses,
+        "recettes": storage.lire_recettes,
+        "paiements": storage.lire_paiements,
+        "autres_recettes": storage.lire_autres_recettes,
+        "inscriptions": storage.lire_inscriptions,
+        "paiements_travaux": storage.lire_paiements_travaux,
+    })
+
     # Charger les données des dépenses
-    df_depenses_list = [storage.lire_depenses()]
+    df_depenses_list = [lectures["depenses"]]
     df_depenses = concat_or_empty(df_depenses_list, [
         "ID", "NomClasse", "NomCours", "DateExamen", "CategorieDepense", "Description",
         "Montant", "TypeDepense", "Commentaire", "DateDepense"
     ])
 
     # Charger les recettes : recettes, paiements inscriptions, autres recettes
-    recettes_list = [storage.lire_recettes(), storage.lire_paiements(), storage.lire_autres_recettes()]
+    recettes_list = [lectures["recettes"], lectures["paiements"], lectures["autres_recettes"]]
     df_recettes_complet = concat_or_empty(recettes_list, [
         "ID", "NomClasse", "Etudiant", "Type", "Montant", "Description", "Date", "Utilisateur"
     ])
 
     # Lire inscriptions et paiements travaux (à adapter fonctions selon projet)
-    df_inscriptions = storage.lire_inscriptions()
-    df_paiements_travaux = storage.lire_paiements_travaux()
+    df_inscriptions = lectures["inscriptions"]
+    df_paiements_travaux = lectures["paiements_travaux"]
 
     # Concaténer inscriptions et paiements travaux dans opérations caisse
     df_operations_supplementaires = concat_or_empty([df_inscriptions, df_paiements_travaux], [
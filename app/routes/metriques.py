@@ -0,0 +1,24 @@
+import hmac
+import os
+from flask import Blueprint, Response, request, session, abort
+from app.utils import metriques
+
+metriques_bp = Blueprint("metriques", __name__)
+
+# Jeton facultatif pour le collecteur Prometheus (qui n'a pas de session) :
+# en-tête "Authorization: Bearer <METRIQUES_JETON>"
+METRIQUES_JETON = os.environ.get("METRIQUES_JETON", "")
+
+
+def _acces_autorise():
+    if session.get("role") == "admin":
+        return True
+    entete = request.headers.get("Authorization", "")
+    return bool(METRIQUES_JETON) and hmac.compare_digest(entete, f"Bearer {METRIQUES_JETON}")
+
+
+@metriques_bp.route("/metrics")
+def metrics():
+    if not _acces_autorise():
+        abort(403)
+    return Response(metriques.exporter(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,35 @@
+from flask import Blueprint, render_template, redirect, url_for, flash, send_file
+from app.routes.auth import login_required, admin_required
+from app.utils import profilage
+
+profils_bp = Blueprint("profils", __name__, template_folder="../templates")
+
+
+@profils_bp.route("/")
+@login_required
+@admin_required
+def liste():
+    return render_template("profils.html", profils=profilage.lister())
+
+
+@profils_bp.route("/<id_profil>")
+@login_required
+@admin_required
+def detail(id_profil):
+    profil = profilage.charger(id_profil)
+    if profil is None:
+        flash("Profil introuvable (peut-être purgé).", "error")
+        return redirect(url_for("profils.liste"))
+    return render_template("profil.html", profil=profil)
+
+
+@profils_bp.route("/<id_profil>/telecharger")
+@login_required
+@admin_required
+def telecharger(id_profil):
+    chemin = profilage.fichier_brut(id_profil)
+    if chemin is None:
+        flash("Profil introuvable (peut-être purgé).", "error")
+        return redirect(url_for("profils.liste"))
+    return send_file(chemin, as_attachment=True, download_name=f"{id_profil}.prof",
+                     mimetype="application/octet-stream")
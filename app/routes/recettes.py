@@ -3,6 +3,7 @@ from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from app.routes.auth import login_required
 from app.models import storage_gsheets as storage  # ✅ Google Sheets
+from app.utils.idempotence import idempotent
 
 recettes_bp = Blueprint('recettes', __name__, url_prefix='/recettes', template_folder='templates/recettes')
 
@@ -71,6 +72,7 @@ def index_recettes():
 
 @recettes_bp.route('/ajouter', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def ajouter_recette():
     try:
         df_categories = storage.lire_categories_paiement()
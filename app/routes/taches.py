@@ -0,0 +1,127 @@
+import logging
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from app.routes.auth import login_required
+from app.utils import taches
+
+taches_bp = Blueprint("taches", __name__, template_folder="../templates")
+
+# Types déposables directement par /taches/deposer/<type> : rôles autorisés et
+# paramètres attendus (tous requis, chaînes non vides). Les autres types ne
+# passent que par leurs propres routes, qui fixent elles-mêmes les paramètres.
+DEPOTS_DIRECTS = {
+    "pdf_inscription": {"roles": {"user", "admin"}, "params": {"nom_classe", "type_inscription"}},
+    "pdf_travaux": {"roles": {"user", "admin"}, "params": {"nom_classe", "type_travail"}},
+    "pdf_classe_categorie": {"roles": {"user", "admin"}, "params": {"nom_classe", "categorie"}},
+    "rapports_paiements_zip": {"roles": {"admin"}, "params": set()},
+}
+
+
+def _reponse_json():
+    return request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json"
+
+
+def _tache_autorisee(id_tache):
+    """Retourne la tâche si l'utilisateur courant peut la voir (la sienne, ou admin)."""
+    tache = taches.etat(id_tache)
+    if tache is None:
+        return None
+    if session.get("role") != "admin" and tache["utilisateur"] != session.get("user"):
+        return None
+    return tache
+
+
+def _resume(tache):
+    return {
+        "id": tache["id"],
+        "type": tache["type"],
+        "etat": tache["etat"],
+        "erreur": tache["erreur"],
+        "nom_fichier": tache["nom_fichier"],
+        "statut_url": url_for("taches.statut", id_tache=tache["id"]),
+        "telechargement_url": url_for("taches.telecharger", id_tache=tache["id"]) if tache["etat"] == "termine" else None,
+    }
+
+
+def deposer_et_suivre(type_tache, params=None, libelle=None):
+    """Dépose une tâche pour l'utilisateur courant puis renvoie vers sa page de suivi (202 en JSON)."""
+    utilisateur = session.get("user")
+    if not utilisateur:
+        # Une tâche sans propriétaire ne serait visible que des admins : jamais de dépôt anonyme
+        if _reponse_json():
+            return jsonify({"status": "error", "message": "Connexion requise."}), 401
+        flash("Veuillez vous connecter pour accéder à cette page.", "error")
+        return redirect(url_for("auth.login", next=request.url))
+    id_tache = taches.deposer(type_tache, params, utilisateur=utilisateur, libelle=libelle)
+    if _reponse_json():
+        return jsonify(_resume(taches.etat(id_tache))), 202
+    return redirect(url_for("taches.statut", id_tache=id_tache))
+
+
+@taches_bp.route("/")
+@login_required
+def liste():
+    utilisateur = None if session.get("role") == "admin" else session.get("user")
+    return render_template("taches.html", taches=taches.lister(utilisateur))
+
+
+def _verifier_depot(type_tache, params):
+    """Paramètres du dépôt direct, validés selon DEPOTS_DIRECTS (PermissionError / ValueError sinon)."""
+    regle = DEPOTS_DIRECTS.get(type_tache)
+    if regle is None or session.get("role", "user") not in regle["roles"]:
+        raise PermissionError(f"Dépôt de tâches « {type_tache} » non autorisé.")
+    params = dict(params or {}) if isinstance(params, dict) else {}
+    params.pop("cle_idempotence", None)
+    if set(params) != regle["params"]:
+        attendus = ", ".join(sorted(regle["params"])) or "aucun"
+        raise ValueError(f"Paramètres invalides pour « {type_tache} » (attendus : {attendus}).")
+    for nom, valeur in params.items():
+        if not isinstance(valeur, str) or not valeur.strip():
+            raise ValueError(f"Paramètre « {nom} » invalide.")
+    return {nom: valeur.strip() for nom, valeur in params.items()}
+
+
+@taches_bp.route("/deposer/<type_tache>", methods=["POST"])
+@login_required
+def deposer(type_tache):
+    params = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+    try:
+        return deposer_et_suivre(type_tache, _verifier_depot(type_tache, params))
+    except (PermissionError, ValueError) as e:
+        if _reponse_json():
+            return jsonify({"status": "error", "message": str(e)}), 403 if isinstance(e, PermissionError) else 400
+        flash(str(e), "error")
+        return redirect(url_for("taches.liste"))
+
+
+@taches_bp.route("/<id_tache>")
+@login_required
+def statut(id_tache):
+    tache = _tache_autorisee(id_tache)
+    if tache is None:
+        if _reponse_json():
+            return jsonify({"status": "error", "message": "Tâche introuvable."}), 404
+        flash("Tâche introuvable.", "error")
+        return redirect(url_for("taches.liste"))
+    if _reponse_json():
+        return jsonify(_resume(tache))
+    return render_template("tache_statut.html", tache=tache)
+
+
+@taches_bp.route("/<id_tache>/telecharger")
+@login_required
+def telecharger(id_tache):
+    tache = _tache_autorisee(id_tache)
+    if tache is None or tache["etat"] != "termine":
+        flash("Résultat non disponible.", "error")
+        return redirect(url_for("taches.liste"))
+    try:
+        return send_file(
+            tache["fichier"],
+            as_attachment=True,
+            download_name=tache["nom_fichier"],
+            mimetype=tache["mimetype"]
+        )
+    except OSError:
+        logging.exception("Fichier de résultat manquant pour la tâche %s", id_tache)
+        flash("Le fichier de résultat a expiré, veuillez relancer la génération.", "error")
+        return redirect(url_for("taches.liste"))
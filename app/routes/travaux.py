@@ -1,22 +1,35 @@
-from flask import Blueprint, request, redirect, url_for, flash, session, render_template, send_file
+from flask import Blueprint, request, redirect, url_for, flash, session, render_template, send_file, jsonify
 from app.models.storage_gsheets import (
-    lire_classes,
+    get_classes,
     get_students_for_class,
     get_payment_status_travaux,
+    get_statuts_paiement,
     update_student_payment_travaux,
     enregistrer_paiement_travaux,
+    enregistrer_paiements_travaux_lot,
     generate_summary_pdf_travaux,
 )
 
+from app.utils.idempotence import idempotent
+from app.utils.rapports_lot import TYPES_TRAVAUX
+from app.utils import taches
+from app.routes.taches import deposer_et_suivre
+from app.routes.auth import login_required
+
 travaux_bp = Blueprint('travaux', __name__, url_prefix='/travaux')
 
 from io import BytesIO
 from app.models.storage_gsheets import get_payment_summary_travaux  # fonction à créer pour travaux
 
 
+def montant_travail(type_travail):
+    """Montant dû selon le type de travail."""
+    return 10.0 if type_travail in ['Projet tutoré', 'Stage'] else 150.0
+
+
 @travaux_bp.route('/selection_type', methods=['GET', 'POST'])
 def selection_type():
-    types_travaux_possibles = ['Projet tutoré', 'Stage', 'Mémoire']
+    types_travaux_possibles = TYPES_TRAVAUX
 
     if request.method == 'POST':
         type_travail = request.form.get('type_travail')
@@ -30,8 +43,7 @@ def selection_type():
 
 @travaux_bp.route('/selection_classe', methods=['GET', 'POST'])
 def selection_classe():
-    df_classes = lire_classes()
-    classes = df_classes['NomClasse'].drop_duplicates().sort_values().tolist()
+    classes = get_classes()
 
     if request.method == 'POST':
         nom_classe = request.form.get('classe')
@@ -69,7 +81,7 @@ def liste_etudiants():
                 flash(f"Le paiement pour {etudiant} est déjà enregistré.", "error")
             else:
                 try:
-                    montant = 10.0 if type_travail in ['Projet tutoré', 'Stage'] else 150.0
+                    montant = montant_travail(type_travail)
                     update_student_payment_travaux(nom_classe, etudiant, type_travail, montant)
                     flash(f"Paiement de {montant} USD enregistré pour {etudiant}.", "success")
                 except Exception as e:
@@ -77,8 +89,10 @@ def liste_etudiants():
             return redirect(url_for('travaux.liste_etudiants'))
 
     etudiants = get_students_for_class(nom_classe)
+    # Tous les statuts de la classe en une lecture de la matrice
+    statuts = get_statuts_paiement("Paiements_Travaux", nom_classe, type_travail)
     etudiants_paiements = {
-        etudiant: get_payment_status_travaux(nom_classe, etudiant, type_travail)
+        etudiant: "Payé" if statuts.get(etudiant) == "Payé" else None
         for etudiant in etudiants
     }
 
@@ -91,6 +105,7 @@ def liste_etudiants():
 
 
 @travaux_bp.route('/enregistrer_paiement', methods=['POST'])
+@idempotent
 def enregistrer_paiement():
     nom_classe = session.get('nom_classe')
     type_travail = session.get('type_travail')
@@ -106,7 +121,7 @@ def enregistrer_paiement():
         return redirect(url_for('travaux.liste_etudiants'))
 
     try:
-        montant = 10.0 if type_travail in ['Projet tutoré', 'Stage'] else 150.0
+        montant = montant_travail(type_travail)
         success = enregistrer_paiement_travaux(nom_classe, etudiant, type_travail, montant)
         if success:
             flash(f"Paiement de {montant} USD enregistré pour {etudiant}.", "success")
@@ -119,6 +134,45 @@ def enregistrer_paiement():
 
 
 
+@travaux_bp.route('/enregistrer_paiements_lot', methods=['POST'])
+@idempotent
+def enregistrer_paiements_lot():
+    """
+    Enregistre les paiements de travaux de plusieurs étudiants en une seule écriture.
+    Accepte un formulaire (cases 'etudiants') ou du JSON {"etudiants": [...]} ;
+    répond en JSON par étudiant, ou par un message flash pour le formulaire.
+    """
+    nom_classe = session.get('nom_classe')
+    type_travail = session.get('type_travail')
+    donnees = request.get_json(silent=True) or {}
+    etudiants = donnees.get('etudiants') if request.is_json else request.form.getlist('etudiants')
+
+    if not nom_classe or not type_travail or not etudiants:
+        if request.is_json:
+            return jsonify({"status": "error", "message": "Classe, type ou étudiants manquants."}), 400
+        flash("Veuillez sélectionner au moins un étudiant.", "error")
+        return redirect(url_for('travaux.liste_etudiants'))
+
+    montant = montant_travail(type_travail)
+    try:
+        resultats = enregistrer_paiements_travaux_lot(nom_classe, etudiants, type_travail, montant)
+    except Exception as e:
+        if request.is_json:
+            return jsonify({"status": "error", "message": str(e)}), 500
+        flash(f"Erreur lors de l'enregistrement des paiements : {e}", "error")
+        return redirect(url_for('travaux.liste_etudiants'))
+
+    if request.is_json:
+        return jsonify({"status": "success", "montant": montant, "resultats": resultats})
+    enregistres = [e for e, r in resultats.items() if r == "enregistre"]
+    deja = [e for e, r in resultats.items() if r == "deja_paye"]
+    if enregistres:
+        flash(f"Paiement de {montant} USD enregistré pour {len(enregistres)} étudiant(s).", "success")
+    if deja:
+        flash(f"Déjà payé, ignoré : {', '.join(deja)}.", "error")
+    return redirect(url_for('travaux.liste_etudiants'))
+
+
 @travaux_bp.route('/suivi_paiements', methods=['GET', 'POST'])
 def suivi_paiements():
     options_paiement = [
@@ -142,7 +196,18 @@ def suivi_paiements():
 from flask import session, flash, redirect, url_for, send_file, current_app
 from io import BytesIO
 
+def tache_pdf_travaux(nom_classe, type_travail):
+    """Tâche de fond : récapitulatif PDF des paiements travaux d'une classe."""
+    summary = get_payment_summary_travaux(nom_classe, type_travail)
+    pdf_buffer = generate_summary_pdf_travaux(summary, nom_classe, type_travail)
+    return pdf_buffer, f"Résumé_paiements_{nom_classe}_{type_travail}.pdf", 'application/pdf'
+
+
+taches.enregistrer_type("pdf_travaux", tache_pdf_travaux)
+
+
 @travaux_bp.route('/generer_pdf')
+@login_required
 def travaux_generer_pdf():
     nom_classe = session.get('nom_classe')
     type_travail = session.get('type_travail')
@@ -151,27 +216,12 @@ def travaux_generer_pdf():
         flash("Veuillez sélectionner une classe et type de travail avant de générer le PDF.", "error")
         return redirect(url_for('travaux.selection_type'))
 
-    # Debug
+    # Génération hors du thread de requête : on suit la tâche jusqu'au téléchargement
     current_app.logger.debug(f"travaux_generer_pdf : nom_classe={nom_classe}, type_travail={type_travail}")
-
-    summary = get_payment_summary_travaux(nom_classe, type_travail)
-
-    # Debug : vérifier le contenu
-    current_app.logger.debug(f"Résumé paiements : {summary}")
-
-    pdf_buffer = generate_summary_pdf_travaux(summary, nom_classe, type_travail)
-
-    if not isinstance(pdf_buffer, BytesIO):
-        current_app.logger.error("generate_summary_pdf_travaux doit retourner un BytesIO")
-        flash("Erreur interne lors de la génération du PDF.", "error")
-        return redirect(url_for('travaux.selection_type'))
-
-    pdf_buffer.seek(0)
-    return send_file(
-        pdf_buffer,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f"Résumé_paiements_{nom_classe}_{type_travail}.pdf"
+    return deposer_et_suivre(
+        "pdf_travaux",
+        {"nom_classe": nom_classe, "type_travail": type_travail},
+        libelle=f"Résumé_paiements_{nom_classe}_{type_travail}.pdf"
     )
 
 
@@ -0,0 +1,125 @@
+# app/utils/disjoncteur.py
+"""
+Disjoncteur (circuit breaker) de l'API Google Sheets, partagé par les workers.
+
+Après SEUIL_ECHECS échecs consécutifs (erreurs 5xx, 429 persistants, coupures
+réseau), le disjoncteur s'ouvre : pendant DELAI_OUVERTURE secondes plus aucun
+appel ne part, ServiceIndisponible est levée immédiatement et le stockage sert
+les derniers instantanés connus au lieu de bloquer les threads des workers.
+Ensuite un seul appel (la sonde) est autorisé : s'il réussit le disjoncteur se
+referme, sinon il se rouvre pour un nouveau délai.
+
+L'état vit dans la base locale : un worker qui constate la panne l'épargne à l'autre.
+"""
+import logging
+import os
+import time
+
+from app.utils import local_store
+
+SEUIL_ECHECS = int(os.environ.get("DISJONCTEUR_SEUIL", "5"))
+DELAI_OUVERTURE = float(os.environ.get("DISJONCTEUR_DELAI", "30"))
+
+FERME, OUVERT, SEMI_OUVERT = "ferme", "ouvert", "semi_ouvert"
+
+local_store.register_schema("""
+CREATE TABLE IF NOT EXISTS disjoncteur (
+    nom TEXT PRIMARY KEY,
+    etat TEXT NOT NULL,
+    echecs INTEGER NOT NULL,
+    depuis REAL NOT NULL
+);
+""")
+
+_au_retablissement = []
+
+
+class ServiceIndisponible(RuntimeError):
+    """Google Sheets est considéré en panne ; `attente` = secondes avant le prochain essai."""
+
+    def __init__(self, attente):
+        self.attente = max(1, int(round(attente)))
+        super().__init__(
+            "Google Sheets est momentanément indisponible, "
+            f"nouvel essai dans environ {self.attente} s."
+        )
+
+
+def au_retablissement(fonction):
+    """Enregistre une fonction appelée (sans argument) quand le disjoncteur se referme."""
+    _au_retablissement.append(fonction)
+    return fonction
+
+
+def _lire(conn, nom):
+    ligne = conn.execute("SELECT etat, echecs, depuis FROM disjoncteur WHERE nom = ?", (nom,)).fetchone()
+    return ligne or (FERME, 0, 0.0)
+
+
+def _ecrire(conn, nom, etat, echecs, depuis):
+    conn.execute(
+        "INSERT INTO disjoncteur (nom, etat, echecs, depuis) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(nom) DO UPDATE SET etat = excluded.etat, echecs = excluded.echecs, depuis = excluded.depuis",
+        (nom, etat, echecs, depuis),
+    )
+
+
+def autoriser(nom="sheets"):
+    """
+    Vérifie qu'un appel peut partir ; retourne l'état lu (à repasser à succes()).
+    Lève ServiceIndisponible si le disjoncteur est ouvert ou qu'une sonde est déjà en cours.
+    """
+    with local_store.lecture() as conn:
+        etat = _lire(conn, nom)
+    if etat[0] == FERME:
+        return etat
+    maintenant = time.time()
+    if maintenant - etat[2] < DELAI_OUVERTURE:
+        raise ServiceIndisponible(DELAI_OUVERTURE - (maintenant - etat[2]))
+    # Délai écoulé (ou sonde perdue) : un seul appelant devient la sonde
+    with local_store.transaction() as conn:
+        etat = _lire(conn, nom)
+        if etat[0] != FERME and maintenant - etat[2] < DELAI_OUVERTURE:
+            raise ServiceIndisponible(DELAI_OUVERTURE - (maintenant - etat[2]))
+        if etat[0] != FERME:
+            _ecrire(conn, nom, SEMI_OUVERT, etat[1], maintenant)
+            etat = (SEMI_OUVERT, etat[1], maintenant)
+    if etat[0] == SEMI_OUVERT:
+        logging.info("Disjoncteur Sheets semi-ouvert : appel de sonde")
+    return etat
+
+
+def succes(etat_avant, nom="sheets"):
+    """L'appel a abouti (le service répond) : remise à zéro des échecs, fermeture après une sonde."""
+    if etat_avant[0] == FERME and etat_avant[1] == 0:
+        return
+    with local_store.transaction() as conn:
+        _ecrire(conn, nom, FERME, 0, time.time())
+    if etat_avant[0] != FERME:
+        logging.warning("✅ Disjoncteur Sheets refermé, le service répond de nouveau")
+        for fonction in _au_retablissement:
+            try:
+                fonction()
+            except Exception:
+                logging.exception("Erreur au rétablissement du service Sheets")
+
+
+def echec(nom="sheets"):
+    """L'appel a échoué pour une raison liée au service : compte l'échec, ouvre au-delà du seuil."""
+    maintenant = time.time()
+    with local_store.transaction() as conn:
+        etat, echecs, depuis = _lire(conn, nom)
+        echecs += 1
+        if etat == SEMI_OUVERT or echecs >= SEUIL_ECHECS:
+            if etat != OUVERT:
+                logging.warning(f"⚠️ Disjoncteur Sheets ouvert après {echecs} échec(s) consécutif(s)")
+            _ecrire(conn, nom, OUVERT, echecs, maintenant)
+        else:
+            _ecrire(conn, nom, etat, echecs, depuis)
+
+
+def etat(nom="sheets"):
+    """{"etat", "echecs", "depuis"} pour l'affichage et la supervision."""
+    with local_store.lecture() as conn:
+        etat_, echecs, depuis = _lire(conn, nom)
+    return {"etat": etat_, "echecs": echecs, "depuis": depuis}
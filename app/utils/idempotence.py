@@ -0,0 +1,149 @@
+# app/utils/idempotence.py
+"""
+Clés d'idempotence pour les formulaires de paiement et de dépense.
+
+Chaque formulaire embarque une clé unique (champ caché 'cle_idempotence' ou en-tête
+'Idempotency-Key'). La première requête qui présente la clé la réserve dans la base
+locale partagée par les workers ; un double-clic ou un renvoi du même formulaire
+est alors court-circuité par une simple lecture de clé primaire, sans toucher au
+Google Sheet. Les clés expirent après IDEMPOTENCE_TTL secondes et la table est
+bornée à IDEMPOTENCE_MAX lignes.
+"""
+import json
+import time
+import uuid
+from functools import wraps
+
+from flask import flash, jsonify, make_response, redirect, request, session
+
+from app.utils import local_store
+
+IDEMPOTENCE_TTL = 24 * 3600
+IDEMPOTENCE_MAX = 5000
+CHAMP_FORMULAIRE = "cle_idempotence"
+ENTETE = "Idempotency-Key"
+
+local_store.register_schema("""
+CREATE TABLE IF NOT EXISTS idempotence (
+    cle TEXT PRIMARY KEY,
+    etat TEXT NOT NULL,
+    resultat TEXT,
+    cree REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotence_cree ON idempotence(cree);
+""")
+
+
+def nouvelle_cle():
+    """Génère une clé à placer dans un formulaire (exposée aux templates)."""
+    return uuid.uuid4().hex
+
+
+def reserver(cle):
+    """
+    Réserve la clé. Retourne None si elle est nouvelle (la requête doit être traitée),
+    sinon {"etat": "en_cours"|"termine", "resultat": ...} de la première requête.
+    """
+    maintenant = time.time()
+    with local_store.transaction() as conn:
+        # Éviction : clés expirées, puis les plus anciennes au-delà de la borne
+        conn.execute("DELETE FROM idempotence WHERE cree < ?", (maintenant - IDEMPOTENCE_TTL,))
+        conn.execute(
+            "DELETE FROM idempotence WHERE cle IN ("
+            "SELECT cle FROM idempotence ORDER BY cree DESC LIMIT -1 OFFSET ?)",
+            (IDEMPOTENCE_MAX - 1,),
+        )
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO idempotence (cle, etat, cree) VALUES (?, 'en_cours', ?)",
+            (cle, maintenant),
+        )
+        if cur.rowcount:
+            return None
+        etat, resultat = conn.execute(
+            "SELECT etat, resultat FROM idempotence WHERE cle = ?", (cle,)
+        ).fetchone()
+    return {"etat": etat, "resultat": json.loads(resultat) if resultat else None}
+
+
+def terminer(cle, resultat):
+    """Marque la clé comme traitée et mémorise de quoi rejouer la réponse."""
+    with local_store.transaction() as conn:
+        conn.execute(
+            "UPDATE idempotence SET etat = 'termine', resultat = ? WHERE cle = ?",
+            (json.dumps(resultat), cle),
+        )
+
+
+def liberer(cle):
+    """Supprime la réservation (échec ou erreur de saisie) : le formulaire pourra être renvoyé."""
+    with local_store.transaction() as conn:
+        conn.execute("DELETE FROM idempotence WHERE cle = ?", (cle,))
+
+
+def _cle_requete():
+    cle = request.headers.get(ENTETE) or request.form.get(CHAMP_FORMULAIRE)
+    if not cle and request.is_json:
+        cle = (request.get_json(silent=True) or {}).get(CHAMP_FORMULAIRE)
+    cle = (cle or "").strip()
+    return cle[:128] or None
+
+
+def _nb_succes():
+    return sum(1 for cat, _ in session.get("_flashes", []) if cat == "success")
+
+
+def _succes(reponse, succes_avant):
+    """Une écriture a réussi si la vue a flashé un message 'success' ou répondu en JSON sans erreur."""
+    if reponse.is_json:
+        return reponse.status_code < 400 and (reponse.get_json(silent=True) or {}).get("status") != "error"
+    return _nb_succes() > succes_avant
+
+
+def _rejouer(precedent):
+    """Réponse renvoyée pour une clé déjà vue, sans ré-exécuter la vue."""
+    resultat = precedent["resultat"] or {}
+    if precedent["etat"] == "en_cours":
+        message = "Cette opération est déjà en cours de traitement, veuillez patienter."
+    else:
+        message = "Cette opération a déjà été enregistrée (envoi en double ignoré)."
+    if request.is_json:
+        if "json" in resultat:
+            return jsonify(resultat["json"]), resultat.get("code", 200)
+        return jsonify({"status": "error", "message": message}), 409
+    flash(message, "info")
+    return redirect(resultat.get("location") or request.referrer or request.path)
+
+
+def idempotent(vue):
+    """
+    Décorateur pour les routes POST qui écrivent un paiement ou une dépense.
+    Sans clé dans la requête, la vue s'exécute normalement (anciens formulaires).
+    """
+    @wraps(vue)
+    def wrapper(*args, **kwargs):
+        if request.method != "POST":
+            return vue(*args, **kwargs)
+        cle = _cle_requete()
+        if not cle:
+            return vue(*args, **kwargs)
+
+        precedent = reserver(cle)
+        if precedent is not None:
+            return _rejouer(precedent)
+
+        succes_avant = _nb_succes()
+        try:
+            reponse = vue(*args, **kwargs)
+        except Exception:
+            liberer(cle)
+            raise
+
+        reponse = make_response(reponse)
+        if not _succes(reponse, succes_avant):
+            liberer(cle)
+        elif reponse.is_json:
+            terminer(cle, {"json": reponse.get_json(silent=True), "code": reponse.status_code})
+        else:
+            terminer(cle, {"location": reponse.headers.get("Location")})
+        return reponse
+    return wrapper
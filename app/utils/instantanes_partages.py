@@ -0,0 +1,103 @@
+# app/utils/instantanes_partages.py
+"""
+Publication des instantanés de feuilles entre les workers gunicorn d'un même hôte.
+
+Chaque worker garde ses instantanés en mémoire ; sans partage, les deux workers
+téléchargeaient chacun les mêmes feuilles. Le worker qui lit une feuille sur
+Google Sheets (ou qui y reporte sa propre écriture) dépose l'instantané dans
+DATA_FOLDER/instantanes/<feuille>.snap ; les autres, au lieu d'appeler l'API,
+relisent ce fichier s'il porte la version courante de la feuille.
+
+C'est un cache de fichiers JSON partagé entre les workers, pas une mémoire
+partagée : chaque worker qui reprend un instantané le décode dans sa propre
+mémoire. Le gain est d'éviter l'appel à l'API, pas la copie.
+
+Format : une ligne d'en-tête JSON {"version", "time", "feuille"} puis le corps
+JSON {"entetes", "lignes"}. Le fichier est remplacé atomiquement (os.replace) :
+un lecteur voit toujours un fichier complet, l'ancien ou le nouveau.
+"time" est l'heure de la lecture sur Google Sheets, si bien que l'expiration des
+instantanés (saisies manuelles dans le classeur) reste la même pour tous.
+"""
+import json
+import logging
+import os
+import re
+import threading
+
+from app.utils import local_store
+
+DOSSIER = os.path.join(local_store.DATA_FOLDER, "instantanes")
+
+
+def _chemin(feuille):
+    return os.path.join(DOSSIER, re.sub(r"[^\w.-]+", "_", feuille) + ".snap")
+
+
+def version_publiee(feuille):
+    """Version de l'instantané publié pour la feuille (lecture de l'en-tête seul), ou None."""
+    try:
+        with open(_chemin(feuille), "rb") as f:
+            return json.loads(f.readline()).get("version")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def publier(feuille, snap):
+    """
+    Dépose l'instantané (entetes, lignes, version, time) pour les autres workers,
+    sauf si une version au moins aussi récente est déjà publiée. À appeler hors
+    de tout verrou : l'encodage d'une grande feuille prend du temps.
+    """
+    publiee = version_publiee(feuille)
+    if publiee is not None and publiee >= snap["version"]:
+        return
+    entete = json.dumps({"feuille": feuille, "version": snap["version"], "time": snap["time"]})
+    corps = json.dumps({"entetes": snap["entetes"], "lignes": snap["lignes"]}, ensure_ascii=False)
+    chemin = _chemin(feuille)
+    temporaire = f"{chemin}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(DOSSIER, exist_ok=True)
+        with open(temporaire, "w", encoding="utf-8") as f:
+            f.write(entete + "\n" + corps)
+        os.replace(temporaire, chemin)
+    except OSError as e:
+        logging.warning("Instantané %s non publié : %s", feuille, e)
+        try:
+            os.remove(temporaire)
+        except OSError:
+            pass
+
+
+def charger(feuille, version, expiration, maintenant):
+    """
+    Retourne l'instantané publié {"entetes", "lignes", "version", "time"} s'il porte
+    `version` et n'a pas expiré, sinon None (il faudra lire la feuille).
+    version/expiration à None : dernier instantané connu, quel qu'il soit (panne).
+    """
+    try:
+        with open(_chemin(feuille), "rb") as f:
+            entete = json.loads(f.readline())
+            # En-tête seul d'abord : un fichier périmé n'est jamais décodé en entier
+            if version is not None and entete.get("version") != version:
+                return None
+            if expiration is not None and maintenant - entete.get("time", 0) > expiration:
+                return None
+            corps = json.loads(f.read())
+    except (OSError, ValueError):
+        return None  # absent, vide ou illisible : on retombe sur l'API
+    return {"entetes": corps["entetes"], "lignes": corps["lignes"],
+            "version": entete["version"], "time": entete["time"]}
+
+
+def supprimer(feuille=None):
+    """Retire l'instantané publié d'une feuille (ou tous)."""
+    try:
+        noms = [_chemin(feuille)] if feuille else [
+            os.path.join(DOSSIER, n) for n in os.listdir(DOSSIER) if n.endswith(".snap")]
+    except OSError:
+        return
+    for chemin in noms:
+        try:
+            os.remove(chemin)
+        except OSError:
+            pass
@@ -0,0 +1,114 @@
+# app/utils/local_store.py
+"""
+Petite base SQLite locale, partagée par tous les workers gunicorn d'un même hôte.
+
+Sert aux états qui doivent rester cohérents entre processus (séquences d'ID, etc.)
+sans passer par l'API Google Sheets. Le dossier vient de la variable DATA_FOLDER
+(disque persistant sur Render), sinon app/data.
+"""
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows (exécutable PyInstaller)
+    fcntl = None
+    import msvcrt
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FOLDER = os.environ.get("DATA_FOLDER") or os.path.join(BASE_DIR, "..", "data")
+DB_FILE = os.path.join(DATA_FOLDER, "local_store.db")
+
+_SCHEMAS = []
+_schemas_appliques = 0  # nombre de _SCHEMAS déjà exécutés dans ce processus
+_schemas_lock = threading.Lock()
+_local = threading.local()  # connexion du thread, avec le pid qui l'a ouverte
+
+
+def register_schema(sql):
+    """Déclare des CREATE TABLE IF NOT EXISTS, exécutés une fois par processus."""
+    _SCHEMAS.append(sql)
+
+
+def _appliquer_schemas(conn):
+    global _schemas_appliques
+    if _schemas_appliques == len(_SCHEMAS):
+        return
+    with _schemas_lock:
+        # Les modules peuvent déclarer leur schéma après la première connexion
+        for sql in _SCHEMAS[_schemas_appliques:]:
+            conn.executescript(sql)
+        _schemas_appliques = len(_SCHEMAS)
+
+
+def _connect():
+    """
+    Connexion SQLite du thread courant, ouverte au premier usage puis réutilisée.
+    Une connexion héritée d'un fork n'est jamais reprise : le processus enfant
+    ouvre la sienne.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        os.makedirs(DATA_FOLDER, exist_ok=True)
+        # isolation_level=None : on pilote les transactions nous-mêmes (BEGIN IMMEDIATE)
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn, _local.pid = conn, os.getpid()
+    _appliquer_schemas(conn)
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Ouvre une transaction en écriture exclusive (BEGIN IMMEDIATE) : deux workers
+    ne peuvent pas l'exécuter en même temps. Commit à la sortie, rollback sur erreur.
+    Imbriquée dans une transaction du même thread, elle en fait simplement partie.
+    """
+    conn = _connect()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+@contextmanager
+def lecture():
+    """Connexion pour des lectures simples (pas de verrou d'écriture)."""
+    yield _connect()
+
+
+@contextmanager
+def verrou(nom):
+    """
+    Verrou exclusif entre processus (fichier DATA_FOLDER/<nom>.lock), pour une
+    lecture-modification-écriture qui passe par le réseau : une transaction
+    SQLite tenue pendant des appels Sheets bloquerait les autres écritures de la
+    base (quota, versions), y compris celles de ces appels eux-mêmes.
+    """
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    chemin = os.path.join(DATA_FOLDER, re.sub(r"[^\w.-]+", "_", nom) + ".lock")
+    with open(chemin, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,233 @@
+# app/utils/metriques.py
+"""
+Métriques de fonctionnement (compteurs, histogrammes, jauges) au format texte Prometheus.
+
+Sur le chemin chaud, une mesure n'est qu'une mise à jour de dictionnaire sous
+verrou, dans la mémoire du worker. Chaque worker dépose périodiquement ses
+valeurs dans DATA_FOLDER/metriques/<pid>.json (au plus toutes les
+INTERVALLE_PUBLICATION secondes, à la fin d'une requête) ; l'export additionne
+les fichiers des workers vivants, puis ajoute les jauges lues au moment de la
+collecte (file d'écritures, disjoncteur, quota...).
+
+    compteur("caisse_sheets_appels_total", operation="values.get", feuille="Classes")
+    observer("caisse_sheets_duree_secondes", 0.42, operation="values.get")
+"""
+import json
+import os
+import threading
+import time
+
+from app.utils import local_store
+
+DOSSIER = os.path.join(local_store.DATA_FOLDER, "metriques")
+INTERVALLE_PUBLICATION = 10  # secondes
+
+SEUILS_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SEUILS_NOMBRE = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# {nom: (type, aide, seuils)}
+DEFINITIONS = {
+    "caisse_sheets_appels_total": ("counter", "Appels HTTP à l'API Google Sheets / Drive", None),
+    "caisse_sheets_duree_secondes": ("histogram", "Durée des appels à l'API Google Sheets", SEUILS_DUREE),
+    "caisse_sheets_octets_total": ("counter", "Octets reçus de l'API Google Sheets", None),
+    "caisse_sheets_lignes_lues_total": ("counter", "Lignes lues lors des chargements complets de feuilles", None),
+    "caisse_sheets_reessais_total": ("counter", "Nouveaux essais après une réponse 429", None),
+    "caisse_quota_attente_secondes": ("histogram", "Attente imposée par le limiteur de quota avant un appel", SEUILS_DUREE),
+    "caisse_cache_instantanes_total": ("counter", "Accès aux instantanés de feuilles par résultat", None),
+    "caisse_requetes_duree_secondes": ("histogram", "Durée des requêtes HTTP par route", SEUILS_DUREE),
+    "caisse_requetes_appels_sheets": ("histogram", "Appels Sheets effectués par requête HTTP", SEUILS_NOMBRE),
+}
+
+_verrou = threading.Lock()
+_compteurs = {}    # {(nom, etiquettes): valeur}
+_histogrammes = {}  # {(nom, etiquettes): [comptes par seuil..., somme, total]}
+_jauges = {}       # {nom: (aide, fonction -> valeur | {etiquettes(tuple): valeur})}
+_derniere_publication = 0.0
+_requete = threading.local()
+
+
+def _cle(nom, etiquettes):
+    return nom, tuple(sorted((k, str(v)) for k, v in etiquettes.items()))
+
+
+def compteur(nom, valeur=1, **etiquettes):
+    cle = _cle(nom, etiquettes)
+    with _verrou:
+        _compteurs[cle] = _compteurs.get(cle, 0) + valeur
+
+
+def observer(nom, valeur, **etiquettes):
+    seuils = DEFINITIONS[nom][2]
+    cle = _cle(nom, etiquettes)
+    with _verrou:
+        h = _histogrammes.get(cle)
+        if h is None:
+            h = _histogrammes[cle] = [0] * (len(seuils) + 2)
+        for i, seuil in enumerate(seuils):
+            if valeur <= seuil:
+                h[i] += 1
+                break
+        h[-2] += valeur
+        h[-1] += 1
+
+
+def jauge(nom, aide, fonction):
+    """Déclare une jauge calculée à chaque collecte (valeur, ou {etiquettes: valeur})."""
+    _jauges[nom] = (aide, fonction)
+
+
+# --- Suivi par requête (durée, nombre d'appels Sheets) ---
+
+def debut_requete():
+    _requete.debut = time.perf_counter()
+    _requete.appels = 0
+
+
+def appel_sheets():
+    _requete.appels = getattr(_requete, "appels", 0) + 1
+
+
+def appels_requete():
+    """Appels Sheets comptés pour le thread courant depuis debut_requete()."""
+    return getattr(_requete, "appels", 0)
+
+
+def ajouter_appels(n):
+    """Reporte sur le thread courant des appels faits pour lui par un autre thread."""
+    _requete.appels = appels_requete() + n
+
+
+def chronologie():
+    """Liste où consigner les appels Sheets du thread courant (requête profilée), sinon None."""
+    return getattr(_requete, "chronologie", None)
+
+
+def suivre_chronologie(liste):
+    """Active (liste) ou coupe (None) la consignation des appels Sheets pour ce thread."""
+    _requete.chronologie = liste
+
+
+def fin_requete(route, methode, statut):
+    debut = getattr(_requete, "debut", None)
+    if debut is None:
+        return
+    _requete.debut = None
+    observer("caisse_requetes_duree_secondes", time.perf_counter() - debut,
+             route=route or "inconnue", methode=methode, statut=statut)
+    observer("caisse_requetes_appels_sheets", appels_requete(), route=route or "inconnue")
+    if time.time() - _derniere_publication > INTERVALLE_PUBLICATION:
+        publier()
+
+
+# --- Publication et export ---
+
+def publier():
+    """Dépose les valeurs de ce worker pour l'export (écriture atomique)."""
+    global _derniere_publication
+    with _verrou:
+        _derniere_publication = time.time()
+        donnees = {
+            "compteurs": [[n, list(map(list, e)), v] for (n, e), v in _compteurs.items()],
+            "histogrammes": [[n, list(map(list, e)), list(h)] for (n, e), h in _histogrammes.items()],
+        }
+    chemin = os.path.join(DOSSIER, f"{os.getpid()}.json")
+    try:
+        os.makedirs(DOSSIER, exist_ok=True)
+        with open(chemin + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(donnees, f)
+        os.replace(chemin + ".tmp", chemin)
+    except OSError:
+        pass
+
+
+def _processus_vivant(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # existe mais appartient à un autre utilisateur
+    return True
+
+
+def _fusionner():
+    compteurs, histogrammes = {}, {}
+    try:
+        fichiers = [n for n in os.listdir(DOSSIER) if n.endswith(".json")]
+    except OSError:
+        fichiers = []
+    for nom_fichier in fichiers:
+        chemin = os.path.join(DOSSIER, nom_fichier)
+        try:
+            pid = int(nom_fichier[:-5])
+        except ValueError:
+            continue
+        if not _processus_vivant(pid):
+            try:
+                os.remove(chemin)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(chemin, encoding="utf-8") as f:
+                donnees = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for nom, etiquettes, valeur in donnees.get("compteurs", []):
+            cle = (nom, tuple(map(tuple, etiquettes)))
+            compteurs[cle] = compteurs.get(cle, 0) + valeur
+        for nom, etiquettes, h in donnees.get("histogrammes", []):
+            cle = (nom, tuple(map(tuple, etiquettes)))
+            cumul = histogrammes.get(cle)
+            histogrammes[cle] = h if cumul is None else [a + b for a, b in zip(cumul, h)]
+    return compteurs, histogrammes
+
+
+def _etiquettes(etiquettes, extra=()):
+    paires = list(etiquettes) + list(extra)
+    if not paires:
+        return ""
+    echapper = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{echapper(v)}"' for k, v in paires) + "}"
+
+
+def _nombre(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def exporter():
+    """Texte au format d'exposition Prometheus (tous les workers vivants)."""
+    publier()
+    compteurs, histogrammes = _fusionner()
+    lignes = []
+    for nom, (type_, aide, seuils) in DEFINITIONS.items():
+        lignes.append(f"# HELP {nom} {aide}")
+        lignes.append(f"# TYPE {nom} {type_}")
+        if type_ == "counter":
+            for (n, etiquettes), valeur in sorted(compteurs.items()):
+                if n == nom:
+                    lignes.append(f"{nom}{_etiquettes(etiquettes)} {_nombre(valeur)}")
+        else:
+            for (n, etiquettes), h in sorted(histogrammes.items()):
+                if n != nom:
+                    continue
+                cumul = 0
+                for seuil, nb in zip(seuils, h):
+                    cumul += nb
+                    lignes.append(f"{nom}_bucket{_etiquettes(etiquettes, [('le', seuil)])} {cumul}")
+                lignes.append(f"{nom}_bucket{_etiquettes(etiquettes, [('le', '+Inf')])} {h[-1]}")
+                lignes.append(f"{nom}_sum{_etiquettes(etiquettes)} {_nombre(h[-2])}")
+                lignes.append(f"{nom}_count{_etiquettes(etiquettes)} {h[-1]}")
+    for nom, (aide, fonction) in _jauges.items():
+        try:
+            valeur = fonction()
+        except Exception:
+            continue
+        lignes.append(f"# HELP {nom} {aide}")
+        lignes.append(f"# TYPE {nom} gauge")
+        if isinstance(valeur, dict):
+            for etiquettes, v in sorted(valeur.items()):
+                lignes.append(f"{nom}{_etiquettes(etiquettes)} {_nombre(v)}")
+        else:
+            lignes.append(f"{nom} {_nombre(valeur)}")
+    return "\n".join(lignes) + "\n"
@@ -0,0 +1,92 @@
+# app/utils/pdf_resumes.py
+"""
+Récapitulatifs PDF des paiements (inscriptions et travaux) avec ReportLab.
+
+Module sans état ni accès à Google Sheets : il est importé tel quel par les
+processus du pool de rapports_lot, démarrés à neuf (spawn) sans l'application.
+"""
+from io import BytesIO
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+
+def generate_summary_pdf(summary_data, nom_classe, type_inscription):
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    margin = 50
+    y = height - margin
+
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(margin, y, f"Résumé des paiements - {nom_classe} - {type_inscription}")
+    y -= 30
+
+    c.setFont("Helvetica", 12)
+    c.drawString(margin, y, f"Étudiants payés : {summary_data['payes']}")
+    y -= 20
+    c.drawString(margin, y, f"Étudiants non payés : {summary_data['non_payes']}")
+    y -= 20
+    c.drawString(margin, y, f"Total des recettes : {summary_data['total_recettes']:.2f} USD")
+    y -= 40
+
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(margin, y, "Détail des paiements :")
+    y -= 20
+
+    c.setFont("Helvetica", 10)
+    for etudiant, statut in summary_data['detail'].items():
+        if y < margin:
+            c.showPage()
+            y = height - margin
+            c.setFont("Helvetica", 10)
+        c.drawString(margin, y, f"{etudiant}: {statut}")
+        y -= 15
+
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+
+def generate_summary_pdf_travaux(summary_data, nom_classe, type_travail):
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    margin = 50
+    y = height - margin
+
+    # Titre
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(margin, y, f"Résumé des paiements - {nom_classe} - {type_travail}")
+    y -= 30
+
+    # Résumé global
+    c.setFont("Helvetica", 12)
+    c.drawString(margin, y, f"Étudiants payés : {summary_data['payes']}")
+    y -= 20
+    c.drawString(margin, y, f"Étudiants non payés : {summary_data['non_payes']}")
+    y -= 20
+    c.drawString(margin, y, f"Total des recettes : {summary_data['total_recettes']:.2f} USD")
+    y -= 40
+
+    # Détails
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(margin, y, "Détail des paiements :")
+    y -= 20
+
+    c.setFont("Helvetica", 10)
+    for etudiant, infos in summary_data['detail'].items():
+        # infos doit contenir {'type_travail': ..., 'statut': ..., 'montant': ...}
+        if y < margin:
+            c.showPage()
+            y = height - margin
+            c.setFont("Helvetica", 10)
+
+        ligne = (f"{etudiant} | Travail: {infos['type_travail']} | "
+                 f"Statut: {infos['statut']} | Montant: {infos['montant']:.2f} USD")
+        c.drawString(margin, y, ligne)
+        y -= 15
+
+    c.save()
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,209 @@
+# app/utils/profilage.py
+"""
+Profilage à la demande d'une requête (réservé aux administrateurs).
+
+Une requête lancée avec ?profil=1 (ou l'en-tête X-Profil: 1) s'exécute sous
+cProfile ; les appels Google Sheets qu'elle déclenche sont consignés en
+chronologie (y compris ceux des lectures parallèles). Le résultat est déposé
+dans DATA_FOLDER/profils :
+    <id>.json  résumé : requête, répartition du temps (réseau, pandas, Jinja...),
+               arbre d'appels élagué, fonctions les plus coûteuses, chronologie Sheets
+    <id>.prof  statistiques pstats brutes (snakeviz, python -m pstats)
+Au plus PROFILS_MAX profils sont gardés, PROFILS_TTL secondes au plus.
+"""
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+
+from app.utils import local_store, metriques
+
+DOSSIER = os.path.join(local_store.DATA_FOLDER, "profils")
+PROFILS_MAX = 50
+PROFILS_TTL = 7 * 24 * 3600
+SEUIL_ARBRE = 0.01   # nœuds de moins de 1 % du temps total élagués
+PROFONDEUR_MAX = 25
+NB_FONCTIONS = 40
+
+# Un seul profil à la fois par worker (cProfile n'aime pas les profileurs concurrents)
+_en_cours = threading.Lock()
+_contexte = threading.local()
+
+# Répartition du temps propre des fonctions par grande famille (premier motif trouvé)
+FAMILLES = (
+    ("réseau", ("/requests/", "/urllib3/", "/ssl.py", "/socket.py", "/http/", "/google/auth", "/httplib2/")),
+    ("gspread", ("/gspread/", "/gspread_dataframe/")),
+    ("pandas / numpy", ("/pandas/", "/numpy/")),
+    ("jinja", ("/jinja2/", "/markupsafe/")),
+    ("pdf", ("/reportlab/", "/weasyprint/", "/fpdf/")),
+    ("base locale", ("sqlite3",)),
+    ("application", ("/app/",)),
+)
+
+
+def demarrer():
+    """Démarre le profilage de la requête courante ; False si un autre profil est en cours."""
+    if not _en_cours.acquire(blocking=False):
+        return False
+    profil = cProfile.Profile()
+    _contexte.profil = profil
+    _contexte.debut = time.perf_counter()
+    _contexte.chronologie = []
+    metriques.suivre_chronologie(_contexte.chronologie)
+    profil.enable()
+    return True
+
+
+def en_cours():
+    return getattr(_contexte, "profil", None) is not None
+
+
+def terminer(infos):
+    """Arrête le profil de la requête courante, l'enregistre et retourne son identifiant."""
+    profil = getattr(_contexte, "profil", None)
+    if profil is None:
+        return None
+    try:
+        profil.disable()
+        duree = time.perf_counter() - _contexte.debut
+        metriques.suivre_chronologie(None)
+        id_profil = f"{datetime.now():%Y%m%d-%H%M%S-%f}"  # triable par date
+        os.makedirs(DOSSIER, exist_ok=True)
+        chemin = os.path.join(DOSSIER, id_profil)
+        profil.dump_stats(chemin + ".prof")
+        stats = pstats.Stats(profil)
+        resume = dict(infos, id=id_profil, date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                      duree=round(duree, 4))
+        resume.update(_analyser(stats, duree))
+        resume["chronologie"] = [
+            dict(appel, debut=round(appel["debut"] - _contexte.debut, 4), duree=round(appel["duree"], 4))
+            for appel in sorted(_contexte.chronologie, key=lambda a: a["debut"])
+        ]
+        resume["appels_sheets"] = len(resume["chronologie"])
+        resume["duree_sheets"] = round(sum(a["duree"] for a in resume["chronologie"]), 4)
+        with open(chemin + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(resume, f, ensure_ascii=False)
+        os.replace(chemin + ".json.tmp", chemin + ".json")
+        purger()
+        return id_profil
+    finally:
+        _contexte.profil = None
+        _en_cours.release()
+
+
+def _nom(fonction):
+    fichier, ligne, nom = fonction
+    if fichier == "~":
+        return nom  # fonction intégrée (<built-in method ...>)
+    return f"{nom} ({os.path.basename(fichier)}:{ligne})"
+
+
+def _famille(fichier):
+    fichier = fichier.replace("\\", "/")
+    for famille, motifs in FAMILLES:
+        if any(m in fichier for m in motifs):
+            return famille
+    return "autres"
+
+
+def _analyser(stats, duree):
+    entrees = stats.stats  # {fonction: (cc, nc, tottime, cumtime, appelants)}
+    total = max(duree, 1e-9)
+
+    repartition = {}
+    for (fichier, _, nom), (_, _, tottime, _, _) in entrees.items():
+        famille = _famille(fichier if fichier != "~" else nom)
+        repartition[famille] = repartition.get(famille, 0) + tottime
+
+    fonctions = sorted(entrees.items(), key=lambda e: e[1][3], reverse=True)[:NB_FONCTIONS]
+
+    # Arbre d'appels : enfants[appelant] = [(appelée, appels, temps cumulé depuis cet appelant)]
+    enfants = {}
+    for appelee, (_, _, _, _, appelants) in entrees.items():
+        for appelant, (_, nc, _, ct) in appelants.items():
+            enfants.setdefault(appelant, []).append((appelee, nc, ct))
+    racines = [(f, v[1], v[3]) for f, v in entrees.items() if not v[4]]
+
+    def noeud(fonction, appels, cumul, chemin):
+        n = {"nom": _nom(fonction), "appels": appels, "cumul": round(cumul, 4),
+             "part": round(100 * cumul / total, 1), "enfants": []}
+        if len(chemin) < PROFONDEUR_MAX:
+            for enfant, nc, ct in sorted(enfants.get(fonction, ()), key=lambda e: e[2], reverse=True):
+                if ct >= SEUIL_ARBRE * total and enfant not in chemin:
+                    n["enfants"].append(noeud(enfant, nc, ct, chemin | {enfant}))
+        return n
+
+    arbre = [noeud(f, nc, ct, {f}) for f, nc, ct in sorted(racines, key=lambda r: r[2], reverse=True)
+             if ct >= SEUIL_ARBRE * total]
+    return {
+        "repartition": sorted(([f, round(t, 4), round(100 * t / total, 1)] for f, t in repartition.items()),
+                              key=lambda r: r[1], reverse=True),
+        "fonctions": [{"nom": _nom(f), "appels": v[1], "propre": round(v[2], 4), "cumul": round(v[3], 4)}
+                      for f, v in fonctions],
+        "arbre": arbre,
+    }
+
+
+def lister():
+    """Résumés (sans arbre ni chronologie) des profils conservés, du plus récent au plus ancien."""
+    profils = []
+    try:
+        noms = sorted((n for n in os.listdir(DOSSIER) if n.endswith(".json")), reverse=True)
+    except OSError:
+        return []
+    for nom in noms:
+        resume = charger(nom[:-5])
+        if resume:
+            profils.append({k: resume.get(k) for k in
+                            ("id", "date", "methode", "chemin", "route", "statut", "utilisateur",
+                             "duree", "appels_sheets", "duree_sheets")})
+    return profils
+
+
+def _chemin(id_profil, extension):
+    # L'identifiant vient de l'URL : pas de séparateur de chemin
+    if not id_profil or os.path.basename(id_profil) != id_profil:
+        return None
+    return os.path.join(DOSSIER, id_profil + extension)
+
+
+def charger(id_profil):
+    chemin = _chemin(id_profil, ".json")
+    if chemin is None:
+        return None
+    try:
+        with open(chemin, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def fichier_brut(id_profil):
+    """Chemin du fichier .prof s'il existe."""
+    chemin = _chemin(id_profil, ".prof")
+    return chemin if chemin and os.path.exists(chemin) else None
+
+
+def purger():
+    """Applique la rétention : profils plus vieux que PROFILS_TTL, puis au-delà de PROFILS_MAX."""
+    try:
+        ids = sorted({n.rsplit(".", 1)[0] for n in os.listdir(DOSSIER) if n.endswith((".json", ".prof"))},
+                     reverse=True)
+    except OSError:
+        return
+    limite = time.time() - PROFILS_TTL
+    for rang, id_profil in enumerate(ids):
+        base = os.path.join(DOSSIER, id_profil)
+        try:
+            ancien = os.path.getmtime(base + ".prof") < limite
+        except OSError:
+            ancien = True
+        if rang >= PROFILS_MAX or ancien:
+            for extension in (".json", ".prof"):
+                try:
+                    os.remove(base + extension)
+                except OSError:
+                    pass
@@ -0,0 +1,236 @@
+# app/utils/quota.py
+"""
+Limiteur de débit partagé pour l'API Google Sheets (seau à jetons).
+
+Le quota Sheets est compté par minute pour tout le compte de service : les deux
+workers gunicorn et tous leurs threads puisent donc dans un seul seau, tenu dans
+la base locale (BEGIN IMMEDIATE sérialise les prises entre processus). Chaque
+requête HTTP de gspread passe par ClientLimite, qui prend un jeton avant l'envoi.
+
+Priorités : une écriture interactive peut vider le seau ; une lecture interactive
+laisse une petite réserve aux écritures ; le travail de fond (tâches, préchargements)
+ne consomme que si le seau est bien rempli. Quand il faut attendre, l'attente est
+calculée d'après le débit de remplissage (et non plus un sommeil exponentiel à
+l'aveugle) ; au-delà de ATTENTE_MAX_INTERACTIVE, QuotaDepasse indique à l'appelant
+dans combien de temps réessayer.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import unquote
+
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+from requests.exceptions import RequestException
+
+from app.utils import disjoncteur, local_store, metriques
+
+QUOTA_PAR_MINUTE = int(os.environ.get("SHEETS_QUOTA_PAR_MINUTE", "60"))
+CAPACITE = float(QUOTA_PAR_MINUTE)
+DEBIT = QUOTA_PAR_MINUTE / 60.0  # jetons par seconde
+
+# Part du seau qu'une priorité doit laisser aux priorités supérieures
+RESERVES = {
+    "ecriture": 0.0,
+    "lecture": 0.1 * CAPACITE,
+    "fond": 0.3 * CAPACITE,
+}
+ATTENTE_MAX_INTERACTIVE = 15.0  # secondes ; au-delà on rend la main avec QuotaDepasse
+TENTATIVES_429 = 4
+
+local_store.register_schema("""
+CREATE TABLE IF NOT EXISTS quota_sheets (
+    nom TEXT PRIMARY KEY,
+    jetons REAL NOT NULL,
+    maj REAL NOT NULL
+);
+""")
+
+_contexte = threading.local()
+
+
+class QuotaDepasse(RuntimeError):
+    """Quota Sheets épuisé pour un moment ; `attente` = secondes avant de réessayer."""
+
+    def __init__(self, attente):
+        self.attente = max(1, int(round(attente)))
+        super().__init__(f"Quota Google Sheets atteint, réessayez dans environ {self.attente} s.")
+
+
+@contextmanager
+def priorite(niveau):
+    """Fixe la priorité des appels Sheets du thread courant ("ecriture", "lecture", "fond")."""
+    precedent = getattr(_contexte, "priorite", None)
+    _contexte.priorite = niveau
+    try:
+        yield
+    finally:
+        _contexte.priorite = precedent
+
+
+def priorite_courante():
+    """Priorité fixée pour le thread courant (None = selon la méthode HTTP)."""
+    return getattr(_contexte, "priorite", None)
+
+
+def _niveau(methode):
+    niveau = getattr(_contexte, "priorite", None)
+    if niveau == "fond":
+        return "fond"
+    return "lecture" if methode.upper() == "GET" else "ecriture"
+
+
+def _remplir(conn, maintenant):
+    ligne = conn.execute("SELECT jetons, maj FROM quota_sheets WHERE nom = 'sheets'").fetchone()
+    if ligne is None:
+        return CAPACITE
+    jetons, maj = ligne
+    return min(CAPACITE, jetons + max(0.0, maintenant - maj) * DEBIT)
+
+
+def prendre(niveau="lecture"):
+    """
+    Tente de prendre un jeton. Retourne 0 si c'est fait, sinon le nombre de
+    secondes à attendre avant qu'un jeton soit disponible pour cette priorité.
+    """
+    maintenant = time.time()
+    with local_store.transaction() as conn:
+        jetons = _remplir(conn, maintenant)
+        seuil = 1.0 + RESERVES.get(niveau, 0.0)
+        attente = 0.0
+        if jetons >= seuil:
+            jetons -= 1.0
+        else:
+            attente = (seuil - jetons) / DEBIT
+        conn.execute(
+            "INSERT INTO quota_sheets (nom, jetons, maj) VALUES ('sheets', ?, ?) "
+            "ON CONFLICT(nom) DO UPDATE SET jetons = excluded.jetons, maj = excluded.maj",
+            (jetons, maintenant),
+        )
+    return attente
+
+
+def penaliser():
+    """Un 429 est revenu malgré le seau : on le vide pour tous les workers."""
+    maintenant = time.time()
+    with local_store.transaction() as conn:
+        jetons = min(_remplir(conn, maintenant), 0.0) - 0.1 * CAPACITE
+        conn.execute(
+            "INSERT INTO quota_sheets (nom, jetons, maj) VALUES ('sheets', ?, ?) "
+            "ON CONFLICT(nom) DO UPDATE SET jetons = excluded.jetons, maj = excluded.maj",
+            (jetons, maintenant),
+        )
+
+
+def attente_estimee(niveau="lecture"):
+    """Secondes avant qu'un appel de cette priorité puisse partir (sans prendre de jeton)."""
+    with local_store.lecture() as conn:
+        jetons = _remplir(conn, time.time())
+    seuil = 1.0 + RESERVES.get(niveau, 0.0)
+    return 0.0 if jetons >= seuil else (seuil - jetons) / DEBIT
+
+
+def etat():
+    """Jetons disponibles et capacité (pour la supervision)."""
+    with local_store.lecture() as conn:
+        jetons = _remplir(conn, time.time())
+    return {"jetons": round(jetons, 2), "capacite": CAPACITE, "debit_par_seconde": DEBIT}
+
+
+def acquerir(niveau="lecture"):
+    """Attend un jeton pour cette priorité ; QuotaDepasse si l'attente est trop longue pour un utilisateur."""
+    total = 0.0
+    while True:
+        attente = prendre(niveau)
+        if attente <= 0:
+            return total
+        if niveau != "fond" and total + attente > ATTENTE_MAX_INTERACTIVE:
+            raise QuotaDepasse(attente)
+        logging.info("⏳ Quota Sheets : attente de %.1fs (%s)", attente, niveau)
+        time.sleep(attente)
+        total += attente
+
+
+class ClientLimite(HTTPClient):
+    """
+    Client HTTP gspread dont chaque requête passe par le disjoncteur puis par le
+    seau à jetons partagé.
+    """
+
+    def request(self, method, endpoint, *args, **kwargs):
+        niveau = _niveau(method)
+        operation, feuille = _operation(method, endpoint, kwargs.get("params"))
+        for tentative in range(TENTATIVES_429):
+            try:
+                etat_disjoncteur = disjoncteur.autoriser()
+                attente = acquerir(niveau)
+            except (disjoncteur.ServiceIndisponible, QuotaDepasse) as e:
+                issue = "disjoncteur" if isinstance(e, disjoncteur.ServiceIndisponible) else "quota_depasse"
+                metriques.compteur("caisse_sheets_appels_total", operation=operation, feuille=feuille, issue=issue)
+                raise
+            if attente:
+                metriques.observer("caisse_quota_attente_secondes", attente, priorite=niveau)
+            metriques.appel_sheets()
+            debut = time.perf_counter()
+            try:
+                reponse = super().request(method, endpoint, *args, **kwargs)
+            except APIError as e:
+                code = e.response.status_code
+                _mesurer(operation, feuille, str(code), debut)
+                if code == 429 and tentative < TENTATIVES_429 - 1:
+                    logging.warning("Quota Sheets dépassé (429) malgré le limiteur, seau vidé")
+                    metriques.compteur("caisse_sheets_reessais_total", operation=operation)
+                    penaliser()
+                    continue
+                if code == 429 or code >= 500:
+                    disjoncteur.echec()
+                else:
+                    disjoncteur.succes(etat_disjoncteur)  # erreur de la requête, pas du service
+                raise
+            except RequestException:
+                _mesurer(operation, feuille, "reseau", debut)
+                disjoncteur.echec()
+                raise
+            _mesurer(operation, feuille, "ok", debut)
+            metriques.compteur("caisse_sheets_octets_total", len(reponse.content or b""), operation=operation)
+            disjoncteur.succes(etat_disjoncteur)
+            return reponse
+
+
+def _mesurer(operation, feuille, issue, debut):
+    duree = time.perf_counter() - debut
+    metriques.compteur("caisse_sheets_appels_total", operation=operation, feuille=feuille, issue=issue)
+    metriques.observer("caisse_sheets_duree_secondes", duree, operation=operation)
+    chronologie = metriques.chronologie()
+    if chronologie is not None:  # requête profilée
+        chronologie.append({"debut": debut, "duree": duree, "operation": operation,
+                            "feuille": feuille, "issue": issue, "thread": threading.current_thread().name})
+
+
+def _feuille_plage(plage):
+    return unquote(str(plage)).split("!")[0].strip("'") or "*"
+
+
+def _operation(method, endpoint, params=None):
+    """("values.append", "Paiements") à partir de l'URL d'un appel gspread (étiquettes des métriques)."""
+    url = str(endpoint).split("?")[0]
+    if "googleapis.com/drive" in url:
+        return "drive", "*"
+    if "/values" not in url:
+        return ("batchUpdate" if url.endswith(":batchUpdate") else "spreadsheets." + method.lower()), "*"
+    suite = url.split("/values", 1)[1]
+    if suite.startswith(":"):  # values:batchGet, values:batchUpdate...
+        plages = (params or {}).get("ranges") or []
+        feuilles = {_feuille_plage(p) for p in (plages if isinstance(plages, list) else [plages])}
+        return "values." + suite[1:], feuilles.pop() if len(feuilles) == 1 else "*"
+    plage = suite.lstrip("/")
+    for action in ("append", "clear"):
+        if plage.endswith(":" + action):
+            return "values." + action, _feuille_plage(plage[:-len(action) - 1])
+    return ("values.get" if method.upper() == "GET" else "values.update"), _feuille_plage(plage)
+
+
+metriques.jauge("caisse_quota_jetons", "Jetons disponibles dans le seau partagé du quota Sheets",
+                lambda: etat()["jetons"])
@@ -0,0 +1,93 @@
+# app/utils/rapports_lot.py
+"""
+Génération groupée des PDF récapitulatifs de paiements (inscriptions et travaux)
+pour toutes les classes, livrés dans une archive ZIP.
+
+Les données sont lues une seule fois dans le processus web (un instantané par
+registre), puis le dessin ReportLab, purement CPU, est réparti sur un
+ProcessPoolExecutor : chaque tâche reçoit son résumé déjà calculé et ne touche
+jamais à Google Sheets. Les processus du pool sont démarrés à neuf (spawn) et non
+par fork : le pool est créé depuis un thread de tâche d'un worker gunicorn
+multithreadé, dont un autre thread peut tenir à cet instant un verrou (SQLite,
+journalisation, instantanés) qu'un enfant forké hériterait verrouillé à jamais.
+"""
+import logging
+import multiprocessing
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+TYPES_INSCRIPTION = ['1er_semestre', '2nd_semestre', 'rattrapage']
+TYPES_TRAVAUX = ['Projet tutoré', 'Stage', 'Mémoire']
+
+# En dessous, le coût de démarrage des processus dépasse le gain
+SEUIL_POOL = 8
+
+
+def _nom_fichier(texte):
+    return re.sub(r'[^\w.-]+', '_', str(texte), flags=re.UNICODE).strip('_') or 'sans_nom'
+
+
+def _rendre_pdf(tache):
+    """Exécuté dans un processus du pool : (dossier, classe, type, résumé) -> (chemin, octets)."""
+    from app.utils.pdf_resumes import generate_summary_pdf, generate_summary_pdf_travaux
+    dossier, nom_classe, type_paiement, resume = tache
+    generer = generate_summary_pdf_travaux if dossier == "Travaux" else generate_summary_pdf
+    buffer = generer(resume, nom_classe, type_paiement)
+    chemin = f"{dossier}/{_nom_fichier(nom_classe)}_{_nom_fichier(type_paiement)}.pdf"
+    return chemin, buffer.getvalue()
+
+
+def preparer_taches(classes=None):
+    """Résumés de toutes les paires (classe, type), lus sur un instantané par registre."""
+    from app.models import storage_gsheets as storage
+    taches = []
+    for dossier, registre, types in (
+        ("Inscriptions", "Paiements_Inscriptions", TYPES_INSCRIPTION),
+        ("Travaux", "Paiements_Travaux", TYPES_TRAVAUX),
+    ):
+        resumes = storage.resumes_paiements_toutes_classes(registre, types, classes)
+        taches.extend((dossier, c, t, r) for (c, t), r in resumes.items())
+    return taches
+
+
+def generer_rapports_zip(classes=None, max_workers=None):
+    """
+    Produit l'archive ZIP de tous les récapitulatifs. Retourne un BytesIO.
+    Le pool n'est utilisé qu'au-delà de SEUIL_POOL rapports ; en cas d'échec du
+    pool (environnement sans multiprocessing), le rendu se fait dans le processus.
+    """
+    taches = preparer_taches(classes)
+    max_workers = max_workers or min(len(taches), os.cpu_count() or 1) or 1
+
+    resultats = None
+    if len(taches) >= SEUIL_POOL and max_workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                resultats = list(pool.map(_rendre_pdf, taches, chunksize=max(1, len(taches) // (max_workers * 4))))
+        except (OSError, RuntimeError) as e:
+            logging.warning("Pool de processus indisponible (%s), génération séquentielle", e)
+    if resultats is None:
+        resultats = [_rendre_pdf(t) for t in taches]
+
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        vus = set()
+        for chemin, contenu in resultats:
+            base, n = chemin[:-4], 1
+            while chemin in vus:  # deux classes au nom proche après nettoyage
+                n += 1
+                chemin = f"{base}_{n}.pdf"
+            vus.add(chemin)
+            zf.writestr(chemin, contenu)
+        zf.writestr(
+            "LISEZMOI.txt",
+            f"Récapitulatifs des paiements générés le {datetime.now():%Y-%m-%d %H:%M}\n"
+            f"{len(resultats)} rapport(s) : Inscriptions/ et Travaux/, un PDF par classe et par type.\n",
+        )
+    archive.seek(0)
+    return archive
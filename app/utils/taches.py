@@ -0,0 +1,258 @@
+# app/utils/taches.py
+"""
+File de tâches en arrière-plan pour les rapports et exports longs (PDF, ZIP).
+
+Les tâches sont enregistrées dans la base locale (table 'taches', partagée par les
+workers gunicorn) et leurs résultats écrits dans DATA_FOLDER/taches. Chaque worker
+fait tourner quelques threads d'exécution démarrés à la première utilisation : un
+thread réclame atomiquement la plus ancienne tâche en attente, quel que soit le
+worker qui l'a déposée. Les threads de requête ne font plus que déposer une tâche,
+consulter son état et servir le fichier produit.
+
+File vide : la scrutation n'est qu'une lecture (pas de transaction d'écriture qui
+gênerait les écritures des requêtes sur la même base). Une tâche en cours signale
+régulièrement qu'elle est vivante (table 'taches_battements') ; sans signe de vie
+depuis TACHE_PERDUE_APRES, son worker est considéré arrêté et elle passe en erreur.
+
+Les types de tâches sont déclarés par les modules qui les proposent :
+    enregistrer_type("pdf_inscription", fonction)
+où fonction(**params) retourne (contenu: bytes | BytesIO, nom_fichier, mimetype).
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from app.utils import local_store, metriques, quota
+
+DOSSIER_RESULTATS = os.path.join(local_store.DATA_FOLDER, "taches")
+NB_THREADS = int(os.environ.get("TACHES_THREADS", "2"))
+TACHES_TTL = 24 * 3600          # résultats conservés un jour
+BATTEMENT_TACHE = 15            # secondes entre deux signes de vie d'une tâche en cours
+TACHE_PERDUE_APRES = 90         # sans signe de vie depuis, une tâche 'en_cours' est considérée perdue
+INTERVALLE_SCRUTATION = 2       # secondes (tâches déposées par un autre worker)
+
+local_store.register_schema("""
+CREATE TABLE IF NOT EXISTS taches (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    params TEXT NOT NULL,
+    etat TEXT NOT NULL,
+    utilisateur TEXT,
+    cree REAL NOT NULL,
+    debut REAL,
+    fin REAL,
+    erreur TEXT,
+    fichier TEXT,
+    nom_fichier TEXT,
+    mimetype TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_taches_etat ON taches(etat, cree);
+CREATE TABLE IF NOT EXISTS taches_battements (id TEXT PRIMARY KEY, battement REAL NOT NULL);
+""")
+
+_types = {}
+_threads = []
+_threads_lock = threading.Lock()
+_reveil = threading.Event()
+
+
+def enregistrer_type(nom, fonction):
+    """Déclare un type de tâche exécutable par la file."""
+    _types[nom] = fonction
+
+
+def _demarrer_threads():
+    # Démarrage paresseux (après le fork des workers gunicorn), et relance si le
+    # processus a été forké depuis (les threads ne survivent pas au fork).
+    with _threads_lock:
+        vivants = [t for t in _threads if t.is_alive()]
+        if len(vivants) >= NB_THREADS:
+            return
+        _threads[:] = vivants
+        for i in range(NB_THREADS - len(vivants)):
+            t = threading.Thread(target=_boucle, name=f"taches-{len(_threads) + 1}", daemon=True)
+            t.start()
+            _threads.append(t)
+
+
+def deposer(type_tache, params=None, utilisateur=None, libelle=None):
+    """
+    Dépose une tâche et retourne son identifiant. `libelle` (nom du fichier attendu)
+    sert à l'affichage en attendant le résultat.
+    """
+    if type_tache not in _types:
+        raise ValueError(f"Type de tâche inconnu : {type_tache}")
+    id_tache = uuid.uuid4().hex
+    with local_store.transaction() as conn:
+        conn.execute(
+            "INSERT INTO taches (id, type, params, etat, utilisateur, cree, nom_fichier) "
+            "VALUES (?, ?, ?, 'en_attente', ?, ?, ?)",
+            (id_tache, type_tache, json.dumps(params or {}), utilisateur, time.time(), libelle),
+        )
+    _demarrer_threads()
+    _reveil.set()
+    return id_tache
+
+
+def etat(id_tache):
+    """Retourne l'enregistrement de la tâche (dict) ou None."""
+    with local_store.lecture() as conn:
+        conn.row_factory = _dict_row
+        ligne = conn.execute("SELECT * FROM taches WHERE id = ?", (id_tache,)).fetchone()
+    if ligne:
+        ligne["params"] = json.loads(ligne["params"])
+        if ligne["etat"] == "en_attente":
+            _demarrer_threads()  # worker redémarré depuis le dépôt : personne ne l'exécuterait
+    return ligne
+
+
+def lister(utilisateur=None, limite=50):
+    """Dernières tâches (toutes, ou celles d'un utilisateur)."""
+    with local_store.lecture() as conn:
+        conn.row_factory = _dict_row
+        if utilisateur:
+            lignes = conn.execute(
+                "SELECT * FROM taches WHERE utilisateur = ? ORDER BY cree DESC LIMIT ?", (utilisateur, limite)
+            ).fetchall()
+        else:
+            lignes = conn.execute("SELECT * FROM taches ORDER BY cree DESC LIMIT ?", (limite,)).fetchall()
+    for ligne in lignes:
+        ligne["params"] = json.loads(ligne["params"])
+        ligne["cree_le"] = datetime.fromtimestamp(ligne["cree"]).strftime("%Y-%m-%d %H:%M")
+    return lignes
+
+
+def _nb_par_etat():
+    with local_store.lecture() as conn:
+        lignes = conn.execute("SELECT etat, COUNT(*) FROM taches WHERE etat IN ('en_attente', 'en_cours') GROUP BY etat")
+        comptes = {(("etat", e),): 0 for e in ("en_attente", "en_cours")}
+        comptes.update({(("etat", etat_),): nb for etat_, nb in lignes})
+    return comptes
+
+
+metriques.jauge("caisse_taches", "Tâches de fond en attente ou en cours", _nb_par_etat)
+
+
+def _dict_row(cursor, row):
+    return {col[0]: row[i] for i, col in enumerate(cursor.description)}
+
+
+_SQL_PERDUES = (
+    "SELECT t.id FROM taches t LEFT JOIN taches_battements b ON b.id = t.id "
+    "WHERE t.etat = 'en_cours' AND COALESCE(b.battement, t.debut) < ?"
+)
+
+
+def _reclamer():
+    """Passe atomiquement la plus ancienne tâche en attente à 'en_cours' et la retourne."""
+    maintenant = time.time()
+    limite = maintenant - TACHE_PERDUE_APRES
+    # Lecture d'abord : la transaction d'écriture n'est prise que s'il y a à faire
+    with local_store.lecture() as conn:
+        en_attente = conn.execute("SELECT 1 FROM taches WHERE etat = 'en_attente' LIMIT 1").fetchone()
+        perdue = conn.execute(_SQL_PERDUES + " LIMIT 1", (limite,)).fetchone()
+    if en_attente is None and perdue is None:
+        return None
+    with local_store.transaction() as conn:
+        # Tâches perdues (worker arrêté en cours d'exécution)
+        perdues = [r[0] for r in conn.execute(_SQL_PERDUES, (limite,))]
+        for id_perdue in perdues:
+            conn.execute(
+                "UPDATE taches SET etat = 'erreur', fin = ?, erreur = 'Interrompue (redémarrage du serveur)' "
+                "WHERE id = ?", (maintenant, id_perdue))
+            conn.execute("DELETE FROM taches_battements WHERE id = ?", (id_perdue,))
+        ligne = conn.execute(
+            "SELECT id, type, params FROM taches WHERE etat = 'en_attente' ORDER BY cree LIMIT 1"
+        ).fetchone()
+        if ligne is None:
+            return None
+        conn.execute("UPDATE taches SET etat = 'en_cours', debut = ? WHERE id = ?", (maintenant, ligne[0]))
+        conn.execute("INSERT OR REPLACE INTO taches_battements (id, battement) VALUES (?, ?)",
+                     (ligne[0], maintenant))
+    return {"id": ligne[0], "type": ligne[1], "params": json.loads(ligne[2])}
+
+
+def _battre(id_tache, fini):
+    """Signe de vie de la tâche tant qu'elle s'exécute (thread à part)."""
+    while not fini.wait(BATTEMENT_TACHE):
+        try:
+            with local_store.transaction() as conn:
+                conn.execute("UPDATE taches_battements SET battement = ? WHERE id = ?", (time.time(), id_tache))
+        except Exception as e:
+            logging.warning("Signe de vie de la tâche %s non enregistré : %s", id_tache, e)
+
+
+def _executer(tache):
+    fini = threading.Event()
+    threading.Thread(target=_battre, args=(tache["id"], fini), name=f"battement-{tache['id'][:8]}",
+                     daemon=True).start()
+    try:
+        with quota.priorite("fond"):  # les requêtes des utilisateurs passent avant
+            contenu, nom_fichier, mimetype = _types[tache["type"]](**tache["params"])
+        if hasattr(contenu, "getvalue"):
+            contenu = contenu.getvalue()
+        os.makedirs(DOSSIER_RESULTATS, exist_ok=True)
+        fichier = os.path.join(DOSSIER_RESULTATS, tache["id"])
+        with open(fichier + ".tmp", "wb") as f:
+            f.write(contenu)
+        os.replace(fichier + ".tmp", fichier)
+        with local_store.transaction() as conn:
+            conn.execute(
+                "UPDATE taches SET etat = 'termine', fin = ?, fichier = ?, nom_fichier = ?, mimetype = ? WHERE id = ?",
+                (time.time(), fichier, nom_fichier, mimetype, tache["id"]),
+            )
+            conn.execute("DELETE FROM taches_battements WHERE id = ?", (tache["id"],))
+    except Exception as e:
+        logging.exception("Échec de la tâche %s (%s)", tache["id"], tache["type"])
+        with local_store.transaction() as conn:
+            conn.execute(
+                "UPDATE taches SET etat = 'erreur', fin = ?, erreur = ? WHERE id = ?",
+                (time.time(), str(e) or e.__class__.__name__, tache["id"]),
+            )
+            conn.execute("DELETE FROM taches_battements WHERE id = ?", (tache["id"],))
+    finally:
+        fini.set()
+
+
+def purger():
+    """Supprime les tâches terminées depuis plus de TACHES_TTL et leurs fichiers."""
+    limite = time.time() - TACHES_TTL
+    with local_store.transaction() as conn:
+        fichiers = [r[0] for r in conn.execute(
+            "SELECT fichier FROM taches WHERE etat IN ('termine', 'erreur') AND fin < ?", (limite,)
+        ) if r[0]]
+        conn.execute("DELETE FROM taches WHERE etat IN ('termine', 'erreur') AND fin < ?", (limite,))
+    for fichier in fichiers:
+        try:
+            os.remove(fichier)
+        except OSError:
+            pass
+
+
+def _boucle():
+    derniere_purge = 0
+    while True:
+        try:
+            tache = _reclamer()
+            if tache is None:
+                if time.time() - derniere_purge > 3600:
+                    purger()
+                    derniere_purge = time.time()
+                _reveil.wait(INTERVALLE_SCRUTATION)
+                _reveil.clear()
+                continue
+            if tache["type"] not in _types:
+                message = f"Type de tâche inconnu : {tache['type']}"
+                with local_store.transaction() as conn:
+                    conn.execute("UPDATE taches SET etat = 'erreur', fin = ?, erreur = ? WHERE id = ?",
+                                 (time.time(), message, tache["id"]))
+                    conn.execute("DELETE FROM taches_battements WHERE id = ?", (tache["id"],))
+                continue
+            _executer(tache)
+        except Exception:
+            logging.exception("Erreur dans la boucle des tâches")
+            time.sleep(INTERVALLE_SCRUTATION)
@@ -0,0 +1,2 @@
+# benchmarks/__init__.py
+"""Mesures de performance hors production (classeur local, données synthétiques)."""
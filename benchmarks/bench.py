@@ -0,0 +1,276 @@
+# benchmarks/bench.py
+"""
+Mesures de performance des chemins de lecture, d'agrégation et de rapport.
+
+L'application tourne dans le processus, branchée sur un classeur local rempli
+de données synthétiques (donnees.py) : aucun appel à Google. Chaque cas est
+exécuté une fois à blanc puis `--repetitions` fois ; on retient la médiane et
+le nombre d'appels à l'API Sheets par exécution.
+
+    python -m benchmarks.bench                        # taille "petit" (~10 k lignes)
+    python -m benchmarks.bench --taille grand         # ~1 M lignes
+    python -m benchmarks.bench --paiements 200000 --filtre historique
+    python -m benchmarks.bench --enregistrer          # remplace la référence
+
+Les résultats sont comparés à la référence (benchmarks/reference.json, une
+entrée par taille) : un cas est en régression si sa médiane dépasse celle de
+la référence de plus de `--tolerance` ou s'il fait plus d'appels Sheets. Le
+code de sortie vaut alors 1. Les durées dépendent de la machine : la
+référence n'a de sens que mesurée sur la même machine que la comparaison.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference.json")
+TAILLES = ("petit", "moyen", "grand")
+BRUIT_MIN = 0.002  # secondes : en dessous, un écart n'est pas significatif
+
+
+def isoler(dossier):
+    """
+    À appeler avant tout import du paquet `app` : DATA_FOLDER (base locale,
+    instantanés partagés, métriques) pointe vers `dossier`, et le quota Sheets
+    est levé, le classeur local n'en ayant pas.
+    """
+    os.environ["DATA_FOLDER"] = dossier
+    os.environ.setdefault("SHEETS_QUOTA_PAR_MINUTE", "1000000")
+
+
+def preparer_application(feuilles, latence=0.0):
+    """Application Flask branchée sur un classeur local (après isoler()). Retourne (application, classeur)."""
+    from benchmarks import sheets_local
+    classeur = sheets_local.installer(sheets_local.ClasseurLocal(feuilles, latence=latence))
+    from app import create_app
+    application = create_app()
+    application.config["TESTING"] = True
+    return application, classeur
+
+
+class Cas:
+    """Un cas mesuré : `executer()` est chronométré, `preparer()` (non chronométré) le précède."""
+
+    def __init__(self, nom, executer, preparer=None):
+        self.nom = nom
+        self.executer = executer
+        self.preparer = preparer
+
+
+def _get(client, url):
+    def executer():
+        reponse = client.get(url)
+        if reponse.status_code != 200:
+            raise RuntimeError(f"GET {url} : HTTP {reponse.status_code}")
+        return reponse.data
+    return executer
+
+
+def construire_cas(application, feuilles):
+    from app.models import storage_gsheets as storage
+    from app.utils.rapports_lot import TYPES_INSCRIPTION, TYPES_TRAVAUX
+
+    client = application.test_client()
+    with client.session_transaction() as session:
+        session["user"], session["role"] = "bench", "admin"
+
+    classe = feuilles["Classes"][1][0]
+    etudiant = feuilles["Classes"][1][1]
+    recherche = etudiant.split()[0].lower()
+    type_travail = next((l[2] for l in feuilles["Paiements_Travaux"][1:] if l[0] == classe), TYPES_TRAVAUX[0])
+
+    def froid(*noms):
+        return lambda: [storage.invalider_instantane(nom) for nom in noms]
+
+    def chaud(*noms):
+        return lambda: [storage.get_instantane(nom) for nom in noms]
+
+    resumes = {}
+
+    def resume_inscriptions():
+        resumes["inscriptions"] = storage.get_payment_summary(classe, TYPES_INSCRIPTION[0])
+
+    def resume_travaux():
+        resumes["travaux"] = storage.get_payment_summary_travaux(classe, type_travail)
+
+    return [
+        Cas("read_sheet.froid[Paiements]", lambda: storage.read_sheet("Paiements"), froid("Paiements")),
+        Cas("read_sheet.chaud[Paiements]", lambda: storage.read_sheet("Paiements"), chaud("Paiements")),
+        Cas("read_sheet.froid[Classes]", lambda: storage.read_sheet("Classes"), froid("Classes")),
+        Cas("tableau_de_bord", _get(client, "/")),
+        Cas("historique", _get(client, "/historique")),
+        Cas("historique.recherche", _get(client, f"/historique?recherche={recherche}")),
+        Cas("get_payment_summary", resume_inscriptions),
+        Cas("get_payment_summary.froid", resume_inscriptions, froid("Paiements_Inscriptions")),
+        Cas("get_payment_summary_travaux", resume_travaux),
+        Cas("pdf.resume_inscriptions",
+            lambda: storage.generate_summary_pdf(resumes["inscriptions"], classe, TYPES_INSCRIPTION[0]),
+            lambda: resumes.get("inscriptions") or resume_inscriptions()),
+        Cas("pdf.resume_travaux",
+            lambda: storage.generate_summary_pdf_travaux(resumes["travaux"], classe, type_travail),
+            lambda: resumes.get("travaux") or resume_travaux()),
+        Cas("detail_classe", _get(client, f"/classes/classes/{classe}")),
+        Cas("detail_classe.recherche", _get(client, f"/classes/classes/{classe}?recherche={recherche}")),
+    ]
+
+
+def mesurer(cas, classeur, repetitions, budget):
+    """Exécute le cas (une fois à blanc, puis jusqu'à `repetitions` fois dans `budget` secondes)."""
+    durees, appels = [], []
+    total = 0.0
+    for rang in range(repetitions + 1):
+        if cas.preparer:
+            cas.preparer()
+        gc.collect()
+        avant = classeur.appels
+        debut = time.perf_counter()
+        cas.executer()
+        duree = time.perf_counter() - debut
+        if rang == 0:
+            continue  # exécution à blanc : imports, gabarits Jinja, caches de l'application
+        durees.append(duree)
+        appels.append(classeur.appels - avant)
+        total += duree
+        if total > budget:
+            break
+    return {
+        "repetitions": len(durees),
+        "mediane": round(statistics.median(durees), 6),
+        "min": round(min(durees), 6),
+        "max": round(max(durees), 6),
+        "appels": int(statistics.median(appels)),
+    }
+
+
+def comparer(resultats, reference, tolerance):
+    """{cas: (verdict, rapport médiane / référence)} ; verdict : regression, amelioration, stable, nouveau."""
+    verdicts = {}
+    for nom, r in resultats.items():
+        ref = (reference or {}).get(nom)
+        if ref is None:
+            verdicts[nom] = ("nouveau", None)
+            continue
+        rapport = r["mediane"] / ref["mediane"] if ref["mediane"] else None
+        ecart = r["mediane"] - ref["mediane"]
+        if r["appels"] > ref["appels"] or (rapport and rapport > 1 + tolerance and ecart > BRUIT_MIN):
+            verdict = "regression"
+        elif rapport and rapport < 1 - tolerance and -ecart > BRUIT_MIN:
+            verdict = "amelioration"
+        else:
+            verdict = "stable"
+        verdicts[nom] = (verdict, rapport)
+    return verdicts
+
+
+def afficher(resultats, reference, verdicts):
+    print(f"\n{'cas':<34}{'médiane':>11}{'min':>11}{'appels':>8}{'référence':>12}{'écart':>9}  verdict")
+    for nom, r in resultats.items():
+        ref = (reference or {}).get(nom)
+        verdict, rapport = verdicts[nom]
+        print(f"{nom:<34}{r['mediane'] * 1000:>9.1f}ms{r['min'] * 1000:>9.1f}ms{r['appels']:>8}"
+              + (f"{ref['mediane'] * 1000:>10.1f}ms" if ref else f"{'-':>12}")
+              + (f"{(rapport - 1) * 100:>+8.0f}%" if rapport else f"{'-':>9}")
+              + f"  {verdict}")
+
+
+def _lire_reference(chemin):
+    try:
+        with open(chemin, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesures de performance de la caisse facultaire")
+    parser.add_argument("--taille", choices=TAILLES, default="petit", help="jeu de données prédéfini")
+    for nom in ("classes", "etudiants", "paiements", "depenses"):
+        parser.add_argument(f"--{nom}", type=int, help=f"remplace le nombre de {nom} de la taille choisie")
+    parser.add_argument("--graine", type=int, default=42)
+    parser.add_argument("--repetitions", type=int, default=7)
+    parser.add_argument("--budget", type=float, default=30, help="secondes au plus par cas")
+    parser.add_argument("--filtre", default="", help="ne mesurer que les cas dont le nom contient ce texte")
+    parser.add_argument("--reference", default=REFERENCE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="écart relatif toléré sur la médiane")
+    parser.add_argument("--enregistrer", action="store_true", help="enregistrer ces résultats comme référence")
+    parser.add_argument("--sortie", help="fichier JSON où écrire les résultats")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    dossier = tempfile.mkdtemp(prefix="bench-caisse-")
+    isoler(dossier)
+    try:
+        from benchmarks import donnees
+        parametres = dict(donnees.TAILLES[args.taille], graine=args.graine)
+        personnalise = False
+        for nom in ("classes", "etudiants", "paiements", "depenses"):
+            if getattr(args, nom) is not None:
+                parametres[nom] = getattr(args, nom)
+                personnalise = True
+        cle = args.taille if not personnalise else "{classes}x{etudiants}-{paiements}-{depenses}".format(**parametres)
+        references = _lire_reference(args.reference)
+        if cle not in references and not args.enregistrer:
+            # Sans référence, tout serait « nouveau » et rien ne pourrait régresser
+            print(f"Aucune référence « {cle} » dans {args.reference} : lancer d'abord la même "
+                  f"commande avec --enregistrer (sur la machine qui fera les comparaisons).",
+                  file=sys.stderr)
+            return 2
+
+        debut = time.perf_counter()
+        feuilles = donnees.generer(**parametres)
+        print(f"Jeu « {cle} » : {donnees.nb_lignes(feuilles)} lignes générées "
+              f"en {time.perf_counter() - debut:.1f}s")
+        application, classeur = preparer_application(feuilles)
+
+        resultats = {}
+        for cas in construire_cas(application, feuilles):
+            if args.filtre and args.filtre not in cas.nom:
+                continue
+            resultats[cas.nom] = mesurer(cas, classeur, args.repetitions, args.budget)
+            print(f"  {cas.nom} : {resultats[cas.nom]['mediane'] * 1000:.1f}ms", flush=True)
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+    reference = references.get(cle, {}).get("cas")
+    verdicts = comparer(resultats, reference, args.tolerance)
+    afficher(resultats, reference, verdicts)
+
+    mesure = {
+        "meta": {"date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "machine": platform.node(),
+                 "python": platform.python_version(), "parametres": parametres,
+                 "lignes": donnees.nb_lignes(feuilles)},
+        "cas": resultats,
+    }
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as f:
+            json.dump(mesure, f, indent=2, ensure_ascii=False)
+    if args.enregistrer:
+        # Les cas non mesurés cette fois (--filtre) gardent leur ancienne référence
+        ancienne = references.get(cle, {}).get("cas", {})
+        mesure["cas"] = dict(ancienne, **resultats)
+        references[cle] = mesure
+        with open(args.reference, "w", encoding="utf-8") as f:
+            json.dump(references, f, indent=2, ensure_ascii=False)
+        print(f"\nRéférence « {cle} » enregistrée dans {args.reference}")
+        return 0
+    if reference:
+        machine = references[cle]["meta"].get("machine")
+        if machine != platform.node():
+            print(f"\n⚠️ Référence mesurée sur une autre machine ({machine}) : écarts de durée indicatifs.")
+    regressions = [nom for nom, (verdict, _) in verdicts.items() if verdict == "regression"]
+    if regressions:
+        print(f"\n❌ {len(regressions)} régression(s) : {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# benchmarks/charge.py
+"""
+Test de charge : des caissiers virtuels rejouent des parcours réalistes.
+
+    inscription   : connexion → type d'inscription → classe → paiements en lot
+                    → statistiques → PDF (tâche suivie jusqu'au téléchargement)
+    consultation  : connexion → tableau de bord → recherche dans l'historique
+
+Chaque utilisateur virtuel enchaîne des parcours (tirés selon --parcours)
+pendant --duree secondes. Le rapport donne le débit, les latences p50 / p95 / p99
+par route et les appels à l'API Sheets par requête (en-tête X-Appels-Sheets
+posé par benchmarks.serveur_local).
+
+Contre une application déjà lancée :
+    python -m benchmarks.serveur_local --taille moyen --workers 2 --threads 4 &
+    python -m benchmarks.charge --url http://127.0.0.1:8000 --utilisateurs 8 --duree 60
+
+Pour dimensionner gunicorn, --configurations lance une application locale par
+configuration WORKERSxTHREADS, la charge, puis compare :
+    python -m benchmarks.charge --configurations 1x4 2x4 2x8 4x4 --utilisateurs 16
+"""
+import argparse
+import html
+import json
+import random
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import requests
+
+from benchmarks.serveur_local import ENTETE_APPELS, RACINE
+
+RECHERCHES = ("kabila", "mukendi", "ilunga", "grâce", "examen", "frais", "informatique", "2025-03")
+TYPES_INSCRIPTION = ("1er_semestre", "2nd_semestre", "rattrapage")
+ATTENTE_PDF_MAX = 60  # secondes
+
+
+class Mesures:
+    """
+    Requêtes enregistrées par tous les utilisateurs virtuels (sous verrou). Seules
+    comptent les requêtes parties dans la fenêtre [debut, fin[ (après l'échauffement).
+    """
+
+    def __init__(self, debut, fin):
+        self.debut, self.fin = debut, fin
+        self._verrou = threading.Lock()
+        self.requetes = []   # (route, statut, durée, appels Sheets ou None)
+        self.parcours = {}   # {nom: [réussis, échoués]}
+
+    def requete(self, depart, route, statut, duree, appels):
+        if self.debut <= depart < self.fin:
+            with self._verrou:
+                self.requetes.append((route, statut, duree, appels))
+
+    def fin_parcours(self, nom, reussi):
+        if self.debut <= time.time() < self.fin:
+            with self._verrou:
+                compte = self.parcours.setdefault(nom, [0, 0])
+                compte[0 if reussi else 1] += 1
+
+
+class ErreurParcours(Exception):
+    pass
+
+
+class Caissier:
+    """Un utilisateur virtuel : une session HTTP (cookies), les redirections suivies une à une."""
+
+    def __init__(self, base, mesures, identifiants, pause, alea):
+        self.base = base.rstrip("/")
+        self.mesures = mesures
+        self.identifiants = identifiants
+        self.pause = pause
+        self.alea = alea
+        self.session = requests.Session()
+
+    @staticmethod
+    def _route(methode, url):
+        chemin = urlsplit(url).path
+        chemin = re.sub(r"/[0-9a-f]{32}(?=/|$)", "/<id>", chemin)  # identifiants de tâche
+        return f"{methode} {chemin}"
+
+    def appel(self, methode, url, donnees=None, suivre=True, **kwargs):
+        """Envoie la requête, l'enregistre, puis suit les redirections comme un navigateur."""
+        depart, debut = time.time(), time.perf_counter()
+        try:
+            reponse = self.session.request(methode, self.base + url, data=donnees,
+                                           allow_redirects=False, timeout=120, **kwargs)
+        except requests.RequestException as e:
+            self.mesures.requete(depart, self._route(methode, url), "erreur", time.perf_counter() - debut, None)
+            raise ErreurParcours(f"{methode} {url} : {e}") from e
+        appels = reponse.headers.get(ENTETE_APPELS)
+        self.mesures.requete(depart, self._route(methode, url), reponse.status_code,
+                             time.perf_counter() - debut, int(appels) if appels is not None else None)
+        if reponse.status_code >= 500:
+            raise ErreurParcours(f"{methode} {url} : HTTP {reponse.status_code}")
+        if suivre and reponse.is_redirect:
+            emplacement = reponse.headers["Location"]
+            decoupe = urlsplit(emplacement)
+            chemin = decoupe.path + (f"?{decoupe.query}" if decoupe.query else "")
+            return self.appel("GET", chemin)
+        return reponse
+
+    def penser(self):
+        if self.pause:
+            time.sleep(self.alea.uniform(0.5, 1.5) * self.pause)
+
+    def connexion(self):
+        self.session.cookies.clear()
+        self.appel("GET", "/login")
+        self.penser()
+        reponse = self.appel("POST", "/login", {"username": self.identifiants[0],
+                                                "password": self.identifiants[1]})
+        if urlsplit(reponse.url).path.endswith("/login"):
+            raise ErreurParcours("connexion refusée (identifiants ?)")
+
+    # --- Parcours ---
+
+    def inscription(self):
+        self.connexion()
+        self.penser()
+        self.appel("GET", "/inscription/selection_type")
+        self.penser()
+        page = self.appel("POST", "/inscription/selection_type",
+                          {"type_inscription": self.alea.choice(TYPES_INSCRIPTION)})
+        classes = [html.unescape(c) for c in re.findall(r'<option value="([^"]+)"', page.text)]
+        if not classes:
+            raise ErreurParcours("aucune classe proposée")
+        self.penser()
+        page = self.appel("POST", "/inscription/selection_classe", {"classe": self.alea.choice(classes)})
+        etudiants = [html.unescape(e) for e in re.findall(r'name="etudiants" value="([^"]*)"', page.text)]
+        if etudiants:
+            self.penser()
+            choisis = self.alea.sample(etudiants, min(len(etudiants), self.alea.randint(1, 4)))
+            self.appel("POST", "/inscription/enregistrer_paiements_lot",
+                       {"etudiants": choisis, "cle_idempotence": uuid.uuid4().hex})
+        self.penser()
+        self.appel("GET", "/inscription/statistiques")
+        self.penser()
+        suivi = self.appel("GET", "/inscription/generer_pdf", suivre=False)
+        statut_url = suivi.headers.get("Location")
+        if not statut_url:
+            raise ErreurParcours("génération du PDF non déposée")
+        statut_url = urlsplit(statut_url).path
+        fin = time.time() + ATTENTE_PDF_MAX
+        while True:
+            etat = self.appel("GET", statut_url, params={"format": "json"}).json()
+            if etat["etat"] == "termine":
+                break
+            if etat["etat"] == "erreur" or time.time() > fin:
+                raise ErreurParcours(f"PDF : {etat.get('erreur') or 'délai dépassé'}")
+            time.sleep(0.2)
+        self.appel("GET", urlsplit(etat["telechargement_url"]).path)
+
+    def consultation(self):
+        self.connexion()  # la connexion aboutit sur le tableau de bord
+        self.penser()
+        recherche = self.alea.choice(RECHERCHES)
+        self.appel("GET", "/historique", params={"recherche": recherche})
+        self.penser()
+        self.appel("GET", "/historique", params={"recherche": recherche, "page": 2})
+
+
+def _utilisateur(numero, args, mesures, parcours, fin):
+    alea = random.Random(args.graine + numero)
+    caissier = Caissier(args.url, mesures, (args.utilisateur, args.mot_de_passe), args.pause, alea)
+    noms, poids = zip(*parcours.items())
+    time.sleep(args.montee * numero / max(args.utilisateurs, 1))
+    while time.time() < fin:
+        nom = alea.choices(noms, poids)[0]
+        try:
+            getattr(caissier, nom)()
+            mesures.fin_parcours(nom, True)
+        except ErreurParcours as e:
+            mesures.fin_parcours(nom, False)
+            if args.verbeux:
+                print(f"  utilisateur {numero}, {nom} : {e}", file=sys.stderr)
+
+
+def _centile(valeurs_triees, p):
+    if not valeurs_triees:
+        return 0.0
+    rang = max(0, min(len(valeurs_triees) - 1, int(round(p / 100 * len(valeurs_triees) + 0.5)) - 1))
+    return valeurs_triees[rang]
+
+
+def resumer(mesures, duree):
+    """{"global": {...}, "routes": {route: {...}}, "parcours": {...}} à partir des requêtes mesurées."""
+    par_route = {}
+    for route, statut, temps, appels in mesures.requetes:
+        par_route.setdefault(route, []).append((statut, temps, appels))
+
+    def stats(lignes):
+        durees = sorted(t for _, t, _ in lignes)
+        appels = [a for _, _, a in lignes if a is not None]
+        return {
+            "requetes": len(lignes),
+            "erreurs": sum(1 for s, _, _ in lignes if s == "erreur" or s >= 500),
+            "debit": round(len(lignes) / duree, 2),
+            "p50": round(_centile(durees, 50), 4),
+            "p95": round(_centile(durees, 95), 4),
+            "p99": round(_centile(durees, 99), 4),
+            "max": round(durees[-1], 4) if durees else 0.0,
+            "appels_sheets": round(sum(appels) / len(appels), 2) if appels else None,
+        }
+
+    toutes = [l for lignes in par_route.values() for l in lignes]
+    return {
+        "duree": round(duree, 1),
+        "global": stats(toutes),
+        "routes": {route: stats(lignes) for route, lignes in sorted(par_route.items())},
+        "parcours": {nom: {"reussis": r, "echoues": e} for nom, (r, e) in mesures.parcours.items()},
+    }
+
+
+def afficher(resume, titre):
+    g = resume["global"]
+    print(f"\n=== {titre} : {g['requetes']} requêtes en {resume['duree']} s, {g['debit']} req/s, "
+          f"{g['erreurs']} erreur(s) ===")
+    for nom, p in resume["parcours"].items():
+        print(f"  parcours {nom} : {p['reussis']} réussi(s), {p['echoues']} échoué(s)")
+    print(f"\n{'route':<46}{'req':>6}{'err':>5}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'appels':>8}")
+    for route, r in list(resume["routes"].items()) + [("TOTAL", g)]:
+        appels = f"{r['appels_sheets']:.2f}" if r["appels_sheets"] is not None else "-"
+        print(f"{route:<46}{r['requetes']:>6}{r['erreurs']:>5}{r['debit']:>8.2f}"
+              f"{r['p50'] * 1000:>7.0f}ms{r['p95'] * 1000:>7.0f}ms{r['p99'] * 1000:>7.0f}ms{appels:>8}")
+
+
+def lancer_charge(args, parcours):
+    debut = time.time() + args.echauffement
+    mesures = Mesures(debut, debut + args.duree)
+    threads = [threading.Thread(target=_utilisateur, args=(i, args, mesures, parcours, mesures.fin), daemon=True)
+               for i in range(args.utilisateurs)]
+    for t in threads:
+        t.start()
+    # Les parcours en cours à l'échéance se terminent, hors mesure
+    for t in threads:
+        t.join(max(0.0, mesures.fin - time.time()) + ATTENTE_PDF_MAX)
+    return resumer(mesures, args.duree)
+
+
+def _attendre_application(url, processus, delai=180):
+    fin = time.time() + delai
+    while time.time() < fin:
+        if processus.poll() is not None:
+            raise RuntimeError("l'application locale s'est arrêtée au démarrage")
+        try:
+            if requests.get(url + "/login", timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("l'application locale ne répond pas")
+
+
+def lancer_configuration(args, parcours, workers, threads):
+    """Démarre benchmarks.serveur_local avec cette configuration, la charge, puis l'arrête."""
+    commande = [sys.executable, "-m", "benchmarks.serveur_local", "--taille", args.taille,
+                "--latence", str(args.latence), "--port", str(args.port), "--serveur", args.serveur,
+                "--workers", str(workers), "--threads", str(threads), "--graine", str(args.graine)]
+    processus = subprocess.Popen(commande, cwd=RACINE)
+    try:
+        _attendre_application(args.url, processus)
+        return lancer_charge(args, parcours)
+    finally:
+        processus.send_signal(signal.SIGTERM)
+        try:
+            processus.wait(30)
+        except subprocess.TimeoutExpired:
+            processus.kill()
+
+
+def _parcours(texte):
+    parcours = {}
+    for element in texte.split(","):
+        nom, _, poids = element.partition("=")
+        if nom not in ("inscription", "consultation"):
+            raise argparse.ArgumentTypeError(f"parcours inconnu : {nom}")
+        parcours[nom] = float(poids or 1)
+    return parcours
+
+
+def _configuration(texte):
+    m = re.fullmatch(r"(\d+)x(\d+)", texte)
+    if m is None:
+        raise argparse.ArgumentTypeError("format attendu : WORKERSxTHREADS, par exemple 2x4")
+    return int(m.group(1)), int(m.group(2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge des parcours de caisse")
+    parser.add_argument("--url", default=None, help="application déjà lancée (sinon lancée localement)")
+    parser.add_argument("--utilisateurs", type=int, default=8, help="utilisateurs virtuels simultanés")
+    parser.add_argument("--duree", type=float, default=60, help="secondes de mesure")
+    parser.add_argument("--echauffement", type=float, default=10, help="secondes non mesurées au début")
+    parser.add_argument("--montee", type=float, default=5, help="secondes pour démarrer tous les utilisateurs")
+    parser.add_argument("--pause", type=float, default=0.0, help="temps de réflexion moyen entre deux pages")
+    parser.add_argument("--parcours", type=_parcours, default=_parcours("inscription=1,consultation=2"),
+                        help="parcours et poids, ex. inscription=1,consultation=2")
+    parser.add_argument("--utilisateur", default="admin")
+    parser.add_argument("--mot-de-passe", default="adminFST@==")
+    parser.add_argument("--graine", type=int, default=42)
+    parser.add_argument("--verbeux", action="store_true", help="afficher les parcours échoués")
+    parser.add_argument("--sortie", help="fichier JSON où écrire les résultats")
+    locale = parser.add_argument_group("application locale (sans --url)")
+    locale.add_argument("--configurations", type=_configuration, nargs="+", default=[(2, 4)],
+                        help="configurations gunicorn WORKERSxTHREADS à comparer")
+    locale.add_argument("--taille", choices=("petit", "moyen", "grand"), default="petit")
+    locale.add_argument("--latence", type=float, default=0.15, help="secondes ajoutées à chaque appel Sheets")
+    locale.add_argument("--port", type=int, default=8765)
+    locale.add_argument("--serveur", choices=("gunicorn", "werkzeug"), default="gunicorn")
+    args = parser.parse_args(argv)
+
+    resultats = {}
+    if args.url:
+        resultats[args.url] = lancer_charge(args, args.parcours)
+        afficher(resultats[args.url], args.url)
+    else:
+        args.url = f"http://127.0.0.1:{args.port}"
+        for workers, threads in args.configurations:
+            nom = f"{workers}x{threads}"
+            resultats[nom] = lancer_configuration(args, args.parcours, workers, threads)
+            afficher(resultats[nom], f"{nom} (workers x threads)")
+        if len(resultats) > 1:
+            print(f"\n{'configuration':<16}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'erreurs':>9}")
+            for nom, r in resultats.items():
+                g = r["global"]
+                print(f"{nom:<16}{g['debit']:>8.2f}{g['p50'] * 1000:>7.0f}ms{g['p95'] * 1000:>7.0f}ms"
+                      f"{g['p99'] * 1000:>7.0f}ms{g['erreurs']:>9}")
+
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as f:
+            json.dump({"parametres": {k: v for k, v in vars(args).items() if k != "mot_de_passe"},
+                       "resultats": resultats}, f, indent=2, ensure_ascii=False, default=str)
+    return 1 if any(r["global"]["erreurs"] for r in resultats.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# benchmarks/donnees.py
+"""
+Jeux de données synthétiques pour le classeur local (sheets_local).
+
+Les feuilles ont les colonnes de storage_gsheets.REQUIRED_SHEETS et des valeurs
+plausibles : noms accentués, montants décimaux, dates étalées sur une année
+académique, une part d'étudiants sans paiement. Pour une même graine, le jeu
+est identique d'une exécution à l'autre.
+
+    feuilles = generer(classes=40, etudiants=60, paiements=20000, depenses=5000)
+    feuilles = generer(**TAILLES["grand"])
+"""
+import random
+from datetime import datetime, timedelta
+
+from app.models.storage_gsheets import REQUIRED_SHEETS
+from app.utils.rapports_lot import TYPES_INSCRIPTION, TYPES_TRAVAUX
+
+# Tailles prédéfinies : nombre total de lignes d'environ 10 k, 100 k et 1 M
+TAILLES = {
+    "petit": {"classes": 20, "etudiants": 50, "paiements": 3000, "depenses": 1000},
+    "moyen": {"classes": 60, "etudiants": 150, "paiements": 40000, "depenses": 10000},
+    "grand": {"classes": 200, "etudiants": 450, "paiements": 400000, "depenses": 100000},
+}
+
+FILIERES = ("Informatique", "Génie civil", "Électronique", "Mécanique", "Architecture",
+            "Chimie industrielle", "Mines", "Télécommunications")
+PRENOMS = ("Amani", "Bénédicte", "Christelle", "Désiré", "Élodie", "Fiston", "Grâce", "Héritier",
+           "Irène", "Jérémie", "Kévin", "Lætitia", "Merveille", "Noëlla", "Olivier", "Patience",
+           "Rébecca", "Sylvain", "Théo", "Zoé")
+NOMS = ("Kabila", "Mukendi", "Tshibanda", "Lukusa", "Kasongo", "Mbuyi", "Ngoy", "Ilunga",
+        "Kalonji", "Mwamba", "Nzuzi", "Bahati", "Kahindo", "Muhindo", "Kavira", "Paluku")
+COURS = ("Analyse", "Algèbre", "Physique", "Programmation", "Bases de données", "Réseaux",
+         "Résistance des matériaux", "Thermodynamique", "Anglais technique", "Statistiques")
+CATEGORIES_PAIEMENT = ("Frais académiques", "Frais de laboratoire", "Bibliothèque", "Enrôlement", "Syllabus")
+CATEGORIES_DEPENSE = ("Examen", "Fournitures", "Transport", "Entretien", "Travail pratique", "Réception")
+DEBUT_ANNEE = datetime(2024, 10, 1)
+
+
+def nb_lignes(feuilles):
+    """Nombre de lignes de données (en-têtes exclus)."""
+    return sum(max(len(lignes) - 1, 0) for lignes in feuilles.values())
+
+
+def _date(alea, heure=True):
+    instant = DEBUT_ANNEE + timedelta(seconds=alea.randrange(300 * 24 * 3600))
+    return instant.strftime("%Y-%m-%d %H:%M:%S" if heure else "%Y-%m-%d")
+
+
+def _montant(alea, minimum, maximum):
+    return round(alea.uniform(minimum, maximum), 2)
+
+
+def _feuille(nom, lignes_dict):
+    colonnes = REQUIRED_SHEETS[nom]
+    return [list(colonnes)] + [[ligne.get(c, "") for c in colonnes] for ligne in lignes_dict]
+
+
+def generer(classes=20, etudiants=50, paiements=3000, depenses=1000, taux_paye=0.7, graine=42):
+    """
+    Retourne {feuille: lignes (en-tête compris)} pour toutes les feuilles requises.
+
+    classes × etudiants lignes dans Classes ; une ligne par étudiant et par type
+    d'inscription (taux_paye d'entre elles payées) dans Paiements_Inscriptions,
+    par type de travail pour un tiers des étudiants dans Paiements_Travaux ;
+    `paiements` lignes dans Paiements, `depenses` dans Depenses, et un dixième
+    de `paiements` dans Recettes et Autres_recettes.
+    """
+    alea = random.Random(graine)
+    noms_classes = [f"L{1 + i % 3} {FILIERES[i // 3 % len(FILIERES)]} {1 + i // (3 * len(FILIERES))}"
+                    for i in range(classes)]
+    effectifs = {}
+    for classe in noms_classes:
+        vus = set()
+        while len(vus) < etudiants:
+            nom = f"{alea.choice(NOMS).upper()} {alea.choice(PRENOMS)}"
+            if nom in vus:
+                nom = f"{nom} {len(vus)}"
+            vus.add(nom)
+        effectifs[classe] = sorted(vus)
+
+    lignes = {nom: [] for nom in REQUIRED_SHEETS}
+    lignes["Classes"] = [{"NomClasse": c, "Etudiant": e} for c, liste in effectifs.items() for e in liste]
+    cours = {c: alea.sample(COURS, 4) for c in noms_classes}
+    lignes["Cours"] = [{"NomClasse": c, "NomCours": nom} for c, liste in cours.items() for nom in liste]
+    lignes["CategoriesPaiement"] = [{"Categorie": c} for c in CATEGORIES_PAIEMENT]
+    lignes["CategoriesDepense"] = [{"Categorie": c} for c in CATEGORIES_DEPENSE]
+
+    for classe, liste in effectifs.items():
+        for etudiant in liste:
+            for type_inscription in TYPES_INSCRIPTION:
+                paye = alea.random() < taux_paye
+                lignes["Paiements_Inscriptions"].append({
+                    "NomClasse": classe, "Etudiant": etudiant, "TypeInscription": type_inscription,
+                    "StatutPaiement": "Payé" if paye else "Non payé", "Montant": 10 if paye else 0,
+                    "DatePaiement": _date(alea) if paye else "",
+                })
+            if alea.random() < 1 / 3:
+                lignes["Paiements_Travaux"].append({
+                    "NomClasse": classe, "Etudiant": etudiant, "TypeTravail": alea.choice(TYPES_TRAVAUX),
+                    "StatutPaiement": "Payé", "Montant": _montant(alea, 20, 150), "DatePaiement": _date(alea),
+                })
+
+    tous = [(c, e) for c, liste in effectifs.items() for e in liste]
+    for i in range(paiements):
+        classe, etudiant = alea.choice(tous)
+        lignes["Paiements"].append({
+            "ID": i + 1, "NomClasse": classe, "Etudiant": etudiant,
+            "CategoriePaiement": alea.choice(CATEGORIES_PAIEMENT), "Montant": _montant(alea, 5, 250),
+            "DatePaiement": _date(alea, heure=False),
+        })
+    for i in range(depenses):
+        classe = alea.choice(noms_classes)
+        examen = alea.random() < 0.4
+        lignes["Depenses"].append({
+            "ID": i + 1, "NomCours": alea.choice(cours[classe]) if examen else "",
+            "CategorieDepense": "Examen" if examen else alea.choice(CATEGORIES_DEPENSE),
+            "Description": f"Dépense {i + 1}", "Montant": _montant(alea, 2, 400), "NomClasse": classe,
+            "TypeDepense": "examen" if examen else "autre", "Commentaire": "",
+            "DateDepense": _date(alea, heure=False), "Utilisateur": "admin",
+        })
+    for i in range(paiements // 10):
+        classe, etudiant = alea.choice(tous)
+        lignes["Recettes"].append({
+            "Date": _date(alea, heure=False), "Source": "Caisse", "Type": alea.choice(CATEGORIES_PAIEMENT),
+            "Description": f"Recette {i + 1}", "Montant": _montant(alea, 5, 300), "NomClasse": classe,
+            "Etudiant": etudiant, "Utilisateur": "admin",
+        })
+        classe, etudiant = alea.choice(tous)
+        lignes["Autres_recettes"].append({
+            "Date": _date(alea, heure=False), "NomClasse": classe, "Etudiant": etudiant,
+            "CategoriePaiement": alea.choice(CATEGORIES_PAIEMENT), "Montant": _montant(alea, 1, 100),
+            "Description": "Versement manuel", "Utilisateur": "caissier",
+        })
+    lignes["Catalogue_Classes"] = [
+        {"NomClasse": c, "NbEtudiants": len(effectifs[c]), "NbCours": len(cours[c]),
+         "DerniereActivite": "2025-06-30 12:00:00"}
+        for c in noms_classes
+    ]
+    return {nom: _feuille(nom, l) for nom, l in lignes.items()}
@@ -0,0 +1,99 @@
+# benchmarks/serveur_local.py
+"""
+Lance l'application sur un classeur local (données synthétiques), pour les tests de charge.
+
+Le classeur est servi en HTTP par ce processus (sheets_local.servir) avec une
+latence simulée par appel ; l'application tourne sous gunicorn avec la
+configuration de production (gunicorn.conf.py : préchargement, post_fork,
+préchauffage), seuls le nombre de workers et de threads changent. Toutes les
+données locales (base SQLite, instantanés partagés, métriques, tâches) vont
+dans un dossier temporaire supprimé à l'arrêt.
+
+    python -m benchmarks.serveur_local --taille moyen --workers 2 --threads 4 --latence 0.15
+    python -m benchmarks.serveur_local --serveur werkzeug      # sans gunicorn (un processus)
+
+Chaque réponse porte l'en-tête X-Appels-Sheets : nombre d'appels à l'API faits
+pour la requête (lu par benchmarks.charge).
+"""
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTETE_APPELS = "X-Appels-Sheets"
+
+
+def application():
+    """Cible gunicorn / werkzeug : l'application branchée sur le classeur servi (SHEETS_LOCAL_URL)."""
+    from benchmarks import sheets_local
+    sheets_local.installer(os.environ["SHEETS_LOCAL_URL"])
+    from app import create_app
+    from app.utils import metriques
+    app = create_app()
+
+    @app.after_request
+    def compter_appels(response):
+        response.headers[ENTETE_APPELS] = str(metriques.appels_requete())
+        return response
+
+    return app
+
+
+def main(argv=None):
+    from benchmarks.bench import isoler
+    parser = argparse.ArgumentParser(description="Application sur classeur local pour les tests de charge")
+    parser.add_argument("--taille", choices=("petit", "moyen", "grand"), default="petit")
+    parser.add_argument("--graine", type=int, default=42)
+    parser.add_argument("--latence", type=float, default=0.15, help="secondes ajoutées à chaque appel Sheets")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--serveur", choices=("gunicorn", "werkzeug"), default="gunicorn",
+                        help="werkzeug : un seul processus, un thread par requête")
+    args = parser.parse_args(argv)
+
+    # Arrêt demandé par benchmarks.charge (SIGTERM) : passer par les finally (gunicorn, dossier)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    dossier = tempfile.mkdtemp(prefix="charge-caisse-")
+    isoler(dossier)
+    try:
+        from benchmarks import donnees, sheets_local
+        feuilles = donnees.generer(**dict(donnees.TAILLES[args.taille], graine=args.graine))
+        serveur_sheets = sheets_local.servir(sheets_local.ClasseurLocal(feuilles, latence=args.latence))
+        os.environ["SHEETS_LOCAL_URL"] = serveur_sheets.url
+        print(f"Classeur local « {args.taille} » ({donnees.nb_lignes(feuilles)} lignes) sur "
+              f"{serveur_sheets.url}, latence {args.latence * 1000:.0f} ms", flush=True)
+
+        if args.serveur == "werkzeug":
+            import logging
+            from werkzeug.serving import run_simple
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)  # pas une ligne par requête
+            from app.models import storage_gsheets
+            app = application()
+            storage_gsheets.demarrer_worker()
+            run_simple("127.0.0.1", args.port, app, threaded=True)
+            return 0
+
+        env = dict(os.environ, PORT=str(args.port), WEB_CONCURRENCY=str(args.workers),
+                   GUNICORN_THREADS=str(args.threads))
+        gunicorn = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{args.port}",
+             "benchmarks.serveur_local:application()"],
+            cwd=RACINE, env=env,
+        )
+        try:
+            return gunicorn.wait()
+        finally:
+            if gunicorn.poll() is None:
+                gunicorn.terminate()
+                gunicorn.wait()
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+# benchmarks/sheets_local.py
+"""
+Classeur Google Sheets local, en mémoire, pour les mesures de performance.
+
+Il remplace Google au niveau de la session HTTP de gspread : tout le reste du
+chemin (gspread, limiteur de quota, disjoncteur, métriques, instantanés) est le
+code réel de l'application. Seules les routes de l'API que gspread appelle pour
+l'application sont servies (ouverture du classeur, métadonnées, values.get /
+append / update / clear / batchGet / batchUpdate, spreadsheets.batchUpdate).
+
+    classeur = ClasseurLocal(donnees.generer(...), latence=0.05)
+    installer(classeur)   # avant le premier accès à storage_gsheets.gc / sh
+
+Pour plusieurs processus (workers gunicorn d'un test de charge), le classeur
+est servi en HTTP par un seul processus et chaque worker s'y adresse :
+
+    serveur = servir(classeur)          # http://127.0.0.1:<port>
+    installer(serveur.url)              # dans chaque processus de l'application
+
+Les valeurs sont rangées en chaînes, comme Google les renvoie (FORMATTED_VALUE).
+`latence` ajoute un délai fixe à chaque appel pour simuler l'aller-retour réseau.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import requests
+
+ID_CLASSEUR = "classeur-local"
+NB_LIGNES_MIN = 1000
+
+_decoder = json.loads  # `json` est aussi le nom d'un paramètre de SessionLocale.request
+
+
+class Reponse:
+    """Réponse HTTP minimale (ce que lisent gspread, APIError et le limiteur de quota)."""
+
+    def __init__(self, status_code, corps):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = "OK" if self.ok else "Error"
+        self.headers = {"Content-Type": "application/json"}
+        self.content = json.dumps(corps, ensure_ascii=False).encode("utf-8")
+        self.text = self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ErreurApi(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def _colonne(lettres):
+    n = 0
+    for c in lettres:
+        n = n * 26 + ord(c) - 64
+    return n
+
+
+def _lettres(n):
+    lettres = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        lettres = chr(65 + r) + lettres
+    return lettres
+
+
+def _decouper_plage(plage):
+    """"'Feuille'!A2:F9" -> ("Feuille", "A2:F9") ; "Feuille" -> ("Feuille", "")."""
+    plage = unquote(plage)
+    if plage.startswith("'"):
+        fin = 1
+        while True:
+            fin = plage.index("'", fin)
+            if plage[fin + 1:fin + 2] == "'":
+                fin += 2
+                continue
+            break
+        titre, reste = plage[1:fin].replace("''", "'"), plage[fin + 1:]
+        return titre, reste[1:] if reste.startswith("!") else ""
+    titre, _, cellules = plage.partition("!")
+    return titre, cellules
+
+
+def _bornes(cellules, nb_lignes, nb_colonnes):
+    """Bornes (ligne1, colonne1, ligne2, colonne2), 1-indexées et incluses, d'une plage A1."""
+    if not cellules:
+        return 1, 1, nb_lignes, nb_colonnes
+    bornes = []
+    for partie in cellules.split(":"):
+        m = re.fullmatch(r"([A-Z]*)(\d*)", partie.upper())
+        if m is None:
+            raise ErreurApi(400, f"Plage invalide : {cellules}")
+        bornes.append((int(m.group(2)) if m.group(2) else None, _colonne(m.group(1)) if m.group(1) else None))
+    (l1, c1), (l2, c2) = bornes[0], bornes[-1]
+    if len(bornes) == 1 and l1 is not None and c1 is not None:
+        return l1, c1, l1, c1
+    return l1 or 1, c1 or 1, l2 or nb_lignes, c2 or nb_colonnes
+
+
+def _texte(valeur):
+    if valeur is None:
+        return ""
+    if isinstance(valeur, bool):
+        return "TRUE" if valeur else "FALSE"
+    if isinstance(valeur, float) and valeur.is_integer():
+        return str(int(valeur))
+    return str(valeur)
+
+
+def _elaguer(lignes):
+    """Comme Google : cellules vides en fin de ligne et lignes vides en fin de plage omises."""
+    resultat = []
+    for ligne in lignes:
+        fin = len(ligne)
+        while fin and ligne[fin - 1] == "":
+            fin -= 1
+        resultat.append(ligne[:fin])
+    while resultat and not resultat[-1]:
+        resultat.pop()
+    return resultat
+
+
+def _plage_ecrite(titre, l1, c1, valeurs):
+    """Corps de réponse d'une écriture (updatedRange...), lu par gspread et storage_gsheets."""
+    largeur = max((len(l) for l in valeurs), default=1)
+    l2, c2 = l1 + max(len(valeurs), 1) - 1, c1 + largeur - 1
+    return {"spreadsheetId": ID_CLASSEUR, "updatedRows": len(valeurs), "updatedColumns": largeur,
+            "updatedCells": sum(len(l) for l in valeurs),
+            "updatedRange": f"'{titre}'!{_lettres(c1)}{l1}:{_lettres(c2)}{l2}"}
+
+
+class Feuille:
+    def __init__(self, id_feuille, titre, lignes, nb_colonnes=None):
+        self.id = id_feuille
+        self.titre = titre
+        self.lignes = [[_texte(v) for v in ligne] for ligne in lignes]
+        largeur = max((len(l) for l in self.lignes), default=0)
+        self.nb_colonnes = max(nb_colonnes or 0, largeur, 1)
+        self.nb_lignes = max(NB_LIGNES_MIN, len(self.lignes))
+
+    def proprietes(self, index):
+        return {"sheetId": self.id, "title": self.titre, "index": index, "sheetType": "GRID",
+                "gridProperties": {"rowCount": self.nb_lignes, "columnCount": self.nb_colonnes}}
+
+    def derniere_ligne(self):
+        fin = len(self.lignes)
+        while fin and not any(self.lignes[fin - 1]):
+            fin -= 1
+        return fin
+
+    def lire(self, cellules):
+        l1, c1, l2, c2 = _bornes(cellules, self.nb_lignes, self.nb_colonnes)
+        return _elaguer([ligne[c1 - 1:c2] for ligne in self.lignes[l1 - 1:l2]])
+
+    def ecrire(self, l1, c1, valeurs):
+        for i, ligne in enumerate(valeurs):
+            num = l1 + i
+            while len(self.lignes) < num:
+                self.lignes.append([])
+            cible = self.lignes[num - 1]
+            fin = c1 - 1 + len(ligne)
+            if len(cible) < fin:
+                cible.extend([""] * (fin - len(cible)))
+            cible[c1 - 1:fin] = [_texte(v) for v in ligne]
+            self.nb_colonnes = max(self.nb_colonnes, fin)
+        self.nb_lignes = max(self.nb_lignes, len(self.lignes))
+
+    def effacer(self, cellules):
+        l1, c1, l2, c2 = _bornes(cellules, self.nb_lignes, self.nb_colonnes)
+        for ligne in self.lignes[l1 - 1:l2]:
+            for c in range(c1 - 1, min(c2, len(ligne))):
+                ligne[c] = ""
+
+
+class ClasseurLocal:
+    """
+    Classeur en mémoire ({titre: lignes, l'en-tête en première ligne}) servant
+    l'API REST de Google Sheets. Partagé par tous les threads du processus.
+    """
+
+    def __init__(self, feuilles=None, titre="ULGLP_Caisse", latence=0.0):
+        self.titre = titre
+        self.latence = latence
+        self.appels = 0
+        self._verrou = threading.Lock()
+        self._feuilles = {}
+        for nom, lignes in (feuilles or {}).items():
+            self.ajouter_feuille(nom, lignes)
+
+    def ajouter_feuille(self, titre, lignes=(), nb_colonnes=None):
+        feuille = Feuille(len(self._feuilles) + 1, titre, lignes, nb_colonnes)
+        self._feuilles[titre] = feuille
+        return feuille
+
+    def lignes(self, titre):
+        """Copie du contenu d'une feuille (pour vérifier les écritures)."""
+        with self._verrou:
+            return [list(l) for l in self._feuilles[titre].lignes]
+
+    def _feuille(self, titre):
+        feuille = self._feuilles.get(titre)
+        if feuille is None:
+            raise ErreurApi(400, f"Unable to parse range: {titre}")
+        return feuille
+
+    # --- Traitement d'une requête ---
+
+    def traiter(self, methode, url, params=None, corps=None):
+        """(code HTTP, corps JSON) pour une requête adressée à l'API Google."""
+        if self.latence:
+            time.sleep(self.latence)
+        methode = methode.upper()
+        params = params or {}
+        with self._verrou:
+            self.appels += 1
+            try:
+                return 200, self._router(methode, url.split("?")[0], params, corps or {})
+            except ErreurApi as e:
+                statut = {400: "INVALID_ARGUMENT", 404: "NOT_FOUND"}.get(e.code, "UNKNOWN")
+                return e.code, {"error": {"code": e.code, "message": str(e), "status": statut}}
+
+    def _router(self, methode, url, params, corps):
+        if "/drive/v3/files" in url:
+            return {"kind": "drive#fileList", "files": [
+                {"id": ID_CLASSEUR, "name": self.titre, "createdTime": "2025-01-01T00:00:00.000Z",
+                 "modifiedTime": "2025-01-01T00:00:00.000Z"}]}
+        chemin = url.split("/v4/spreadsheets/", 1)[-1]
+        identifiant, _, reste = chemin.partition("/")
+        if not reste:
+            if identifiant.endswith(":batchUpdate"):
+                return self._batch_update(corps)
+            return self._metadonnees()
+        if reste == "values:batchGet":
+            plages = params.get("ranges") or []
+            plages = plages if isinstance(plages, list) else [plages]
+            return {"spreadsheetId": ID_CLASSEUR, "valueRanges": [self._valeurs(p) for p in plages]}
+        if reste == "values:batchUpdate":
+            reponses = [self._mettre_a_jour(d["range"], d.get("values", [])) for d in corps.get("data", [])]
+            return {"spreadsheetId": ID_CLASSEUR, "totalUpdatedCells": sum(r["updatedCells"] for r in reponses),
+                    "responses": reponses}
+        if reste == "values:batchClear":
+            for plage in corps.get("ranges", []):
+                self._effacer(plage)
+            return {"spreadsheetId": ID_CLASSEUR, "clearedRanges": corps.get("ranges", [])}
+        plage = reste[len("values/"):]
+        if plage.endswith(":append"):
+            return self._ajouter(plage[:-len(":append")], corps.get("values", []))
+        if plage.endswith(":clear"):
+            return self._effacer(plage[:-len(":clear")])
+        if methode == "GET":
+            return self._valeurs(plage)
+        return self._mettre_a_jour(plage, corps.get("values", []))
+
+    def _metadonnees(self):
+        return {"spreadsheetId": ID_CLASSEUR,
+                "properties": {"title": self.titre, "locale": "fr_FR", "timeZone": "Africa/Kinshasa"},
+                "sheets": [{"properties": f.proprietes(i)} for i, f in enumerate(self._feuilles.values())]}
+
+    def _valeurs(self, plage):
+        titre, cellules = _decouper_plage(plage)
+        feuille = self._feuille(titre)
+        reponse = {"range": f"'{titre}'!{cellules or 'A1:' + _lettres(feuille.nb_colonnes) + str(feuille.nb_lignes)}",
+                   "majorDimension": "ROWS"}
+        valeurs = feuille.lire(cellules)
+        if valeurs:
+            reponse["values"] = valeurs
+        return reponse
+
+    def _mettre_a_jour(self, plage, valeurs):
+        titre, cellules = _decouper_plage(plage)
+        feuille = self._feuille(titre)
+        l1, c1, _, _ = _bornes(cellules or "A1", feuille.nb_lignes, feuille.nb_colonnes)
+        feuille.ecrire(l1, c1, valeurs)
+        return _plage_ecrite(titre, l1, c1, valeurs)
+
+    def _ajouter(self, plage, valeurs):
+        titre, _ = _decouper_plage(plage)
+        feuille = self._feuille(titre)
+        debut = feuille.derniere_ligne() + 1
+        del feuille.lignes[debut - 1:]
+        feuille.ecrire(debut, 1, valeurs)
+        return {"spreadsheetId": ID_CLASSEUR, "tableRange": f"'{titre}'!A1",
+                "updates": _plage_ecrite(titre, debut, 1, valeurs)}
+
+    def _effacer(self, plage):
+        titre, cellules = _decouper_plage(plage)
+        self._feuille(titre).effacer(cellules)
+        return {"spreadsheetId": ID_CLASSEUR, "clearedRange": unquote(plage)}
+
+    def _batch_update(self, corps):
+        reponses = []
+        for demande in corps.get("requests", []):
+            if "addSheet" in demande:
+                proprietes = demande["addSheet"].get("properties", {})
+                titre = proprietes.get("title")
+                if titre in self._feuilles:
+                    raise ErreurApi(400, f"A sheet with the name \"{titre}\" already exists.")
+                grille = proprietes.get("gridProperties", {})
+                feuille = self.ajouter_feuille(titre, nb_colonnes=int(grille.get("columnCount", 26)))
+                reponses.append({"addSheet": {"properties": feuille.proprietes(len(self._feuilles) - 1)}})
+                continue
+            dimension = demande.get("insertDimension") or demande.get("deleteDimension")
+            if dimension and dimension["range"].get("dimension") == "ROWS":
+                feuille = next(f for f in self._feuilles.values() if f.id == dimension["range"]["sheetId"])
+                debut, fin = dimension["range"]["startIndex"], dimension["range"]["endIndex"]
+                if "insertDimension" in demande:
+                    feuille.lignes[debut:debut] = [[] for _ in range(fin - debut)]
+                    feuille.nb_lignes += fin - debut
+                else:
+                    del feuille.lignes[debut:fin]
+            reponses.append({})
+        return {"spreadsheetId": ID_CLASSEUR, "replies": reponses}
+
+
+class SessionLocale:
+    """Tient lieu de session `requests` pour gspread : les appels sont servis par le classeur local."""
+
+    def __init__(self, classeur):
+        self.classeur = classeur
+        self.headers = {}
+
+    def request(self, method, url, params=None, data=None, json=None, files=None, headers=None, timeout=None):
+        if json is None and data:
+            json = _decoder(data)
+        code, corps = self.classeur.traiter(method, url, params, json)
+        return Reponse(code, corps)
+
+    def close(self):
+        pass
+
+
+class SessionDistante(requests.Session):
+    """Session `requests` qui envoie les appels destinés à Google au classeur servi par servir()."""
+
+    def __init__(self, base):
+        super().__init__()
+        self.base = base.rstrip("/")
+
+    def request(self, method, url, *args, **kwargs):
+        decoupe = urlsplit(url)
+        return super().request(method, self.base + decoupe.path, *args, **kwargs)
+
+
+class _Gestionnaire(BaseHTTPRequestHandler):
+    classeur = None
+
+    def _traiter(self):
+        decoupe = urlsplit(self.path)
+        params = {k: v if k == "ranges" or len(v) > 1 else v[0]
+                  for k, v in parse_qs(decoupe.query, keep_blank_values=True).items()}
+        longueur = int(self.headers.get("Content-Length") or 0)
+        corps = _decoder(self.rfile.read(longueur)) if longueur else None
+        code, reponse = self.classeur.traiter(self.command, decoupe.path, params, corps)
+        contenu = json.dumps(reponse, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(contenu)))
+        self.end_headers()
+        self.wfile.write(contenu)
+
+    do_GET = do_POST = do_PUT = _traiter
+
+    def log_message(self, *args):
+        pass
+
+
+def servir(classeur, hote="127.0.0.1", port=0):
+    """
+    Sert le classeur en HTTP dans un thread de fond (port 0 : port libre).
+    Retourne le serveur ; son adresse est dans `serveur.url`.
+    """
+    gestionnaire = type("Gestionnaire", (_Gestionnaire,), {"classeur": classeur})
+    serveur = ThreadingHTTPServer((hote, port), gestionnaire)
+    serveur.daemon_threads = True
+    serveur.url = f"http://{hote}:{serveur.server_address[1]}"
+    threading.Thread(target=serveur.serve_forever, name="sheets-local", daemon=True).start()
+    return serveur
+
+
+def installer(cible):
+    """
+    Branche le classeur local à la place de Google pour le processus courant :
+    gspread.service_account renvoie un client (avec le limiteur de quota de
+    l'application) dont la session est SessionLocale(cible) si `cible` est un
+    ClasseurLocal, SessionDistante(cible) si c'est l'URL d'un classeur servi.
+    À appeler avant la première connexion de storage_gsheets.
+    """
+    import gspread
+
+    def service_account(filename=None, http_client=None, **_):
+        session = SessionDistante(cible) if isinstance(cible, str) else SessionLocale(cible)
+        return gspread.Client(auth=None, session=session, http_client=http_client or gspread.HTTPClient)
+
+    gspread.service_account = service_account
+    return cible
@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+# Lancement : gunicorn -c gunicorn.conf.py 'app:create_app()'
+#
+# L'application est importée une seule fois dans le maître (preload_app) ; les
+# clients Google Sheets sont créés dans chaque worker après le fork, puis le
+# worker vérifie les feuilles et précharge le cache avant de servir.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = 120
+preload_app = True
+
+
+def post_fork(server, worker):
+    from app.models import storage_gsheets
+    storage_gsheets.apres_fork()
+
+
+def post_worker_init(worker):
+    from app.models import storage_gsheets
+    storage_gsheets.demarrer_worker(prechauffage=os.environ.get("PRECHAUFFAGE", "1") != "0")
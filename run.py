@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import webbrowser
 import threading
@@ -10,6 +11,10 @@ def open_browser(port):
     webbrowser.open(url)
 
 if __name__ == "__main__":
+    # Exécutable PyInstaller : les processus du pool de rapports (spawn) relancent
+    # l'exécutable, qui doit alors exécuter leur tâche et non l'application
+    multiprocessing.freeze_support()
+
     # Création de l'application
     app = create_app()
 